@@ -12,17 +12,11 @@ from telegram.ext import (
     filters,
 )
 
-# Import handlers
-from handlers import commands, messages, callbacks
-from logging_config import setup_logging
-
-# Setup logging
-setup_logging()
+# Handlers and services are imported in main(), not here: Whisper worker
+# processes are spawned and re-import this module as __mp_main__, and must
+# not load the handlers and every service singleton along with their model.
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
-load_dotenv()
-
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and send a telegram message to notify the developer."""
@@ -49,15 +43,52 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     await context.bot.send_message(chat_id=admin_id, text=message, parse_mode="HTML")
 
 
+async def post_init(application: Application) -> None:
+    """Connect to the database and start background maintenance and model loading before polling starts."""
+    from utils.database import db
+    from utils.transcriber import transcriber
+
+    await db.connect()
+    db.start_maintenance()
+    transcriber.start_loading()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Release resources once polling has stopped."""
+    from utils.database import db
+    from utils.fingerprint import fingerprint_index
+    from utils.transcriber import transcriber
+
+    await db.close()
+    await fingerprint_index.close()
+    await transcriber.close()
+
+
 def main() -> None:
     """Start the bot."""
+    # Load environment variables from .env file, before the modules below read their settings
+    load_dotenv()
+
+    # Import handlers
+    from handlers import commands, messages, callbacks
+    from logging_config import setup_logging
+
+    # Setup logging
+    setup_logging()
+
     bot_token = os.getenv("BOT_TOKEN")
     if not bot_token:
         logger.critical("BOT_TOKEN environment variable not set!")
         return
 
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(bot_token).build()
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # --- Register all handlers here ---
     application.add_error_handler(error_handler)
@@ -65,6 +96,7 @@ def main() -> None:
     # Command handlers
     application.add_handler(CommandHandler("start", commands.start))
     application.add_handler(CommandHandler("stats", commands.stats))
+    application.add_handler(CommandHandler("metrics", commands.metrics))
 
     # Message handlers
     application.add_handler(MessageHandler(filters.CONTACT, messages.handle_contact))
@@ -1,8 +1,10 @@
 import logging
+from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from utils.database import db
 from utils.downloader import downloader
+from utils.file_ids import file_ids
 from utils.recognizer import music_recognizer
 from utils.transcriber import transcriber
 
@@ -70,18 +72,19 @@ async def handle_download_music_callback(query, data: str) -> None:
             await query.edit_message_text("❌ Qo'shiq topilmadi")
             return
         
-        # Download audio
+        # Send by file_id if this track was uploaded before, otherwise download it
+        source_key = file_ids.track_key(music_info)
+        tags = {'title': music_info['title'], 'performer': music_info['artist']}
+        if await file_ids.send(query.message, 'audio', source_key, None, **tags):
+            return
+
         audio_info = await downloader.download_audio(
             music_info['url'],
             f"{music_info['title']} - {music_info['artist']}"
         )
         
         if audio_info:
-            await query.message.reply_audio(
-                InputFile(audio_info['filename']),
-                title=music_info['title'],
-                performer=music_info['artist']
-            )
+            await file_ids.send(query.message, 'audio', source_key, Path(audio_info['filename']), **tags)
         else:
             await query.edit_message_text("❌ Qo'shiq yuklanishda xatolik yuz berdi")
             
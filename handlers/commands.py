@@ -3,6 +3,16 @@ import os
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 from utils.database import db
+from utils.media_cache import media_cache
+from utils.file_ids import file_ids
+from utils.media import media_preparer
+from utils.recognition_cache import recognition_cache
+from utils.transcript_cache import transcript_cache
+from utils.fingerprint import fingerprint_index
+from utils.downloader import downloader
+from utils.scheduler import download_scheduler
+from utils.recognizer import music_recognizer
+from utils.transcriber import transcriber
 from utils.helpers import helpers
 
 logger = logging.getLogger(__name__)
@@ -47,12 +57,72 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Get bot statistics
     stats = await db.get_bot_stats()
     
+    by_type = "".join(
+        f"\n   • {action_type}: {count}" for action_type, count in stats.get('actions_by_type', {}).items()
+    )
+
     await update.message.reply_text(
         f"📊 Bot Statistikasi:\n\n"
         f"👥 Umumiy foydalanuvchilar: {stats['total_users']}\n"
         f"🆕 Bugun qo'shilganlar: {stats['new_today']}\n"
-        f"📊 Umumiy ishlatilgan xizmatlar: {stats['total_actions']}",
-        parse_mode='Markdown'
+        f"📊 Umumiy ishlatilgan xizmatlar: {stats['total_actions']}{by_type}"
+    )
+
+async def metrics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /metrics command with runtime performance counters."""
+    admin_id = int(os.getenv('ADMIN_ID', 0))
+    if update.effective_user.id != admin_id:
+        await update.message.reply_text("Bu buyruq faqat admin uchun")
+        return
+
+    pool = db.get_pool_metrics()
+    buffer = db.get_buffer_metrics()
+    user_cache = db.get_cache_metrics()
+    retention = db.get_retention_metrics()
+    media = media_cache.stats()
+    uploads = file_ids.stats()
+    recognitions = recognition_cache.stats()
+    transcripts = transcript_cache.stats()
+    local = fingerprint_index.stats()
+    shazam = music_recognizer.guard.stats()
+    whisper = transcriber.get_model_metrics()
+    downloads = download_scheduler.stats()
+    flights = [downloader.video_flights, media_preparer.flights, music_recognizer.flights, transcriber.flights]
+    coalesced = ", ".join(f"{f.name}: {f.stats()['coalesced']}" for f in flights)
+
+    await update.message.reply_text(
+        f"⚙️ Ish ko'rsatkichlari:\n\n"
+        f"🗄 DB ({db.backend_name}): {pool['in_use']}/{pool['pool_size']} band, {pool['waiting']} navbatda\n"
+        f"⏱ Ulanish kutish: o'rtacha {pool['wait_avg_ms']:.1f} ms, maks {pool['wait_max_ms']:.1f} ms\n"
+        f"⛔️ Kutish tugagan so'rovlar: {pool['timeouts']}\n"
+        f"📝 Yozish buferi: {buffer['pending_users']} foydalanuvchi, {buffer['pending_actions']} amal kutmoqda, "
+        f"{buffer['flushes']} ta yozish, {buffer['dropped']} ta tashlab yuborilgan\n"
+        f"👤 Foydalanuvchi keshi: {user_cache['size']}/{user_cache['maxsize']}, "
+        f"{user_cache['hits']} hit / {user_cache['misses']} miss ({user_cache['hit_rate']:.0%})\n"
+        f"🧹 Statistika saqlash: {retention['retention_days'] or '∞'} kun, "
+        f"{retention['rows_archived']} qator arxivlangan, {retention['partitions_dropped']} bo'lim o'chirilgan\n"
+        f"🎬 Media keshi: {media['entries']} fayl, {media['bytes'] / 1048576:.0f}/{media['max_bytes'] / 1048576:.0f} MB, "
+        f"{media['hits']} hit / {media['misses']} miss ({media['hit_rate']:.0%})\n"
+        f"📤 Yuborishlar: {uploads['reused']} file_id orqali, {uploads['uploaded']} yuklangan, "
+        f"{uploads['rejected']} rad etilgan file_id\n"
+        f"🎵 Aniqlash keshi: {recognitions['hits']} topilgan, {recognitions['negative_hits']} musiqasiz, "
+        f"{recognitions['misses']} miss ({recognitions['hit_rate']:.0%})\n"
+        f"🔎 Mahalliy indeks: {local['hits']} topilgan / {local['misses']} miss, {local['indexed']} klip indekslangan\n"
+        f"🛡 Shazam: holat {shazam['state']}, {shazam['calls']} so'rov, {shazam['failures']} xato, "
+        f"{shazam['retries']} qayta urinish ({shazam['retries_denied']} rad etilgan), "
+        f"{shazam['short_circuited']} tez rad etilgan, {shazam['waiting']} navbatda, {shazam['rejected']} navbatdan rad etilgan\n"
+        f"🗣 Whisper ({whisper['model']}, {whisper['compute_type']}): {whisper['ready']}/{whisper['processes']} jarayon tayyor, "
+        f"{whisper['running']} ishlamoqda, {whisper['waiting']}/{whisper['queue_limit']} navbatda, "
+        f"{whisper['rejected']} rad etilgan, kutish o'rtacha {whisper['wait_avg_ms']:.0f} ms, "
+        f"paket o'rtacha {whisper['batch_avg']:.1f}/{whisper['batch_size']}, "
+        f"yuklash {whisper['load_seconds']:.1f} s, qizdirish {whisper['warmup_seconds']:.1f} s, "
+        f"{whisper['rss_bytes'] / 1048576:.0f} MB xotira\n"
+        f"📝 Transkripsiya keshi: {transcripts['hits']} topilgan / {transcripts['misses']} miss "
+        f"({transcripts['hit_rate']:.0%}), {transcripts['evicted']} chiqarilgan\n"
+        f"🔗 Birlashtirilgan so'rovlar: {coalesced}\n"
+        f"⬇️ Yuklab olish: {downloads['running']}/{downloads['workers']} ishlamoqda, "
+        f"{downloads['waiting']}/{downloads['queue_limit']} navbatda, {downloads['rejected']} rad etilgan, "
+        f"kutish o'rtacha {downloads['wait_avg_ms']:.0f} ms, maks {downloads['wait_max_ms']:.0f} ms"
     )
 
 async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
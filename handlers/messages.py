@@ -1,16 +1,87 @@
+import asyncio
 import logging
 from pathlib import Path
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message, InputFile, ReplyKeyboardRemove
+from typing import Optional
+from uuid import uuid4
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message, ReplyKeyboardRemove
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 from utils.database import db
-from utils.downloader import downloader
+from utils.downloader import downloader, DownloadRejected
+from utils.file_ids import file_ids
+from utils.media_cache import media_cache
+from utils.scheduler import QueueFullError
+from utils.resilience import ServiceUnavailable
 from utils.recognizer import music_recognizer
+from utils.recognition_cache import recognition_cache
 from utils.transcriber import transcriber
+from utils.whisper_pool import TranscriptionQueueFull
 from utils.helpers import helpers
+from utils.media import PreparedMedia, media_preparer, MEMORY_LIMIT
 
 logger = logging.getLogger(__name__)
 
+RECOGNITION_UNAVAILABLE = "⏳ Musiqani aniqlash xizmati hozir band. Iltimos, birozdan so'ng qayta urinib ko'ring."
+TRANSCRIPTION_BUSY = "⏳ Hozir matnga o'girish navbati juda uzun. Iltimos, birozdan so'ng qayta urinib ko'ring."
+# Telegram allows about one edit per second per chat; partial transcripts are shown at most this often
+TRANSCRIPT_EDIT_INTERVAL = float(os.getenv('TRANSCRIPT_EDIT_INTERVAL', 3))
+MESSAGE_LIMIT = 4096
+
+def with_wait_estimate(text: str, duration: float) -> str:
+    """Add the expected queueing time to a status message when it is noticeable."""
+    wait = transcriber.estimate_wait(duration)
+    return f"{text} (taxminan {wait:.0f} soniya navbat)" if wait >= 5 else text
+
+async def edit_quietly(message: Message, text: str) -> None:
+    """Edit a message, logging instead of raising when Telegram refuses (e.g. too many edits)."""
+    try:
+        await message.edit_text(text)
+    except TelegramError as e:
+        logger.warning(f"Could not edit message: {e}")
+
+async def send_transcript(message: Message, transcript: str, reply: Optional[Message] = None) -> None:
+    """Show a finished transcript in reply (or a new reply), continued in more messages past Telegram's limit."""
+    text = f"📝 Transkripsiya natijasi:\n\n{transcript}"
+    if reply:
+        await edit_quietly(reply, text[:MESSAGE_LIMIT])
+    else:
+        await message.reply_text(text[:MESSAGE_LIMIT])
+    for start in range(MESSAGE_LIMIT, len(text), MESSAGE_LIMIT):
+        await message.reply_text(text[start:start + MESSAGE_LIMIT])
+
+async def reply_transcript(message: Message, media: PreparedMedia, status_text: str, failure_text: str,
+                           cache_key: Optional[str] = None) -> None:
+    """Transcribe media into one reply, edited with the text so far while segments are decoded."""
+    reply = await message.reply_text(with_wait_estimate(status_text, media.duration))
+    segments = []
+    updated = asyncio.Event()
+
+    def on_segment(text: str) -> None:
+        segments.append(text)
+        updated.set()
+
+    async def show_progress() -> None:
+        while True:
+            await updated.wait()
+            updated.clear()
+            partial = "".join(segments).strip()
+            if len(partial) > MESSAGE_LIMIT - len(status_text) - 10:
+                partial = "…" + partial[-(MESSAGE_LIMIT - len(status_text) - 10):]
+            await edit_quietly(reply, f"{status_text}\n\n{partial}")
+            await asyncio.sleep(TRANSCRIPT_EDIT_INTERVAL)
+
+    progress = asyncio.create_task(show_progress())
+    try:
+        transcript = await transcriber.transcribe_audio(media, on_segment=on_segment, cache_key=cache_key)
+    finally:
+        progress.cancel()
+
+    if not transcript:
+        await edit_quietly(reply, failure_text)
+        return
+    await send_transcript(message, transcript, reply)
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle a text message, which could be a command or a URL."""
     await db.add_user(update.effective_user)
@@ -45,45 +116,94 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await message.reply_text("❌ Foydalanuvchi xatoligi: Foydalanuvchi xabari tushuntirilmagan")
         return
     
+    max_size = 25 * 1024 * 1024  # 25MB
+    max_duration = transcriber.max_duration
+
+    # Telegram reports size and duration up front, so oversized files are never downloaded
+    errors = helpers.check_limits(file_info.file_size or 0, getattr(file_info, 'duration', None), max_size, max_duration)
+    if errors:
+        await message.reply_text("❌ Xatolik: " + ". ".join(errors))
+        return
+
+    media_key = get_media_key(message)
+    file_path = None
     try:
-        # Download file
+        # A forwarded copy of a file recognized before needs no download at all
+        found, music_info = await recognition_cache.get(f"tg:{media_key}")
+        if found and music_info:
+            await message.reply_text("🎵 Qo'shiq topildi. Yuklanmoqda...")
+            await send_track(message, music_info)
+            return
+        # Known to hold no music and already transcribed: answer without downloading either
+        transcript = await transcriber.cached_transcript(f"tg:{media_key}") if found else None
+        if transcript:
+            await send_transcript(message, transcript)
+            return
+
         file = await context.bot.get_file(file_info.file_id)
-        file_path = await file.download_to_drive()
-        
-        # Validate file
-        validation = helpers.validate_file(
-            Path(file_path),
-            max_size=25 * 1024 * 1024,  # 25MB
-            max_duration=300  # 5 minutes
-        )
-        
-        if not validation['valid']:
-            await message.reply_text("❌ Xatolik: " + ". ".join(validation['errors']))
+        if file_info.file_size and file_info.file_size <= MEMORY_LIMIT:
+            # Small files never touch the disk: ffmpeg decodes them over pipes
+            source = bytes(await file.download_as_bytearray())
+            size = len(source)
+        else:
+            # Download file under a unique name, so concurrent uploads never collide
+            suffix = Path(file.file_path or '').suffix
+            file_path = await file.download_to_drive(custom_path=downloader.temp_dir / f"{uuid4().hex}{suffix}")
+            source = Path(file_path)
+            size = source.stat().st_size
+
+        # Decode once; recognition and transcription both work from the result
+        media = await media_preparer.prepare(source, key=media_key)
+        if not media:
+            await message.reply_text("❌ Faylda audio topilmadi.")
             return
-        
+
+        # Validate file against its real size and decoded length
+        errors = helpers.check_limits(size, media.duration, max_size, max_duration)
+        if errors:
+            await message.reply_text("❌ Xatolik: " + ". ".join(errors))
+            return
+
         # Process based on file type
-        try:
-            if message.audio or message.voice:
-                await process_audio(message, file_path)
-            elif message.video:
-                await process_video(message, file_path)
-        finally:
-            await downloader.cleanup_file(file_path)
-        
+        if message.audio or message.voice:
+            await process_audio(message, media)
+        elif message.video:
+            await process_video(message, media)
+
     except Exception as e:
         logger.error(f"Error processing media: {str(e)}")
         await message.reply_text("❌ Xatolik yuz berdi. Iltimos, keyinroq urinib ko'ring.")
+    finally:
+        if file_path:
+            await downloader.cleanup_file(file_path)
+
+def get_media_key(message: Message) -> Optional[str]:
+    """Identify an uploaded file across messages, so forwarded copies share work."""
+    media = message.audio or message.voice or message.video
+    return media.file_unique_id if media else None
 
 async def process_url(message: Message, url: str) -> None:
     """Process URL message."""
     status_message = await message.reply_text("⏳ Havolani tekshirmoqdaman...")
     video_info = None  # Initialize video_info to None
+    sent = None
     try:
-        # Download video
+        # Download video while the small audio-only stream is fetched and recognized
         await status_message.edit_text("⏳ Videoni yuklab olmoqdaman...")
-        video_info = await downloader.download_video(url)
+        recognition = asyncio.create_task(music_recognizer.recognize_url(url))
+        try:
+            # A link uploaded before is re-sent by file_id, without downloading the video again
+            sent = await file_ids.send(
+                message, 'video', f"video:{await media_cache.resolve_key(url)}", None,
+                caption="✅ Video muvaffaqiyatli yuklandi"
+            )
+            if not sent:
+                video_info = await downloader.download_video(url)
+        finally:
+            if not sent and not video_info:
+                recognition.cancel()
 
-        if not video_info:
+        if not sent and not video_info:
             await status_message.edit_text(
                 "❌ Havoladan video yuklab bo'lmadi.\n\n"
                 "Instagram kabi ba'zi saytlar havoladan to'g'ridan-to'g'ri yuklashni cheklashi mumkin. "
@@ -93,16 +213,30 @@ async def process_url(message: Message, url: str) -> None:
 
         # Recognize music
         await status_message.edit_text("🎵 Musiqani qidirmoqdaman...")
-        music_info = await music_recognizer.recognize_music(Path(video_info['filename']))
+        recognition_unavailable = False
+        try:
+            media, music_info = await recognition
+            if not media:
+                # No separate audio stream: decode the video once for recognition and transcription
+                if not video_info:
+                    video_info = await downloader.download_video(url)
+                if video_info:
+                    media = await media_preparer.prepare(Path(video_info['filename']), key=f"video:{video_info['cache_key']}")
+                if media:
+                    music_info = await music_recognizer.recognize_music(media)
+        except ServiceUnavailable as e:
+            logger.warning(f"Music recognition unavailable for {url}: {e}")
+            media, music_info = None, None
+            recognition_unavailable = True
 
         # Delete status message
         await status_message.delete()
 
-        # Send video
-        await message.reply_video(
-            InputFile(video_info['filename']),
-            caption=f"✅ Video muvaffaqiyatli yuklandi: {video_info['title']}"
-        )
+        if not sent:
+            await file_ids.send(
+                message, 'video', f"video:{video_info['cache_key']}", Path(video_info['filename']),
+                caption=f"✅ Video muvaffaqiyatli yuklandi: {video_info['title']}"
+            )
 
         # If music found, send info with download button
         if music_info:
@@ -116,101 +250,109 @@ async def process_url(message: Message, url: str) -> None:
                 f"🎵 Qo'shiq topildi: {music_info['title']} - {music_info['artist']}",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+        elif recognition_unavailable:
+            await message.reply_text(RECOGNITION_UNAVAILABLE)
         else:
             # If no music, try to transcribe
-            await message.reply_text("📝 Videodagi nutq matnga o'girilmoqda...")
-            transcript = await transcriber.transcribe_audio(Path(video_info['filename']))
-            if transcript:
-                await message.reply_text(f"📝 Transkripsiya natijasi:\n\n{transcript}")
+            no_result = "ℹ️ Ushbu videoda taniqli musiqa yoki nutq topilmadi."
+            if media:
+                await reply_transcript(message, media, "📝 Videodagi nutq matnga o'girilmoqda...", no_result)
             else:
-                await message.reply_text("ℹ️ Ushbu videoda taniqli musiqa yoki nutq topilmadi.")
+                await message.reply_text(no_result)
 
+    except DownloadRejected as e:
+        if e.reason == 'too_long':
+            text = f"❌ Video juda uzun. {downloader.max_video_duration // 60} daqiqagacha bo'lgan videolarni yuklay olaman."
+        else:
+            text = "❌ Video juda katta. Telegram orqali 50 MB gacha yuborish mumkin, bu videoning mos sifati topilmadi."
+        await status_message.edit_text(text)
+    except TranscriptionQueueFull:
+        await message.reply_text(TRANSCRIPTION_BUSY)
+    except QueueFullError:
+        await status_message.edit_text("⏳ Hozir juda ko'p yuklab olish navbatda. Iltimos, birozdan so'ng qayta urinib ko'ring.")
     except Exception as e:
         logger.error(f"Error processing URL: {str(e)}")
         await message.reply_text("❌ Xatolik yuz berdi. Iltimos, keyinroq urinib ko'ring.")
     finally:
-        # Cleanup downloaded file
-        if 'video_info' in locals() and video_info and 'filename' in video_info:
-            await downloader.cleanup_file(video_info['filename'])
+        # The file stays in the media cache for repeated links
+        if video_info:
+            downloader.release_video(video_info)
 
-async def process_audio(message: Message, file_path: str) -> None:
+async def process_audio(message: Message, media: PreparedMedia) -> None:
     """Process audio/voice message."""
     try:
         # First try to recognize music
         await message.reply_text("🎵 Musiqani qidirmoqdaman...")
-        music_info = await music_recognizer.recognize_music(Path(file_path))
+        music_info = await music_recognizer.recognize_music(media, cache_key=f"tg:{get_media_key(message)}")
         
         if music_info:
             # Try to find and download the music
             await message.reply_text("🎵 Qo'shiq topildi. Yuklanmoqda...")
-            
-            # Download audio
-            audio_info = await downloader.download_audio(
-                music_info['url'],
-                f"{music_info['title']} - {music_info['artist']}"
-            )
-            
-            if audio_info:
-                await message.reply_audio(
-                    InputFile(audio_info['filename']),
-                    title=music_info['title'],
-                    performer=music_info['artist']
-                )
-            else:
-                await message.reply_text("❌ Qo'shiq yuklanishda xatolik yuz berdi")
+            await send_track(message, music_info)
         else:
             # If no music found, try transcription
-            await message.reply_text("📝 Matnga o'girilmoqda...")
-            transcript = await transcriber.transcribe_audio(Path(file_path))
-            
-            if transcript:
-                await message.reply_text(f"📝 Transkripsiya natijasi:\n\n{transcript}")
-            else:
-                await message.reply_text("❌ Transkripsiya qilishda xatolik yuz berdi")
+            await reply_transcript(
+                message, media, "📝 Matnga o'girilmoqda...", "❌ Transkripsiya qilishda xatolik yuz berdi",
+                cache_key=f"tg:{get_media_key(message)}"
+            )
                 
+    except ServiceUnavailable as e:
+        # Transcribing what may well be music would only waste Whisper time; ask to retry instead
+        logger.warning(f"Music recognition unavailable: {e}")
+        await message.reply_text(RECOGNITION_UNAVAILABLE)
+    except TranscriptionQueueFull:
+        await message.reply_text(TRANSCRIPTION_BUSY)
     except Exception as e:
         logger.error(f"Error processing audio: {str(e)}")
         await message.reply_text("❌ Xatolik yuz berdi. Iltimos, keyinroq urinib ko'ring.")
 
-async def process_video(message: Message, file_path: str) -> None:
+async def process_video(message: Message, media: PreparedMedia) -> None:
     """Process video message."""
     try:
         # First try to recognize music
         await message.reply_text("🎵 Musiqani qidirmoqdaman...")
-        music_info = await music_recognizer.recognize_music(Path(file_path))
+        music_info = await music_recognizer.recognize_music(media, cache_key=f"tg:{get_media_key(message)}")
         
         if music_info:
             # Try to find and download the music
             await message.reply_text("🎵 Qo'shiq topildi. Yuklanmoqda...")
-            
-            # Download audio
-            audio_info = await downloader.download_audio(
-                music_info['url'],
-                f"{music_info['title']} - {music_info['artist']}"
-            )
-            
-            if audio_info:
-                await message.reply_audio(
-                    InputFile(audio_info['filename']),
-                    title=music_info['title'],
-                    performer=music_info['artist']
-                )
-            else:
-                await message.reply_text("❌ Qo'shiq yuklanishda xatolik yuz berdi")
+            await send_track(message, music_info)
         else:
             # If no music found, try transcription
-            await message.reply_text("📝 Matnga o'girilmoqda...")
-            transcript = await transcriber.transcribe_audio(Path(file_path))
-            
-            if transcript:
-                await message.reply_text(f"📝 Transkripsiya natijasi:\n\n{transcript}")
-            else:
-                await message.reply_text("❌ Transkripsiya qilishda xatolik yuz berdi")
+            await reply_transcript(
+                message, media, "📝 Matnga o'girilmoqda...", "❌ Transkripsiya qilishda xatolik yuz berdi",
+                cache_key=f"tg:{get_media_key(message)}"
+            )
                 
+    except ServiceUnavailable as e:
+        # Transcribing what may well be music would only waste Whisper time; ask to retry instead
+        logger.warning(f"Music recognition unavailable: {e}")
+        await message.reply_text(RECOGNITION_UNAVAILABLE)
+    except TranscriptionQueueFull:
+        await message.reply_text(TRANSCRIPTION_BUSY)
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
         await message.reply_text("❌ Xatolik yuz berdi. Iltimos, keyinroq urinib ko'ring.")
 
+async def send_track(message: Message, music_info: dict) -> None:
+    """Send a recognized track, re-using an earlier upload before downloading it."""
+    source_key = file_ids.track_key(music_info)
+    tags = {'title': music_info['title'], 'performer': music_info['artist']}
+
+    if await file_ids.send(message, 'audio', source_key, None, **tags):
+        return
+
+    # Download audio
+    audio_info = await downloader.download_audio(
+        music_info['url'],
+        f"{music_info['title']} - {music_info['artist']}"
+    )
+
+    if audio_info:
+        await file_ids.send(message, 'audio', source_key, Path(audio_info['filename']), **tags)
+    else:
+        await message.reply_text("❌ Qo'shiq yuklanishda xatolik yuz berdi")
+
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle incoming contact message."""
     contact = update.message.contact
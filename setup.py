@@ -35,6 +35,7 @@ setup(
     entry_points={
         'console_scripts': [
             'vortexfetchbot=bot:main',
+            'vortexfetchbot-migrate=utils.migrations:main',
         ],
     },
 )
@@ -0,0 +1,31 @@
+import unittest
+from unittest.mock import patch
+from utils.cache import LRUCache
+
+class TestLRUCache(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'b' is now the oldest
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['evictions'], stats['hits'], stats['misses']), (2, 1, 3, 1))
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = LRUCache(maxsize=10, ttl=60)
+        with patch('utils.cache.time.monotonic', return_value=1000.0):
+            cache.set('default', 1)
+            cache.set('short', 2, ttl=5)
+        with patch('utils.cache.time.monotonic', return_value=1010.0):
+            self.assertEqual(cache.get('default'), 1)
+            self.assertEqual(cache.get('short', 'gone'), 'gone')
+        with patch('utils.cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('default'))
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
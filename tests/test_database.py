@@ -0,0 +1,261 @@
+import os
+import asyncio
+import time
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+from telegram import User
+from utils.database import Database
+from utils.migrations import LATEST_VERSION, MIGRATIONS, migrate
+from utils.storage import StorageError, TransientStorageError
+
+class TestDatabase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        env = {
+            'DB_BACKEND': 'sqlite',
+            'SQLITE_PATH': os.path.join(self.tmp.name, 'bot.db'),
+            'DB_FLUSH_INTERVAL': '60',
+        }
+        with patch.dict(os.environ, env):
+            self.db = Database()
+            await self.db.connect()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmp.cleanup()
+
+    async def test_schema_is_migrated_once(self):
+        self.assertEqual(await self.db.backend.get_schema_version(), LATEST_VERSION)
+
+        with patch.object(self.db.backend, 'apply_migration') as apply_migration:
+            await self.db.close()
+            with patch.dict(os.environ, {'DB_BACKEND': 'sqlite', 'SQLITE_PATH': os.path.join(self.tmp.name, 'bot.db')}):
+                self.db = Database()
+                await self.db.connect()
+        apply_migration.assert_not_called()
+
+    async def test_offline_migrations_are_left_to_the_migrate_command(self):
+        env = {'DB_BACKEND': 'sqlite', 'SQLITE_PATH': os.path.join(self.tmp.name, 'bot.db')}
+        migrations = MIGRATIONS + [
+            {'version': LATEST_VERSION + 1, 'description': 'Online', 'sqlite': ["CREATE TABLE online (a)"]},
+            {'version': LATEST_VERSION + 2, 'description': 'Heavy', 'offline': True, 'sqlite': ["CREATE TABLE heavy (a)"]},
+        ]
+        await self.db.close()
+        with patch('utils.migrations.MIGRATIONS', migrations), \
+                patch('utils.migrations.LATEST_VERSION', LATEST_VERSION + 2), patch.dict(os.environ, env):
+            self.db = Database()
+            # The online migration before it is still applied
+            with self.assertRaisesRegex(StorageError, f"at version {LATEST_VERSION + 1} and migration {LATEST_VERSION + 2}"):
+                await self.db.connect()
+
+            await migrate()
+            self.db = Database()
+            await self.db.connect()
+            self.assertEqual(await self.db.backend.get_schema_version(), LATEST_VERSION + 2)
+
+    async def test_add_user_is_buffered_until_flush(self):
+        user = User(id=1, first_name="Test", is_bot=False, username="tester")
+        await self.db.add_user(user)
+        self.assertEqual(self.db.get_buffer_metrics()['pending_users'], 1)
+
+        await self.db.flush()
+
+        self.assertEqual(self.db.get_buffer_metrics()['pending_users'], 0)
+        row = await self.db.backend.get_user(1)
+        self.assertEqual(row['username'], "tester")
+
+    async def test_full_batch_is_flushed_without_waiting_for_the_interval(self):
+        self.db.batch_size = 3
+        for user_id in (20, 20, 21):
+            await self.db.log_action(user_id, 'media')
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.db.get_buffer_metrics()['pending_actions'], 0)
+        self.assertEqual((await self.db.get_user_stats(20))['total_actions'], 2)
+
+    async def test_failed_flush_is_requeued_or_dropped(self):
+        await self.db.add_user(User(id=22, first_name="Old", is_bot=False))
+        await self.db.log_action(22, 'media')
+        with patch.object(self.db.backend, 'write_batch', AsyncMock(side_effect=TransientStorageError("busy"))):
+            await self.db.flush()
+        # A newer profile written meanwhile wins over the failed one
+        await self.db.add_user(User(id=22, first_name="New", is_bot=False))
+        await self.db.log_action(22, 'url')
+        metrics = self.db.get_buffer_metrics()
+        self.assertEqual((metrics['pending_users'], metrics['pending_actions']), (1, 2))
+        self.assertEqual([action for _, action, _ in self.db._pending_actions], ['media', 'url'])
+
+        await self.db.flush()
+        self.assertEqual((await self.db.backend.get_user(22))['first_name'], "New")
+        self.assertEqual((await self.db.get_user_stats(22))['total_actions'], 2)
+
+        self.db.buffer_limit = 2
+        for _ in range(3):
+            await self.db.log_action(22, 'media')
+        with patch.object(self.db.backend, 'write_batch', AsyncMock(side_effect=TransientStorageError("busy"))):
+            await self.db.flush()
+        self.assertEqual(self.db.get_buffer_metrics()['pending_actions'], 2)
+
+        with patch.object(self.db.backend, 'write_batch', AsyncMock(side_effect=StorageError("bad row"))):
+            await self.db.flush()
+        metrics = self.db.get_buffer_metrics()
+        self.assertEqual((metrics['pending_actions'], metrics['dropped']), (0, 3))
+
+    async def test_unchanged_profile_skips_upsert(self):
+        user = User(id=2, first_name="Test", is_bot=False)
+        await self.db.add_user(user)
+        await self.db.flush()
+        await self.db.add_user(user)
+
+        self.assertEqual(self.db.get_buffer_metrics()['pending_users'], 0)
+        self.assertEqual(self.db.get_cache_metrics()['hits'], 1)
+
+        await self.db.add_user(User(id=2, first_name="Renamed", is_bot=False))
+        self.assertEqual(self.db.get_buffer_metrics()['pending_users'], 1)
+
+    async def test_stale_last_active_is_written_again(self):
+        user = User(id=23, first_name="Test", is_bot=False)
+        with patch('utils.database.time.monotonic', return_value=1000.0):
+            await self.db.add_user(user)
+        await self.db.flush()
+        with patch('utils.database.time.monotonic', return_value=1000.0 + self.db.last_active_granularity - 1):
+            await self.db.add_user(user)
+        self.assertEqual(self.db.get_buffer_metrics()['pending_users'], 0)
+
+        with patch('utils.database.time.monotonic', return_value=1000.0 + self.db.last_active_granularity):
+            await self.db.add_user(user)
+        self.assertEqual(self.db.get_buffer_metrics()['pending_users'], 1)
+
+    async def test_get_user_reads_pending_write_and_caches_phone(self):
+        await self.db.add_user(User(id=3, first_name="Test", is_bot=False))
+        await self.db.save_phone_number(3, "+998901234567")
+
+        user_data = await self.db.get_user(3)
+        self.assertEqual(user_data['phone_number'], "+998901234567")
+
+        misses = self.db.get_cache_metrics()['misses']
+        await self.db.get_user(3)
+        self.assertEqual(self.db.get_cache_metrics()['misses'], misses)
+
+    async def test_stats_come_from_rollups(self):
+        await self.db.add_user(User(id=4, first_name="A", is_bot=False))
+        await self.db.add_user(User(id=5, first_name="B", is_bot=False))
+        for user_id in (4, 4, 5):
+            await self.db.log_action(user_id, 'media')
+        await self.db.log_action(5, 'url')
+        await self.db.flush()
+
+        stats = await self.db.get_bot_stats()
+        self.assertEqual(stats['total_users'], 2)
+        self.assertEqual(stats['new_today'], 2)
+        self.assertEqual(stats['total_actions'], 4)
+        self.assertEqual(stats['actions_by_type'], {'media': 3, 'url': 1})
+
+        user_stats = await self.db.get_user_stats(4)
+        self.assertEqual(user_stats['total_actions'], 2)
+        self.assertIsNotNone(user_stats['last_action_date'])
+
+    async def test_rollups_add_up_across_flushes(self):
+        await self.db.add_user(User(id=24, first_name="A", is_bot=False))
+        await self.db.log_action(24, 'media')
+        await self.db.flush()
+        await self.db.add_user(User(id=25, first_name="B", is_bot=False))
+        await self.db.log_action(24, 'media')
+        await self.db.log_action(25, 'url')
+        await self.db.flush()
+
+        stats = await self.db.get_bot_stats()
+        self.assertEqual((stats['total_users'], stats['new_today'], stats['total_actions']), (2, 2, 3))
+        self.assertEqual(stats['actions_by_type'], {'media': 2, 'url': 1})
+        self.assertEqual((await self.db.get_user_stats(24))['total_actions'], 2)
+
+    async def test_new_users_are_counted_once_per_utc_day(self):
+        today = datetime.now(timezone.utc).date()
+        profile = (7, "A", None, None, None)
+        await asyncio.gather(
+            self.db.backend.write_batch([profile], [], today),
+            self.db.backend.write_batch([profile], [], today),
+        )
+        await self.db.add_user(User(id=7, first_name="Renamed", is_bot=False))
+        await self.db.add_user(User(id=8, first_name="B", is_bot=False))
+        await self.db.flush()
+
+        stats = await self.db.get_bot_stats()
+        self.assertEqual(stats['total_users'], 2)
+        self.assertEqual(stats['new_today'], 2)
+        self.assertEqual((await self.db.backend.get_user(7))['first_name'], "Renamed")
+
+    async def test_rollups_use_the_utc_day(self):
+        # 23:30 UTC on 1 March is already 2 March in Tashkent
+        tz = patch.dict(os.environ, {'TZ': 'Asia/Tashkent'})
+        tz.start()
+        self.addCleanup(time.tzset)
+        self.addCleanup(tz.stop)
+        time.tzset()
+        late = datetime(2026, 3, 1, 23, 30, tzinfo=timezone.utc)
+        await self.db.backend.write_batch([(9, "A", None, None, None)], [(9, 'media', late)], late.date())
+
+        rows = await self.db.backend._fetch_all("SELECT day, actions FROM daily_actions")
+        self.assertEqual(rows, [{'day': '2026-03-01', 'actions': 1}])
+        row = await self.db.backend._fetch_one("SELECT action_time FROM stats WHERE user_id = 9")
+        self.assertEqual(row['action_time'], '2026-03-02 04:30:00')
+
+        await self.db.log_action(9, 'media')
+        self.assertEqual(self.db._pending_actions[-1][2].tzinfo, timezone.utc)
+
+    async def test_retention_archives_old_rows(self):
+        old = datetime.now() - timedelta(days=40)
+        self.db._pending_actions = [(6, 'media', old), (6, 'media', old), (6, 'url', old)]
+        await self.db.log_action(6, 'media')
+        await self.db.flush()
+        before = await self.db.get_bot_stats()
+
+        self.db.retention_days = 30
+        self.db.retention_batch = 2
+        self.assertEqual(await self.db.run_retention(), 3)
+
+        remaining = await self.db.backend._fetch_all("SELECT action_time FROM stats")
+        self.assertEqual(len(remaining), 1)
+        archive = await self.db.backend._fetch_all(
+            "SELECT action_type, actions FROM stats_archive ORDER BY action_type"
+        )
+        self.assertEqual(archive, [{'action_type': 'media', 'actions': 2}, {'action_type': 'url', 'actions': 1}])
+        self.assertEqual(await self.db.get_bot_stats(), before)
+
+    async def test_file_ids_round_trip(self):
+        self.assertIsNone(await self.db.get_file_id('video:youtube:abc'))
+        await self.db.save_file_id('video:youtube:abc', 'video', 'FILE1')
+        await self.db.save_file_id('video:youtube:abc', 'video', 'FILE2')
+        self.assertEqual(await self.db.get_file_id('video:youtube:abc'), 'FILE2')
+
+        await self.db.forget_file_id('video:youtube:abc')
+        self.assertIsNone(await self.db.get_file_id('video:youtube:abc'))
+
+    async def test_recognitions_expire(self):
+        now = datetime.now()
+        await self.db.save_recognition('tg:match', '{"title": "Song"}', now + timedelta(days=1))
+        await self.db.save_recognition('tg:silence', None, now + timedelta(days=1))
+        await self.db.save_recognition('tg:stale', None, now - timedelta(seconds=1))
+
+        self.assertEqual((await self.db.get_recognition('tg:match'))['result'], '{"title": "Song"}')
+        self.assertIsNone((await self.db.get_recognition('tg:silence'))['result'])
+        self.assertIsNone(await self.db.get_recognition('tg:stale'))
+
+    async def test_least_recently_used_transcripts_are_evicted(self):
+        backend = await self.db._get_backend()
+        start = datetime(2024, 1, 1)
+        for i, key in enumerate(['tg:a', 'tg:b', 'tg:c']):
+            await backend.save_transcript(key, 'uz', f"matn {key}", '[[0.0, "matn"]]', start + timedelta(minutes=i))
+        # Reading tg:a makes it the most recently used
+        row = await backend.get_transcript('tg:a', start + timedelta(minutes=5))
+        self.assertEqual((row['language'], row['transcript']), ('uz', "matn tg:a"))
+
+        self.assertEqual(await backend.evict_transcripts(2), 1)
+        self.assertIsNone(await self.db.get_transcript('tg:b'))
+        self.assertIsNotNone(await self.db.get_transcript('tg:a'))
+        self.assertIsNotNone(await self.db.get_transcript('tg:c'))
+
+if __name__ == '__main__':
+    unittest.main()
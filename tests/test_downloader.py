@@ -0,0 +1,97 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+from handlers.messages import process_url
+from utils.downloader import Downloader, select_format
+from utils.media_cache import MediaCache
+from utils.file_ids import FileIdCache
+
+MB = 1024 * 1024
+
+class TestSelectFormat(unittest.TestCase):
+    def setUp(self):
+        self.info = {
+            'duration': 120,
+            'formats': [
+                {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 360, 'filesize': 10 * MB},
+                {'format_id': '22', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 720, 'filesize': 60 * MB},
+                {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 720, 'filesize': 40 * MB},
+                {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 1080, 'filesize': 90 * MB},
+                {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a', 'filesize': 2 * MB},
+            ],
+        }
+
+    def test_picks_best_quality_that_fits(self):
+        self.assertEqual(select_format(self.info, 50 * MB), ('136+140', 42 * MB))
+
+    def test_falls_back_to_smaller_formats(self):
+        self.assertEqual(select_format(self.info, 20 * MB), ('18', 10 * MB))
+
+    def test_rejects_when_nothing_fits(self):
+        self.assertIsNone(select_format(self.info, 5 * MB))
+
+    def test_estimates_size_from_bitrate(self):
+        info = {'duration': 100, 'formats': [{'format_id': 'hd', 'vcodec': 'h264', 'acodec': 'aac', 'tbr': 8000}]}
+        self.assertIsNone(select_format(info, 50 * MB))  # ~100 MB at 8 Mbit/s
+
+class TestRepeatedLinks(unittest.IsolatedAsyncioTestCase):
+    async def test_uploaded_link_is_resent_without_downloading(self):
+        status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+        message = MagicMock(reply_text=AsyncMock(return_value=status))
+        music_info = {'title': 'Song', 'artist': 'Artist', 'url': 'https://shazam/1', 'key': '1'}
+        with patch('handlers.messages.file_ids.send', AsyncMock(return_value=MagicMock())) as send, \
+                patch('handlers.messages.downloader.download_video', AsyncMock()) as download_video, \
+                patch('handlers.messages.music_recognizer.recognize_url', AsyncMock(return_value=(MagicMock(), music_info))):
+            await process_url(message, 'https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+
+        download_video.assert_not_awaited()
+        send.assert_awaited_once()
+        self.assertEqual(send.await_args.args[2], 'video:youtube:dQw4w9WgXcQ')
+        self.assertIn("Song - Artist", message.reply_text.await_args.args[0])
+
+    def test_tracks_share_one_source_key(self):
+        recognized = {'title': 'Song', 'artist': 'Artist', 'url': 'https://shazam/1', 'key': '1'}
+        searched = {'title': 'Song', 'artist': 'Artist', 'url': 'https://shazam/1?from=search', 'key': '1'}
+        self.assertEqual(FileIdCache.track_key(recognized), FileIdCache.track_key(searched))
+        self.assertEqual(FileIdCache.track_key({'url': 'https://shazam/2'}), 'audio:https://shazam/2')
+
+class TestEvictedDownloads(unittest.IsolatedAsyncioTestCase):
+    async def test_download_evicted_before_waiters_resume_is_fetched_again(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with patch.dict(os.environ, {'MEDIA_CACHE_DIR': tmp.name, 'MEDIA_CACHE_MAX_MB': '0.001'}):  # ~1 KB budget
+            cache = MediaCache()
+        cache._load()
+        a_done = asyncio.Event()
+        fetches = []
+
+        async def fetch_video(url: str, key: str) -> bool:
+            fetches.append(key)
+            if key == 'b':
+                await a_done.wait()
+            path = cache.staging_dir / f"{key}{len(fetches)}.mp4"
+            path.write_bytes(b"x" * 600)
+            cache.put(key, path, {'title': key.upper()}, pin=False)
+            if key == 'a':
+                # 'b' is stored, evicting 'a', before the callers waiting for 'a' resume
+                a_done.set()
+            return True
+
+        downloader = Downloader()
+        with patch('utils.downloader.media_cache', cache), \
+                patch.object(cache, 'resolve_key', AsyncMock(side_effect=lambda url: url)), \
+                patch.object(downloader, '_fetch_video', side_effect=fetch_video):
+            results = await asyncio.gather(
+                downloader.download_video('b'),
+                downloader.download_video('a'),
+                downloader.download_video('a'),
+            )
+
+        self.assertEqual([r['title'] for r in results], ['B', 'A', 'A'])
+        self.assertEqual(fetches.count('a'), 2)
+
+if __name__ == '__main__':
+    unittest.main()
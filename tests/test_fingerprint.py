@@ -0,0 +1,49 @@
+import os
+import unittest
+import numpy as np
+from unittest.mock import patch
+from utils.fingerprint import FingerprintIndex
+
+SAMPLE_RATE = 16000
+
+def melody(seed: int, seconds: int) -> np.ndarray:
+    """Random chords, a quarter second each."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(SAMPLE_RATE // 4) / SAMPLE_RATE
+    notes = [np.sin(2 * np.pi * rng.uniform(200, 3500, (3, 1)) * t).mean(axis=0) for _ in range(seconds * 4)]
+    return np.concatenate(notes)
+
+def to_pcm(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes()
+
+class TestFingerprintIndex(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        with patch.dict(os.environ, {'FINGERPRINT_DB_PATH': ':memory:', 'FINGERPRINT_INDEX': '1'}):
+            self.index = FingerprintIndex()
+        self.song = melody(1, 40)
+        await self.index.add({'key': '1', 'title': 'A'}, to_pcm(self.song))
+        await self.index.add({'key': '2', 'title': 'B'}, to_pcm(melody(2, 40)))
+
+    async def asyncTearDown(self):
+        await self.index.close()
+
+    async def test_matches_a_quiet_noisy_excerpt(self):
+        rng = np.random.default_rng(0)
+        start = int(7.31 * SAMPLE_RATE)  # not on a frame boundary
+        clip = self.song[start:start + 12 * SAMPLE_RATE] * 0.4 + rng.normal(0, 0.05, 12 * SAMPLE_RATE)
+        self.assertEqual(await self.index.match(to_pcm(clip)), {'key': '1', 'title': 'A'})
+
+    async def test_unknown_audio_does_not_match(self):
+        self.assertIsNone(await self.index.match(to_pcm(melody(3, 12))))
+        noise = np.random.default_rng(0).normal(0, 0.3, 12 * SAMPLE_RATE)
+        self.assertIsNone(await self.index.match(to_pcm(noise)))
+    async def test_oldest_clips_are_evicted(self):
+        self.index.max_clips = 2
+        await self.index.add({'key': '3', 'title': 'C'}, to_pcm(melody(3, 40)))
+
+        self.assertEqual(self.index.stats()['evicted'], 1)
+        self.assertIsNone(await self.index.match(to_pcm(self.song[:12 * SAMPLE_RATE])))
+        self.assertEqual(await self.index.match(to_pcm(melody(3, 12))), {'key': '3', 'title': 'C'})
+
+if __name__ == '__main__':
+    unittest.main()
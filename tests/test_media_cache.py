@@ -0,0 +1,67 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from utils.media_cache import MediaCache, normalize_url
+
+class TestMediaCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        env = {'MEDIA_CACHE_DIR': self.tmp.name, 'MEDIA_CACHE_MAX_MB': '0.001'}  # ~1 KB budget
+        with patch.dict(os.environ, env):
+            self.cache = MediaCache()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _download(self, size: int) -> Path:
+        self.cache._load()  # creates the staging directory
+        path = self.cache.staging_dir / f"{size}.mp4"
+        path.write_bytes(b"x" * size)
+        return path
+
+    def test_shared_links_map_to_one_key(self):
+        self.assertEqual(
+            normalize_url("https://www.instagram.com/reel/abc/?igsh=xyz&utm_source=ig"),
+            normalize_url("https://instagram.com/reel/abc"),
+        )
+        self.assertEqual(
+            self.cache.key_for("https://youtu.be/dQw4w9WgXcQ?si=share"),
+            self.cache.key_for("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
+        )
+
+    def test_resolve_key_matches_extractors_once(self):
+        url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+        self.assertEqual(asyncio.run(self.cache.resolve_key(url)), "youtube:dQw4w9WgXcQ")
+
+        with patch.object(self.cache, '_match_key') as match_key:
+            self.assertEqual(asyncio.run(self.cache.resolve_key(url + "&si=share")), "youtube:dQw4w9WgXcQ")
+        match_key.assert_not_called()
+
+    def test_hit_and_pinned_entries_survive_eviction(self):
+        first = self.cache.put('a', self._download(600), {'title': 'A'})
+        self.assertEqual(self.cache.acquire('a')['title'], 'A')
+
+        # Over budget, but 'a' is still pinned twice
+        self.cache.put('b', self._download(600), {'title': 'B'})
+        self.assertTrue(Path(first['filename']).exists())
+
+        self.cache.release('a')
+        self.cache.release('a')
+        self.cache.release('b')
+        self.cache.put('c', self._download(600), {'title': 'C'})
+        self.assertFalse(Path(first['filename']).exists())
+        self.assertIsNone(self.cache.acquire('a'))
+
+    def test_unpinned_put_over_budget_keeps_the_new_entry(self):
+        self.cache.put('a', self._download(600), {'title': 'A'}, pin=False)
+        self.cache.put('b', self._download(2000), {'title': 'B'}, pin=False)
+
+        # 'b' alone exceeds the budget; older entries go, but the caller can still pin it
+        self.assertIsNone(self.cache.pin('a'))
+        self.assertEqual(self.cache.pin('b')['title'], 'B')
+
+if __name__ == '__main__':
+    unittest.main()
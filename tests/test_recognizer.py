@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+import numpy as np
+from unittest.mock import AsyncMock, patch
+from utils.media import MediaPreparer, PreparedMedia
+from utils.recognizer import MusicRecognizer
+from utils.resilience import ServiceUnavailable
+
+class TestWindowedRecognition(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.recognizer = MusicRecognizer()
+        self.recognizer.window = 12
+        self.recognizer.window_positions = [0.3, 0.6, 0.1]
+        index = patch('utils.recognizer.fingerprint_index', AsyncMock(**{'match.return_value': None}))
+        self.index = index.start()
+        self.addCleanup(index.stop)
+
+    def test_short_files_use_one_window(self):
+        self.assertEqual(self.recognizer._window_starts(15), [0.0])
+        self.assertEqual(self.recognizer._window_starts(0), [0.0])
+
+    def test_windows_stay_inside_the_file(self):
+        self.assertEqual(self.recognizer._window_starts(100), [24.0, 54.0, 4.0])
+        self.assertEqual(self.recognizer._window_starts(20), [0.0, 6.0])
+
+    async def test_stops_at_first_match(self):
+        match = {'title': 'Song', 'artist': 'Artist'}
+        query = AsyncMock(side_effect=[None, match, match])
+        media = PreparedMedia('clip', 'clip.mp4', b'\1\0' * (16000 * 100))  # 100 seconds of 16 kHz audio
+        with patch.object(self.recognizer, '_query', query):
+            self.assertEqual(await self.recognizer._recognize_music(media), (match, True))
+
+        self.assertEqual(query.await_count, 2)
+        self.assertEqual([c.args[1] for c in query.await_args_list], ['clip.mp4 @ 24s', 'clip.mp4 @ 54s'])
+        self.assertEqual(len(query.await_args_list[0].args[0]), 44 + 12 * 16000 * 2)  # WAV header + 12 s
+        self.index.add.assert_awaited_once_with(match, media.clip(54, 12))  # the window that matched
+
+    async def test_local_index_is_tried_before_shazam(self):
+        match = {'title': 'Song', 'artist': 'Artist'}
+        self.index.match.side_effect = [None, match]
+        query = AsyncMock()
+        media = PreparedMedia('clip', 'clip.mp4', b'\1\0' * (16000 * 100))
+        with patch.object(self.recognizer, '_query', query):
+            self.assertEqual(await self.recognizer._recognize_music(media), (match, True))
+        query.assert_not_awaited()
+
+    async def test_failed_lookups_are_not_cached_as_silence(self):
+        media = PreparedMedia('clip', 'clip.mp4', b'\0' * 320)
+        cache = AsyncMock()
+        cache.get.return_value = (False, None)
+        with patch('utils.recognizer.recognition_cache', cache), \
+                patch.object(self.recognizer, '_query', AsyncMock(side_effect=RuntimeError("timeout"))):
+            with self.assertRaises(ServiceUnavailable):
+                await self.recognizer.recognize_music(media, cache_key='tg:abc')
+        cache.put.assert_not_awaited()
+
+        with patch('utils.recognizer.recognition_cache', cache), \
+                patch.object(self.recognizer, '_query', AsyncMock(return_value=None)):
+            self.assertIsNone(await self.recognizer.recognize_music(media, cache_key='tg:abc'))
+        cache.put.assert_awaited_once_with('tg:abc', None)
+
+class TestMediaPreparation(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_consumers_share_one_decode(self):
+        preparer = MediaPreparer()
+        with patch('utils.media.decode_pcm', AsyncMock(return_value=b'\0' * 320)) as decode:
+            first, second = await asyncio.gather(
+                preparer.prepare(b'uploaded bytes', key='file-1'),
+                preparer.prepare(b'uploaded bytes', key='file-1'),
+            )
+
+        decode.assert_awaited_once_with(b'uploaded bytes')
+        self.assertIs(first, second)
+        self.assertEqual(first.duration, 0.01)
+        self.assertEqual(first.samples().dtype, np.float32)
+
+if __name__ == '__main__':
+    unittest.main()
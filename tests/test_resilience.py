@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+from utils.resilience import ServiceGuard, ServiceUnavailable, TokenBucket
+
+def make_guard(**overrides) -> ServiceGuard:
+    options = dict(rate=1000, burst=10, max_waiting=10, timeout=0.05, attempts=3, backoff=0,
+                   retry_ratio=0.2, breaker_threshold=3, breaker_reset=60, transient_errors=(ConnectionError,))
+    options.update(overrides)
+    return ServiceGuard("test", **options)
+
+class TestServiceGuard(unittest.IsolatedAsyncioTestCase):
+    async def test_retries_transient_errors(self):
+        guard = make_guard()
+        func = AsyncMock(side_effect=[ConnectionError(), {'ok': True}])
+        self.assertEqual(await guard.call(func), {'ok': True})
+        self.assertEqual(guard.stats()['retries'], 1)
+        self.assertEqual(guard.breaker.state, 'closed')
+
+    async def test_other_errors_are_not_retried(self):
+        guard = make_guard()
+        func = AsyncMock(side_effect=ValueError("bad input"))
+        with self.assertRaises(ValueError):
+            await guard.call(func)
+        self.assertEqual(func.await_count, 1)
+        self.assertEqual(guard.breaker.failures, 0)
+
+    async def test_breaker_opens_and_fails_fast(self):
+        guard = make_guard(attempts=1)
+
+        async def hang():
+            await asyncio.sleep(1)
+
+        for _ in range(3):
+            with self.assertRaises(ServiceUnavailable):
+                await guard.call(hang)
+        self.assertEqual(guard.breaker.state, 'open')
+
+        func = AsyncMock()
+        with self.assertRaises(ServiceUnavailable):
+            await guard.call(func)
+        func.assert_not_awaited()
+        self.assertEqual(guard.stats()['short_circuited'], 1)
+
+        # After the reset timeout one trial call closes it again
+        with patch('utils.resilience.time.monotonic', return_value=guard.breaker.opened_at + 61):
+            await guard.call(func)
+        self.assertEqual(guard.breaker.state, 'closed')
+
+    async def test_retry_budget_limits_retries(self):
+        guard = make_guard(burst=1, attempts=5, breaker_threshold=100)
+        func = AsyncMock(side_effect=ConnectionError())
+        with self.assertRaises(ServiceUnavailable):
+            await guard.call(func)
+        # One retry from the initial budget, then the budget is spent
+        self.assertEqual(func.await_count, 2)
+        self.assertEqual(guard.stats()['retries_denied'], 1)
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_rejects_beyond_queue_limit(self):
+        bucket = TokenBucket(rate=10, burst=1, max_waiting=1)
+        await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        with self.assertRaises(ServiceUnavailable):
+            await bucket.acquire()
+        await waiter
+        self.assertEqual(bucket.rejected, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import time
+import asyncio
+import unittest
+from unittest.mock import patch
+from utils.scheduler import DownloadScheduler, QueueFullError
+
+class TestDownloadScheduler(unittest.IsolatedAsyncioTestCase):
+    def make_scheduler(self, **env) -> DownloadScheduler:
+        with patch.dict(os.environ, env):
+            return DownloadScheduler()
+
+    async def test_host_limit_caps_concurrency(self):
+        scheduler = self.make_scheduler(DOWNLOAD_WORKERS='4', DOWNLOAD_HOST_LIMITS='instagram.com=1')
+        active = []
+        peak = 0
+
+        def fetch():
+            nonlocal peak
+            active.append(1)
+            peak = max(peak, len(active))
+            time.sleep(0.02)
+            active.pop()
+
+        urls = [f"https://www.instagram.com/reel/{i}/" for i in range(3)]
+        await asyncio.gather(*(scheduler.run(url, fetch) for url in urls))
+
+        self.assertEqual(peak, 1)
+        self.assertEqual(scheduler.stats()['completed'], 3)
+
+    async def test_full_queue_rejects_immediately(self):
+        scheduler = self.make_scheduler(DOWNLOAD_WORKERS='1', DOWNLOAD_QUEUE_LIMIT='1')
+        running = asyncio.create_task(scheduler.run("https://a.example/1", time.sleep, 0.05))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(scheduler.run("https://a.example/2", time.sleep, 0))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(QueueFullError):
+            await scheduler.run("https://a.example/3", time.sleep, 0)
+
+        await asyncio.gather(running, queued)
+        self.assertEqual(scheduler.stats()['rejected'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
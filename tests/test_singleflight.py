@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+from utils.singleflight import SingleFlight
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight("test")
+        runs = 0
+
+        async def work():
+            nonlocal runs
+            runs += 1
+            await asyncio.sleep(0.01)
+            return "done"
+
+        results = await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+
+        self.assertEqual(results, ["done"] * 5)
+        self.assertEqual(runs, 1)
+        self.assertEqual(flights.stats(), {'in_flight': 0, 'executed': 1, 'coalesced': 4})
+
+    async def test_errors_reach_every_caller(self):
+        flights = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flights.do("key", fail), flights.do("key", fail), return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    async def test_run_is_cancelled_only_when_every_caller_leaves(self):
+        flights = SingleFlight("test")
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def work():
+            started.set()
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(flights.do("key", work))
+        second = asyncio.create_task(flights.do("key", work))
+        await started.wait()
+
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await second, "done")
+
+        third = asyncio.create_task(flights.do("other", work))
+        release.clear()
+        await asyncio.sleep(0)
+        task = flights._flights["other"].task
+        third.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await third
+        await asyncio.sleep(0)
+        self.assertTrue(task.cancelled())
+        self.assertEqual(flights.stats()['in_flight'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
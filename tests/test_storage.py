@@ -0,0 +1,82 @@
+import os
+import asyncio
+import threading
+import unittest
+from datetime import datetime, date, timezone
+from unittest.mock import patch
+from mysql.connector.errors import OperationalError, ProgrammingError
+from utils.storage import MySQLBackend, StorageError, TransientStorageError, aggregate_actions
+
+class TestRollups(unittest.TestCase):
+    def test_actions_fold_into_daily_and_per_user_increments(self):
+        first = datetime(2026, 5, 1, 9, 0, tzinfo=timezone.utc)
+        later = datetime(2026, 5, 1, 18, 0, tzinfo=timezone.utc)
+        next_day = datetime(2026, 5, 2, 8, 0, tzinfo=timezone.utc)
+        per_day, per_user = aggregate_actions([
+            (1, 'media', later), (1, 'media', first), (2, 'url', first), (1, 'url', next_day),
+        ])
+
+        self.assertEqual(sorted(per_day), [
+            (date(2026, 5, 1), 'media', 2), (date(2026, 5, 1), 'url', 1), (date(2026, 5, 2), 'url', 1),
+        ])
+        totals = {user_id: (count, last) for user_id, count, last in per_user}
+        self.assertEqual(totals[1][0], 3)
+        self.assertEqual(totals[2][0], 1)
+        # Last-action times are stored as naive server-local time
+        self.assertEqual(totals[1][1], next_day.astimezone().replace(tzinfo=None))
+
+class TestMySQLExecutor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        with patch.dict(os.environ, {'DB_POOL_SIZE': '1', 'DB_POOL_TIMEOUT': '0.05'}):
+            self.backend = MySQLBackend()
+        self.release = threading.Event()
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await self.backend.close()
+
+    def blocking_call(self) -> str:
+        self.release.wait(5)
+        return "done"
+
+    async def test_waiting_for_a_busy_pool_times_out(self):
+        busy = asyncio.create_task(self.backend._run(self.blocking_call))
+        await asyncio.sleep(0.01)
+
+        with self.assertRaises(TransientStorageError):
+            await self.backend._run(lambda: "never runs")
+
+        self.release.set()
+        self.assertEqual(await busy, "done")
+        metrics = self.backend.get_metrics()
+        self.assertEqual((metrics['acquired'], metrics['timeouts'], metrics['in_use']), (1, 1, 0))
+
+    async def test_slot_is_held_until_a_cancelled_call_finishes(self):
+        busy = asyncio.create_task(self.backend._run(self.blocking_call))
+        await asyncio.sleep(0.01)
+        busy.cancel()
+        await asyncio.sleep(0.01)
+
+        # The call is still running on the executor, so the pool is still full
+        self.assertEqual(self.backend.get_metrics()['in_use'], 1)
+        with self.assertRaises(TransientStorageError):
+            await self.backend._run(lambda: "never runs")
+
+        self.release.set()
+        self.assertEqual(await self.backend._run(lambda: "runs"), "runs")
+
+    async def test_driver_errors_are_translated(self):
+        def lost_connection():
+            raise OperationalError("Lost connection to MySQL server")
+
+        def bad_query():
+            raise ProgrammingError("You have an error in your SQL syntax")
+
+        with self.assertRaises(TransientStorageError):
+            await self.backend._run(lost_connection)
+        with self.assertRaises(StorageError) as raised:
+            await self.backend._run(bad_query)
+        self.assertNotIsInstance(raised.exception, TransientStorageError)
+
+if __name__ == '__main__':
+    unittest.main()
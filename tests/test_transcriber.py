@@ -0,0 +1,217 @@
+import asyncio
+import unittest
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock, patch
+from utils.media import PreparedMedia
+from utils.transcriber import Transcriber, group_chunks
+from utils.whisper_pool import TranscriptionQueueFull, WhisperPool, load_model, transcribe_batch
+
+CONFIG = {'model_size': 'tiny', 'device': 'cpu', 'compute_type': 'int8', 'cpu_threads': 2, 'num_workers': 1}
+
+class TestModelLoading(unittest.TestCase):
+    def test_model_is_configured_and_warmed_up(self):
+        with patch('utils.whisper_pool.WhisperModel') as whisper_model:
+            whisper_model.return_value.transcribe.return_value = (iter([]), MagicMock())
+            model, metrics = load_model(CONFIG)
+
+        whisper_model.assert_called_once_with('tiny', device='cpu', compute_type='int8', cpu_threads=2, num_workers=1)
+        self.assertIs(model, whisper_model.return_value)
+        model.transcribe.assert_called_once()
+        self.assertEqual(set(metrics), {'load_seconds', 'warmup_seconds', 'rss_bytes'})
+
+class TestBatching(unittest.TestCase):
+    @staticmethod
+    def chunks(samples: np.ndarray) -> list:
+        return [{'start': 0, 'end': len(samples)}]
+
+    def test_segments_go_back_to_their_requests(self):
+        batched = MagicMock()
+        batched.transcribe.return_value = (
+            iter([MagicMock(start=0.5, end=2.0, text="birinchi"), MagicMock(start=10.5, end=12.0, text="ikkinchi")]),
+            MagicMock(language='uz', language_probability=0.9)
+        )
+        jobs = [(np.zeros(10 * 16000, dtype=np.float32), {}), (np.zeros(5 * 16000, dtype=np.float32), {})]
+        model = MagicMock()
+        model.detect_language.return_value = ('uz', 0.9, [])
+        with patch('utils.whisper_pool.speech_chunks', side_effect=self.chunks):
+            emitted = []
+            results = transcribe_batch(model, batched, jobs, 8, lambda *segment: emitted.append(segment))
+
+        clips = batched.transcribe.call_args.kwargs['clip_timestamps']
+        self.assertEqual(clips, [{'start': 0, 'end': 160000}, {'start': 160000, 'end': 240000}])
+        self.assertEqual([text for text, _, _ in results], ["birinchi", "ikkinchi"])
+        self.assertEqual(emitted, [(0, 0.5, "birinchi"), (1, 0.5, "ikkinchi")])
+
+    def test_each_request_keeps_its_own_language(self):
+        batched = MagicMock()
+        batched.transcribe.side_effect = [
+            (iter([MagicMock(start=0.5, end=2.0, text="salom")]), MagicMock(language='uz')),
+            (iter([MagicMock(start=0.5, end=2.0, text="привет")]), MagicMock(language='uz')),
+        ]
+        model = MagicMock()
+        model.detect_language.side_effect = [('uz', 0.9, []), ('ru', 0.8, [])]
+        jobs = [(np.zeros(10 * 16000, dtype=np.float32), {}), (np.zeros(5 * 16000, dtype=np.float32), {})]
+        with patch('utils.whisper_pool.speech_chunks', side_effect=self.chunks):
+            results = transcribe_batch(model, batched, jobs, 8, lambda *segment: None)
+
+        self.assertEqual(results, [("salom", 'uz', 0.9), ("привет", 'ru', 0.8)])
+        self.assertEqual([call.kwargs['language'] for call in batched.transcribe.call_args_list], ['uz', 'ru'])
+
+class TestWhisperPoolQueue(unittest.IsolatedAsyncioTestCase):
+    def seconds(self, duration: float) -> np.ndarray:
+        return np.zeros(int(duration * 16000), dtype=np.float32)
+
+    async def test_short_audio_goes_first(self):
+        pool = WhisperPool(CONFIG, processes=1, queue_limit=5, max_wait=1000)
+        video = pool._admit(self.seconds(60), 60, {})
+        voice = pool._admit(self.seconds(5), 5, {})
+
+        self.assertIs((await pool._queue.get())[2], voice)
+        self.assertIs((await pool._queue.get())[2], video)
+
+    async def test_overload_is_rejected_fast(self):
+        pool = WhisperPool(CONFIG, processes=1, queue_limit=2, max_wait=1000)
+        pool._admit(self.seconds(10), 10, {})
+        pool._admit(self.seconds(10), 10, {})
+        with self.assertRaises(TranscriptionQueueFull):
+            pool._admit(self.seconds(10), 10, {})
+
+        # A long backlog is refused even below the queue limit
+        pool = WhisperPool(CONFIG, processes=1, queue_limit=10, max_wait=20)
+        pool._admit(self.seconds(60), 60, {})
+        self.assertAlmostEqual(pool.estimate_wait(120), 30.0)
+        with self.assertRaises(TranscriptionQueueFull) as raised:
+            pool._admit(self.seconds(120), 120, {})
+        self.assertGreater(raised.exception.estimated_wait, 0)
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+    async def test_dead_worker_is_restarted_in_its_own_slot(self):
+        pool = WhisperPool({**CONFIG, 'batch_size': 2}, processes=1, queue_limit=5, max_wait=1000, batch_wait=0.01)
+        conn = MagicMock()
+        # The second job of the batch streams a segment, then the worker dies
+        conn.recv.side_effect = [('segment', (1, 0.0, " Salom")), EOFError()]
+        spawn = AsyncMock(side_effect=[(MagicMock(), conn), None])
+        jobs = [pool._admit(self.seconds(5), 5, {}) for _ in range(2)]
+
+        with patch.object(pool, '_spawn', spawn):
+            worker = asyncio.create_task(pool._run_worker(3, preload=True))
+            with self.assertRaises(RuntimeError):
+                await jobs[0].future
+            retry = pool._admit(self.seconds(5), 5, {})
+            with self.assertRaises(RuntimeError):
+                await retry.future
+            worker.cancel()
+
+        self.assertEqual([call.args for call in spawn.await_args_list], [(3,), (3,)])
+
+    async def test_parts_of_long_audio_are_admitted_together(self):
+        pool = WhisperPool(CONFIG, processes=4, queue_limit=20, max_wait=120)
+        parts = [(self.seconds(450), {}) for _ in range(4)]
+        with patch.object(pool, 'start'):
+            futures = pool.submit(parts)
+
+        # Thirty minutes on an idle pool: the parts run side by side, none waits behind another
+        self.assertEqual(len(futures), 4)
+        self.assertEqual(pool._queue.qsize(), 4)
+        self.assertEqual(pool.stats()['rejected'], 0)
+
+        with patch.object(pool, 'start'), self.assertRaises(TranscriptionQueueFull):
+            pool.submit([(self.seconds(1), {}) for _ in range(17)])
+        self.assertEqual(pool._queue.qsize(), 4)
+
+    async def test_queued_jobs_are_batched(self):
+        pool = WhisperPool({**CONFIG, 'batch_size': 2}, processes=1, queue_limit=5, max_wait=1000, batch_wait=0.01)
+        jobs = [pool._admit(self.seconds(5), 5, {}) for _ in range(3)]
+        _, _, first = await pool._queue.get()
+
+        self.assertEqual(await pool._next_batch(first), jobs[:2])
+        self.assertEqual(pool._queue.qsize(), 1)
+
+        # Jobs already queued are batched even without waiting for more
+        pool.batch_wait = 0
+        _, _, first = await pool._queue.get()
+        pool._admit(self.seconds(5), 5, {})
+        self.assertEqual(len(await pool._next_batch(first)), 2)
+
+class TestSegmentStreaming(unittest.IsolatedAsyncioTestCase):
+    async def test_segments_reach_every_waiting_caller(self):
+        transcriber = Transcriber()
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def transcribe(samples, on_segment, **options):
+            on_segment(0.0, " Salom")
+            started.set()
+            await release.wait()
+            on_segment(2.0, " dunyo")
+            return "Salom dunyo", 'uz', 0.9
+
+        first, second = [], []
+        media = PreparedMedia('audio:1', 'test', bytes(3200))
+        with patch.object(transcriber.pool, 'transcribe', side_effect=transcribe), \
+                patch('utils.transcriber.transcript_cache', get=AsyncMock(return_value=None), put=AsyncMock()):
+            leader = asyncio.create_task(transcriber.transcribe_audio(media, on_segment=first.append))
+            await started.wait()
+            follower = asyncio.create_task(transcriber.transcribe_audio(media, on_segment=second.append))
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(leader, follower)
+
+        self.assertEqual(results, ["Salom dunyo", "Salom dunyo"])
+        self.assertEqual(first, [" Salom", " dunyo"])
+        self.assertEqual(second, [" dunyo"])
+        self.assertEqual(transcriber._listeners, {})
+
+class TestTranscriptCache(unittest.IsolatedAsyncioTestCase):
+    async def test_cached_transcripts_skip_whisper(self):
+        transcriber = Transcriber()
+        media = PreparedMedia('audio:1', 'test', bytes(3200))
+        cache = MagicMock(get=AsyncMock(return_value=None), put=AsyncMock())
+        with patch('utils.transcriber.transcript_cache', cache), \
+                patch.object(transcriber.pool, 'transcribe', AsyncMock(return_value=("Salom", 'uz', 0.9))) as transcribe:
+            self.assertEqual(await transcriber.transcribe_audio(media, cache_key='tg:abc'), "Salom")
+            key = f"tg:abc|{transcriber.settings_key}"
+            cache.put.assert_awaited_once_with(key, 'uz', "Salom", [])
+
+            cache.get.return_value = {'language': 'uz', 'transcript': "Salom", 'segments': []}
+            self.assertEqual(await transcriber.transcribe_audio(media, cache_key='tg:abc'), "Salom")
+            self.assertEqual(transcribe.await_count, 1)
+            cache.get.assert_awaited_with(key)
+
+class TestLongForm(unittest.IsolatedAsyncioTestCase):
+    def test_speech_is_shared_evenly(self):
+        chunks = [{'start': i * 100, 'end': i * 100 + 90} for i in range(8)]
+        groups = group_chunks(chunks, 3)
+        self.assertEqual([len(group) for group in groups], [3, 3, 2])
+        self.assertEqual(sum(groups, []), chunks)
+        self.assertEqual(group_chunks(chunks[:1], 4), [chunks[:1]])
+
+    async def test_parts_run_in_parallel_and_are_stitched_in_order(self):
+        transcriber = Transcriber()
+        transcriber.pool.processes = 2
+        chunks = [{'start': 0, 'end': 16000}, {'start': 48000, 'end': 64000}]
+        published = []
+        futures = []
+
+        def submit(parts, on_segment):
+            self.assertEqual(parts[1][1]['clip_timestamps'], [{'start': 0, 'end': 16000}])
+            futures.extend(asyncio.get_running_loop().create_future() for _ in parts)
+            # The second part finishes first
+            on_segment(1, 0.0, " ikkinchi")
+            futures[1].set_result(("ikkinchi", 'uz', 0.9))
+            on_segment(0, 0.0, " birinchi")
+            futures[0].set_result(("birinchi", 'uz', 0.9))
+            return futures
+
+        media = PreparedMedia('audio:long', 'test', bytes(4 * 16000 * 2))
+        transcriber._listeners[media.key].append(published.append)
+        with patch('utils.transcriber.speech_chunks', return_value=chunks), \
+                patch.object(transcriber.pool, 'submit', side_effect=submit):
+            transcript, language, segments = await transcriber._transcribe_long(media)
+
+        self.assertEqual(transcript, "[00:00:00] birinchi\n[00:00:03] ikkinchi")
+        self.assertEqual(segments, [(0.0, "birinchi"), (3.0, "ikkinchi")])
+        self.assertEqual(published, ["\n[00:00:00] birinchi", "\n[00:00:03] ikkinchi"])
+
+if __name__ == '__main__':
+    unittest.main()
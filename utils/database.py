@@ -1,274 +1,413 @@
 import os
-import mysql.connector
-from mysql.connector import pooling
-from mysql.connector import Error
+import time
+import asyncio
 from typing import Optional, List, Dict
 import logging
-from datetime import datetime
-from urllib.parse import urlparse
+from datetime import datetime, date, timedelta, timezone
 from telegram import User
+from utils.cache import LRUCache
+from utils.storage import StorageBackend, StorageError, TransientStorageError, create_backend
+from utils.migrations import ensure_schema
 
 logger = logging.getLogger(__name__)
 
+def utc_today() -> date:
+    """Get the current UTC date, so the daily rollups do not shift with the host's time zone."""
+    return datetime.now(timezone.utc).date()
+
 class Database:
     def __init__(self):
-        # Check if running on Railway by looking for a Railway-specific env var
-        is_railway = 'RAILWAY_ENVIRONMENT' in os.environ
-
-        if is_railway:
-            logger.info("Railway environment detected. Using MYSQL_URL.")
-            # Railway provides a single connection string URL which is more reliable
-            db_url_str = os.getenv('MYSQL_URL')
-            if not db_url_str:
-                logger.critical("MYSQL_URL not found in Railway environment! Cannot connect to the database.")
-                raise ValueError("MYSQL_URL environment variable not found.")
-            
-            url = urlparse(db_url_str)
-            db_host = url.hostname
-            db_user = url.username
-            db_password = url.password
-            db_name = url.path[1:]  # Remove leading '/'
-            db_port = url.port
+        # Nothing connects here; the backend is opened by connect() or on first use
+        self.backend_name = os.getenv('DB_BACKEND', 'mysql').lower()
+        self.backend: Optional[StorageBackend] = None
+        self._connect_lock = asyncio.Lock()
+        # With auto-migrate off, pending migrations must be applied with `python -m utils.migrations`
+        self.auto_migrate = os.getenv('DB_AUTO_MIGRATE', '1').lower() in ('1', 'true', 'yes')
 
-        else:
-            logger.info("Local environment detected. Using .env file variables.")
-            db_host = os.getenv('DB_HOST', 'localhost')
-            db_user = os.getenv('DB_USER', 'root')
-            db_password = os.getenv('DB_PASSWORD', '')
-            db_name = os.getenv('DB_NAME', 'vortex_bot')
-            db_port = os.getenv('DB_PORT', 3306)
+        # Write-behind buffer: user upserts and action logs are collected here and
+        # written in batches when batch_size rows are pending or every flush_interval.
+        self.batch_size = int(os.getenv('DB_BATCH_SIZE', 100))
+        self.flush_interval = float(os.getenv('DB_FLUSH_INTERVAL', 1.0))
+        self.buffer_limit = int(os.getenv('DB_BUFFER_LIMIT', 10000))
+        self._pending_users: Dict[int, tuple] = {}
+        self._pending_actions: List[tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_wakeup = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._buffer_metrics = {'flushes': 0, 'users_written': 0, 'actions_written': 0, 'dropped': 0}
 
-        try:
-            # For local development, we ensure the database exists.
-            # On Railway, the database is already provisioned and this step is skipped.
-            if not is_railway:
-                conn = mysql.connector.connect(host=db_host, user=db_user, password=db_password, port=int(db_port))
-                cursor = conn.cursor()
-                logger.info(f"Ensuring local database '{db_name}' exists...")
-                cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name} CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-                cursor.close()
-                conn.close()
-                logger.info(f"Local database '{db_name}' is ready.")
-
-            # Create the connection pool
-            self.pool = mysql.connector.pooling.MySQLConnectionPool(
-                pool_name="bot_pool",
-                pool_size=5,
-                host=db_host,
-                database=db_name,
-                user=db_user,
-                password=db_password,
-                port=int(db_port),
-                charset='utf8mb4'
-            )
-            logger.info("Database connection pool created successfully.")
-            
-            # Create tables if they don't exist
-            self._create_tables()
-
-        except Error as e:
-            logger.error(f"Database setup error: {e}")
-            raise
-
-    def _create_tables(self):
-        """Create necessary tables and add missing columns atomically."""
-        conn = self.pool.get_connection()
-        cursor = conn.cursor()
-        try:
-            logger.info("Verifying database schema...")
-            # Create tables if they don't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    username VARCHAR(255),
-                    language_code VARCHAR(10),
-                    phone_number VARCHAR(20),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS stats (
-                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
-                    user_id BIGINT,
-                    action_type VARCHAR(50),
-                    action_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # Add missing columns for backward compatibility
-            self._add_column_if_not_exists(cursor, 'users', 'last_name', 'VARCHAR(255) AFTER first_name')
-            self._add_column_if_not_exists(cursor, 'users', 'language_code', 'VARCHAR(10) AFTER username')
-
-            conn.commit()
-            logger.info("Database schema verified and updated successfully.")
-        except Error as e:
-            logger.error(f"Error during schema creation/update: {e}")
-            conn.rollback()
-        finally:
-            cursor.close()
-            conn.close()
-
-    def _add_column_if_not_exists(self, cursor, table_name, column_name, column_definition):
-        """Helper function to add a column if it doesn't exist, using the provided cursor."""
-        cursor.execute(f"""
-            SELECT COUNT(*)
-            FROM INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_SCHEMA = DATABASE()
-              AND TABLE_NAME = '{table_name}'
-              AND COLUMN_NAME = '{column_name}'
-        """)
-        if cursor.fetchone()[0] == 0:
-            logger.info(f"Column '{column_name}' not found in table '{table_name}'. Adding it...")
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
-            logger.info(f"Successfully added column '{column_name}'.")
-        else:
-            logger.debug(f"Column '{column_name}' already exists in table '{table_name}'.")
+        # Cache of the last profile written per user, so repeated messages from the
+        # same user skip the upsert until something changes or last_active is stale.
+        self.last_active_granularity = float(os.getenv('USER_LAST_ACTIVE_GRANULARITY', 300))
+        self._user_cache = LRUCache(
+            maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('USER_CACHE_TTL', 3600))
+        )
 
-    async def add_user(self, user: User) -> None:
-        """Add or update a user in the database."""
-        query = """
-            INSERT INTO users (user_id, first_name, last_name, username, language_code)
-            VALUES (%s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                first_name = VALUES(first_name),
-                last_name = VALUES(last_name),
-                username = VALUES(username),
-                language_code = VALUES(language_code),
-                last_active = NOW()
+        # Retention: raw stats rows older than retention_days are rolled into
+        # stats_archive and deleted in chunks of retention_batch rows, pausing
+        # between chunks so the job never holds long locks. 0 keeps rows forever.
+        self.retention_days = int(os.getenv('STATS_RETENTION_DAYS', 0))
+        self.retention_batch = int(os.getenv('STATS_RETENTION_BATCH', 5000))
+        self.retention_pause = float(os.getenv('STATS_RETENTION_PAUSE', 0.2))
+        self.retention_interval = float(os.getenv('STATS_RETENTION_INTERVAL', 86400))
+        self._retention_task: Optional[asyncio.Task] = None
+        self._retention_metrics = {'runs': 0, 'rows_archived': 0, 'partitions_dropped': 0}
+
+    async def connect(self) -> None:
+        """Open the configured storage backend and check its schema version."""
+        async with self._connect_lock:
+            if self.backend is not None:
+                return
+            backend = create_backend(self.backend_name)
+            try:
+                await backend.connect()
+                await ensure_schema(backend, self.auto_migrate)
+            except StorageError as e:
+                logger.error(f"Database setup error: {e}")
+                await backend.close()
+                raise
+            self.backend = backend
+            logger.info(f"Database backend '{self.backend_name}' connected.")
+
+    async def _get_backend(self) -> StorageBackend:
+        if self.backend is None:
+            await self.connect()
+        return self.backend
+
+    def get_pool_metrics(self) -> Dict:
+        """Get connection pool usage and wait-time metrics."""
+        if self.backend is None:
+            return {
+                'pool_size': 0,
+                'in_use': 0,
+                'waiting': 0,
+                'acquired': 0,
+                'timeouts': 0,
+                'wait_avg_ms': 0.0,
+                'wait_max_ms': 0.0,
+            }
+        return self.backend.get_metrics()
+
+    def get_buffer_metrics(self) -> Dict:
+        """Get write-behind buffer metrics."""
+        return {
+            'pending_users': len(self._pending_users),
+            'pending_actions': len(self._pending_actions),
+            **self._buffer_metrics,
+        }
+
+    def get_cache_metrics(self) -> Dict:
+        """Get user cache hit/miss counters."""
+        return self._user_cache.stats()
+
+    def get_retention_metrics(self) -> Dict:
+        """Get stats retention job counters."""
+        return {'retention_days': self.retention_days, **self._retention_metrics}
+
+    def _schedule_flush(self) -> None:
+        """Start the background flusher and wake it early once a batch is full."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if len(self._pending_users) + len(self._pending_actions) >= self.batch_size:
+            self._flush_wakeup.set()
+
+    async def _flush_loop(self) -> None:
+        """Flush buffered writes on a size or time trigger."""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Unexpected error in write buffer flush: {e}")
+
+    async def flush(self) -> None:
+        """Write all buffered users and actions to the database."""
+        async with self._flush_lock:
+            users = list(self._pending_users.values())
+            actions = self._pending_actions
+            self._pending_users = {}
+            self._pending_actions = []
+            if not users and not actions:
+                return
+
+            try:
+                backend = await self._get_backend()
+                await backend.write_batch(users, actions, utc_today())
+                self._buffer_metrics['flushes'] += 1
+                self._buffer_metrics['users_written'] += len(users)
+                self._buffer_metrics['actions_written'] += len(actions)
+            except TransientStorageError as e:
+                logger.error(f"Error flushing write buffer, will retry: {e}")
+                self._requeue(users, actions)
+            except StorageError as e:
+                logger.error(f"Error flushing write buffer, dropping {len(users)} users and {len(actions)} actions: {e}")
+                self._buffer_metrics['dropped'] += len(users) + len(actions)
+                # Forget dropped profiles so the next message writes them again
+                for row in users:
+                    self._user_cache.pop(row[0])
+
+    def _requeue(self, users: List[tuple], actions: List[tuple]) -> None:
+        """Put a failed batch back in front of newer writes, within buffer_limit."""
+        for row in users:
+            # A newer upsert for the same user supersedes the failed one
+            self._pending_users.setdefault(row[0], row)
+        self._pending_actions = actions + self._pending_actions
+        overflow = len(self._pending_actions) - self.buffer_limit
+        if overflow > 0:
+            logger.warning(f"Write buffer full, dropping {overflow} oldest actions")
+            self._pending_actions = self._pending_actions[overflow:]
+            self._buffer_metrics['dropped'] += overflow
+
+    async def _flush_user_if_pending(self, user_id: int) -> None:
+        """Make a buffered upsert visible before reading or updating that user."""
+        if user_id in self._pending_users:
+            await self.flush()
+
+    def start_maintenance(self) -> None:
+        """Start the periodic stats retention job, if a retention window is configured."""
+        if self.retention_days > 0 and (self._retention_task is None or self._retention_task.done()):
+            self._retention_task = asyncio.create_task(self._retention_loop())
+
+    async def _retention_loop(self) -> None:
+        """Run the retention job every retention_interval seconds."""
+        while True:
+            try:
+                await self.run_retention()
+            except Exception as e:
+                logger.error(f"Unexpected error in stats retention: {e}")
+            await asyncio.sleep(self.retention_interval)
+
+    async def run_retention(self) -> int:
+        """Archive and delete raw stats rows older than the retention window.
+
+        The daily and per-user rollups are left alone, so /stats is unaffected.
+        Returns the number of rows archived by the chunked job.
         """
-        params = (user.id, user.first_name, user.last_name, user.username, user.language_code)
-        
-        conn = self.pool.get_connection()
-        cursor = conn.cursor()
+        if self.retention_days <= 0:
+            return 0
+        cutoff = datetime.combine(date.today() - timedelta(days=self.retention_days), datetime.min.time())
+        archived = 0
         try:
-            cursor.execute(query, params)
-            conn.commit()
-        except Error as e:
-            logger.error(f"Error in add_user: {e}")
-            conn.rollback()
-        finally:
-            cursor.close()
-            conn.close()
+            backend = await self._get_backend()
+            # Whole partitions first (MySQL), then whatever is left row by row
+            self._retention_metrics['partitions_dropped'] += await backend.maintain_partitions(cutoff.date())
+            while True:
+                count = await backend.archive_stats_chunk(cutoff, self.retention_batch)
+                archived += count
+                if count < self.retention_batch:
+                    break
+                await asyncio.sleep(self.retention_pause)
+        except StorageError as e:
+            logger.error(f"Error pruning stats older than {cutoff:%Y-%m-%d}: {e}")
+        self._retention_metrics['runs'] += 1
+        self._retention_metrics['rows_archived'] += archived
+        if archived:
+            logger.info(f"Archived {archived} stats rows older than {cutoff:%Y-%m-%d}.")
+        return archived
+
+    async def close(self) -> None:
+        """Flush buffered writes and close the storage backend."""
+        if self._retention_task:
+            self._retention_task.cancel()
+            try:
+                await self._retention_task
+            except asyncio.CancelledError:
+                pass
+            self._retention_task = None
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        if self.backend is None:
+            return
+        await self.backend.close()
+        self.backend = None
+        logger.info("Database write buffer flushed and backend closed.")
+
+    async def add_user(self, user: User) -> None:
+        """Add or update a user in the database (buffered, skipped when unchanged)."""
+        profile = (user.first_name, user.last_name, user.username, user.language_code)
+        now = time.monotonic()
+        entry = self._user_cache.get(user.id)
+
+        if entry and entry['profile'] == profile and now - entry['written_at'] < self.last_active_granularity:
+            return
+
+        self._pending_users[user.id] = (user.id, *profile)
+        self._schedule_flush()
+
+        if entry:
+            entry['profile'] = profile
+            entry['written_at'] = now
+            if entry['row'] is not None:
+                entry['row'].update(zip(('first_name', 'last_name', 'username', 'language_code'), profile))
+        else:
+            self._user_cache.set(user.id, {'profile': profile, 'written_at': now, 'row': None})
+
+    def _cache_phone_number(self, user_id: int, phone_number: str) -> None:
+        """Keep the cached registration state in step with a phone number update."""
+        entry = self._user_cache.get(user_id)
+        if entry and entry['row'] is not None:
+            entry['row']['phone_number'] = phone_number
 
     async def save_phone_number(self, user_id: int, phone_number: str) -> None:
         """Save or update user's phone number."""
-        query = "UPDATE users SET phone_number = %s WHERE user_id = %s"
-        params = (phone_number, user_id)
-        
-        conn = self.pool.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute(query, params)
-            conn.commit()
+            await self._flush_user_if_pending(user_id)
+            backend = await self._get_backend()
+            await backend.update_phone_number(user_id, phone_number)
+            self._cache_phone_number(user_id, phone_number)
             logger.info(f"Saved phone number for user {user_id}")
-        except Error as e:
+        except StorageError as e:
             logger.error(f"Error in save_phone_number: {e}")
-            conn.rollback()
-        finally:
-            cursor.close()
-            conn.close()
 
     async def get_user_stats(self, user_id: int) -> Optional[Dict]:
-        """Get user statistics."""
-        conn = self.pool.get_connection()
-        cursor = conn.cursor(dictionary=True)
-
+        """Get user statistics from the per-user rollup."""
         try:
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_actions,
-                    DATE_FORMAT(MAX(action_time), '%Y-%m-%d') as last_action_date
-                FROM stats 
-                WHERE user_id = %s
-            ''', (user_id,))
-            
-            return cursor.fetchone()
-        except Error as e:
+            backend = await self._get_backend()
+            row = await backend.get_user_totals(user_id)
+        except StorageError as e:
             logger.error(f"Error getting user stats: {str(e)}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
 
-    async def log_action(self, user_id: int, action_type: str) -> None:
-        """Log a user action to the stats table."""
-        conn = self.pool.get_connection()
-        cursor = conn.cursor()
+        if not row:
+            return {'total_actions': 0, 'last_action_date': None}
+        return {
+            'total_actions': row['total_actions'],
+            'last_action_date': row['last_action_time'].strftime('%Y-%m-%d') if row['last_action_time'] else None
+        }
 
-        try:
-            cursor.execute('''
-                INSERT INTO stats (user_id, action_type)
-                VALUES (%s, %s)
-            ''', (user_id, action_type))
-            
-            conn.commit()
-            return True
-        except Error as e:
-            logger.error(f"Error logging action: {str(e)}")
-            conn.rollback()
-            return False
-        finally:
-            cursor.close()
-            conn.close()
+    async def log_action(self, user_id: int, action_type: str) -> None:
+        """Log a user action to the stats table (buffered)."""
+        # Capture the time now, in UTC as the rollup days are; the row may only be written a moment later
+        self._pending_actions.append((user_id, action_type, datetime.now(timezone.utc)))
+        self._schedule_flush()
+        return True
 
     async def get_bot_stats(self) -> Dict:
-        """Get overall bot statistics."""
-        conn = self.pool.get_connection()
-        cursor = conn.cursor(dictionary=True)
-
+        """Get overall bot statistics from the daily rollups."""
         try:
-            cursor.execute('''
-                SELECT 
-                    COUNT(DISTINCT user_id) as total_users,
-                    COUNT(*) as total_actions,
-                    COUNT(DISTINCT CASE WHEN DATE(action_time) = CURDATE() THEN user_id END) as new_today
-                FROM stats
-            ''')
-            
-            return cursor.fetchone()
-        except Error as e:
+            backend = await self._get_backend()
+            return await backend.get_bot_stats(utc_today())
+        except StorageError as e:
             logger.error(f"Error getting bot stats: {str(e)}")
             return {
                 'total_users': 0,
                 'total_actions': 0,
-                'new_today': 0
+                'new_today': 0,
+                'actions_by_type': {}
             }
-        finally:
-            cursor.close()
-            conn.close()
 
     async def get_user(self, user_id: int) -> Optional[Dict]:
-        """Get a user's full record from the database."""
-        conn = self.pool.get_connection()
-        cursor = conn.cursor(dictionary=True)
+        """Get a user's full record, served from the user cache when possible."""
+        entry = self._user_cache.get(user_id)
+        if entry and entry['row'] is not None:
+            return dict(entry['row'])
+
         try:
-            cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
-            return cursor.fetchone()
-        except Error as e:
+            await self._flush_user_if_pending(user_id)
+            backend = await self._get_backend()
+            row = await backend.get_user(user_id)
+        except StorageError as e:
             logger.error(f"Error fetching user {user_id}: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
+
+        if row:
+            if entry:
+                entry['row'] = dict(row)
+            else:
+                profile = (row['first_name'], row['last_name'], row['username'], row['language_code'])
+                # written_at is unknown, so the next add_user refreshes last_active
+                self._user_cache.set(user_id, {'profile': profile, 'written_at': float('-inf'), 'row': dict(row)})
+        return row
 
     async def update_phone_number(self, user_id: int, phone_number: str) -> None:
         """Update a user's phone number in the database."""
-        conn = self.pool.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute("UPDATE users SET phone_number = %s WHERE user_id = %s", (phone_number, user_id))
-            conn.commit()
+            await self._flush_user_if_pending(user_id)
+            backend = await self._get_backend()
+            await backend.update_phone_number(user_id, phone_number)
+            self._cache_phone_number(user_id, phone_number)
             logger.info(f"Updated phone number for user {user_id}.")
-        except Error as e:
+        except StorageError as e:
             logger.error(f"Error updating phone number for {user_id}: {e}")
-            conn.rollback()
-        finally:
-            cursor.close()
-            conn.close()
 
-# Create a singleton instance
+    async def get_file_id(self, source_key: str) -> Optional[str]:
+        """Get the Telegram file_id of media already uploaded for a source."""
+        try:
+            backend = await self._get_backend()
+            return await backend.get_file_id(source_key)
+        except StorageError as e:
+            logger.error(f"Error getting file_id for {source_key}: {e}")
+            return None
+
+    async def save_file_id(self, source_key: str, media_type: str, file_id: str) -> None:
+        """Remember the Telegram file_id of an upload for a source."""
+        try:
+            backend = await self._get_backend()
+            await backend.save_file_id(source_key, media_type, file_id)
+        except StorageError as e:
+            logger.error(f"Error saving file_id for {source_key}: {e}")
+
+    async def forget_file_id(self, source_key: str) -> None:
+        """Drop a file_id that Telegram no longer accepts."""
+        try:
+            backend = await self._get_backend()
+            await backend.delete_file_id(source_key)
+        except StorageError as e:
+            logger.error(f"Error deleting file_id for {source_key}: {e}")
+
+    async def get_recognition(self, cache_key: str) -> Optional[Dict]:
+        """Get an unexpired cached recognition row ('result' JSON or None, 'expires_at')."""
+        try:
+            backend = await self._get_backend()
+            return await backend.get_recognition(cache_key, datetime.now())
+        except StorageError as e:
+            logger.error(f"Error getting recognition for {cache_key}: {e}")
+            return None
+
+    async def save_recognition(self, cache_key: str, result: Optional[str], expires_at: datetime) -> None:
+        """Remember a recognition result, or a "no music" answer when result is None."""
+        try:
+            backend = await self._get_backend()
+            await backend.save_recognition(cache_key, result, expires_at)
+        except StorageError as e:
+            logger.error(f"Error saving recognition for {cache_key}: {e}")
+
+    async def get_transcript(self, cache_key: str) -> Optional[Dict]:
+        """Get a cached transcript row ('language', 'transcript', 'segments' JSON), marking it recently used."""
+        try:
+            backend = await self._get_backend()
+            return await backend.get_transcript(cache_key, datetime.now())
+        except StorageError as e:
+            logger.error(f"Error getting transcript for {cache_key}: {e}")
+            return None
+
+    async def save_transcript(self, cache_key: str, language: str, transcript: str, segments: str) -> None:
+        """Remember a transcript with its language and segments."""
+        try:
+            backend = await self._get_backend()
+            await backend.save_transcript(cache_key, language, transcript, segments, datetime.now())
+        except StorageError as e:
+            logger.error(f"Error saving transcript for {cache_key}: {e}")
+
+    async def evict_transcripts(self, keep: int) -> int:
+        """Drop the least recently used transcripts beyond the newest `keep`."""
+        try:
+            backend = await self._get_backend()
+            return await backend.evict_transcripts(keep)
+        except StorageError as e:
+            logger.error(f"Error evicting transcripts: {e}")
+            return 0
+
+# Create a singleton instance (connects lazily)
 db = Database()
@@ -1,59 +1,230 @@
+import os
+import copy
 import yt_dlp
 import logging
-import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 import tempfile
+from uuid import uuid4
+from utils.cache import LRUCache
+from utils.media_cache import media_cache
+from utils.singleflight import SingleFlight
+from utils.scheduler import download_scheduler, QueueFullError
 
 logger = logging.getLogger(__name__)
 
+class DownloadRejected(Exception):
+    """A link was rejected from its metadata, before any media was downloaded."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason  # 'too_long' or 'too_large'
+
+def estimate_size(fmt: Dict, duration: Optional[float]) -> Optional[float]:
+    """Estimate a format's size in bytes from its metadata, or None if unknown."""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    if fmt.get('tbr') and duration:
+        return fmt['tbr'] * 1000 / 8 * duration
+    return None
+
+def select_format(info: Dict, max_bytes: int) -> Optional[Tuple[str, Optional[float]]]:
+    """Pick the best format (or video+audio pair) expected to fit in max_bytes.
+
+    Returns a yt-dlp format spec and its estimated size, or None if nothing fits.
+    Formats of unknown size are only used when no format has a known fitting size.
+    """
+    formats: List[Dict] = info.get('formats') or [info]
+    duration = info.get('duration')
+
+    def quality(fmt: Dict) -> tuple:
+        return (fmt.get('height') or 0, fmt.get('ext') == 'mp4', fmt.get('tbr') or 0)
+
+    candidates = []
+    combined = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+    for fmt in combined:
+        candidates.append((quality(fmt), fmt.get('format_id', 'best'), estimate_size(fmt, duration)))
+
+    # Separate streams need a merge, so only pair mp4 video with m4a audio
+    videos = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') == 'none' and f.get('ext') == 'mp4']
+    audios = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') != 'none' and f.get('ext') == 'm4a']
+    if audios:
+        audio = min(audios, key=lambda f: estimate_size(f, duration) or float('inf'))
+        audio_size = estimate_size(audio, duration)
+        for video in videos:
+            video_size = estimate_size(video, duration)
+            size = video_size + audio_size if video_size and audio_size else None
+            candidates.append((quality(video), f"{video['format_id']}+{audio['format_id']}", size))
+
+    fitting = [c for c in candidates if c[2] is not None and c[2] <= max_bytes]
+    if not fitting:
+        fitting = [c for c in candidates if c[2] is None]
+    if not fitting:
+        return None
+    _, spec, size = max(fitting, key=lambda c: c[0])
+    return spec, size
+
 class Downloader:
     def __init__(self):
         self.temp_dir = Path(tempfile.gettempdir()) / "vortex_bot"
         self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.video_flights = SingleFlight("video download")
+        # The video download and the audio-only fast path probe the same link at once
+        self.probe_flights = SingleFlight("link probe")
+        self.max_video_size = 50 * 1024 * 1024  # Telegram bot upload limit
+        self.max_video_duration = 600  # 10 minutes limit
+        # Downloads evicted before their callers could pin them are fetched again this many times in total
+        self.fetch_attempts = 3
+        # Probe results by media cache key; format URLs expire, so keep them briefly
+        self._probes = LRUCache(maxsize=1024, ttl=float(os.getenv('PROBE_CACHE_TTL', 600)))
 
     async def download_video(self, url: str) -> Optional[Dict]:
-        """Download video from URL using yt-dlp."""
+        """Download video from URL using yt-dlp, or serve it from the media cache.
+
+        Concurrent requests for the same video share one download. The returned
+        file is pinned in the cache; pass the result to release_video when done.
+        Raises QueueFullError when the download queue is full and DownloadRejected
+        when the metadata shows the video cannot be sent.
+        """
         try:
-            ydl_opts = {
-                'format': 'best[ext=mp4]/best',  # Prioritize pre-merged MP4
-                'outtmpl': str(self.temp_dir / '%(title)s.%(ext)s'),
-                'quiet': True,
-                'no_warnings': True,
-                'noplaylist': True,
-                'concurrent_fragment_downloads': 4,
-                'max_filesize': 50 * 1024 * 1024,  # 50MB limit
-                'max_duration': 600,  # 10 minutes limit
-                'merge_output_format': 'mp4',
-            }
-
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: yt_dlp.YoutubeDL(ydl_opts).extract_info(url, download=True)
-            )
+            key = await media_cache.resolve_key(url)
+            cached = media_cache.acquire(key)
+            if cached:
+                logger.info(f"Serving {url} from media cache ({key})")
+                return cached
 
-            if result:
-                return {
-                    'filename': result['requested_downloads'][0]['_filename'],
-                    'title': result.get('title', 'Unknown'),
-                    'duration': result.get('duration', 0),
-                    'thumbnail': result.get('thumbnail')
-                }
+            for _ in range(self.fetch_attempts):
+                if not await self.video_flights.do(key, lambda: self._fetch_video(url, key)):
+                    return None
+                # Every caller pins the cached file for itself
+                pinned = media_cache.pin(key)
+                if pinned:
+                    return pinned
+                # Another download evicted the unpinned file before this caller resumed
+                logger.warning(f"Cached download of {url} was evicted before use, fetching it again")
             return None
 
+        except (QueueFullError, DownloadRejected):
+            raise
         except Exception as e:
             logger.error(f"Error downloading video: {str(e)}")
             return None
 
+    async def probe(self, url: str, key: str) -> Dict:
+        """Extract a link's metadata without downloading any media (cached and coalesced)."""
+        info = self._probes.get(key)
+        if info is None:
+            info = await self.probe_flights.do(key, lambda: self._probe(url, key))
+        return info
+
+    async def _probe(self, url: str, key: str) -> Dict:
+        ydl_opts = {'quiet': True, 'no_warnings': True, 'noplaylist': True}
+        info = await download_scheduler.run(
+            url,
+            lambda: yt_dlp.YoutubeDL(ydl_opts).extract_info(url, download=False)
+        )
+        self._probes.set(key, info)
+        return info
+
+    async def _fetch_video(self, url: str, key: str) -> bool:
+        """Probe a video, pick a format that fits, and download it into the media cache without pinning it."""
+        probed = await self.probe(url, key)
+        if not probed:
+            return False
+
+        duration = probed.get('duration') or 0
+        if duration > self.max_video_duration:
+            raise DownloadRejected('too_long', f"Video is {duration:.0f}s long, limit is {self.max_video_duration}s")
+        selected = select_format(probed, self.max_video_size)
+        if not selected:
+            raise DownloadRejected('too_large', f"No format of {url} fits in {self.max_video_size} bytes")
+        spec, estimated = selected
+        logger.info(f"Selected format {spec} for {url} (~{(estimated or 0) / 1048576:.1f} MB)")
+
+        ydl_opts = {
+            'format': spec,
+            # Unique name per download, so a download never shares a partial file
+            'outtmpl': str(media_cache.staging_dir / f'{uuid4().hex}.%(ext)s'),
+            'quiet': True,
+            'noprogress': True,
+            'no_warnings': True,
+            'noplaylist': True,
+            'concurrent_fragment_downloads': 4,
+            'max_filesize': self.max_video_size,  # Still enforced for estimates that were off
+            'merge_output_format': 'mp4',
+        }
+
+        # Re-use the probed metadata instead of extracting the page a second time
+        result = await download_scheduler.run(
+            url,
+            lambda: yt_dlp.YoutubeDL(ydl_opts).process_ie_result(copy.deepcopy(probed), download=True)
+        )
+
+        if not result or not result.get('requested_downloads'):
+            return False
+        info = {
+            'title': result.get('title', 'Unknown'),
+            'duration': result.get('duration', 0),
+            'thumbnail': result.get('thumbnail')
+        }
+        media_cache.put(key, Path(result['requested_downloads'][0]['_filename']), info, pin=False)
+        return True
+
+    def release_video(self, video_info: Dict) -> None:
+        """Let the media cache evict a video returned by download_video again."""
+        media_cache.release(video_info['cache_key'])
+
+    async def download_recognition_audio(self, url: str) -> Optional[Path]:
+        """Download a link's smallest audio-only stream, for music recognition.
+
+        Returns None when the link has no separate audio stream or the download fails;
+        the caller owns the returned temporary file.
+        """
+        try:
+            probed = await self.probe(url, await media_cache.resolve_key(url))
+            audio_formats = [
+                f for f in probed.get('formats') or []
+                if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')
+            ]
+            if not audio_formats:
+                return None
+            smallest = min(audio_formats, key=lambda f: f.get('abr') or f.get('tbr') or float('inf'))
+
+            ydl_opts = self._get_ydl_opts(self.temp_dir / f'{uuid4().hex}.%(ext)s', is_audio=True)
+            ydl_opts['format'] = smallest['format_id']
+            result = await download_scheduler.run(
+                url,
+                lambda: yt_dlp.YoutubeDL(ydl_opts).process_ie_result(copy.deepcopy(probed), download=True)
+            )
+            if result and result.get('requested_downloads'):
+                return Path(result['requested_downloads'][0]['_filename'])
+            return None
+
+        except Exception as e:
+            logger.error(f"Error downloading recognition audio: {str(e)}")
+            return None
+
+    def _get_ydl_opts(self, outtmpl: Path, is_audio: bool = False) -> Dict:
+        """Build yt-dlp options for a single-file download."""
+        return {
+            'format': 'bestaudio[ext=m4a]/bestaudio/best' if is_audio else 'best[ext=mp4]/best',
+            'outtmpl': str(outtmpl),
+            'quiet': True,
+            'noprogress': True,
+            'no_warnings': True,
+            'noplaylist': True,
+            'max_filesize': 50 * 1024 * 1024,
+        }
+
     async def download_audio(self, url: str, title: str) -> Optional[Dict]:
         """Download audio from URL using yt-dlp."""
         try:
-            ydl_opts = self._get_ydl_opts(self.temp_dir / f'{title}.%(ext)s', is_audio=True)
+            # The title is only metadata; names with '/' would break the output path
+            ydl_opts = self._get_ydl_opts(self.temp_dir / f'{uuid4().hex}.%(ext)s', is_audio=True)
 
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
+            result = await download_scheduler.run(
+                url,
                 lambda: yt_dlp.YoutubeDL(ydl_opts).extract_info(url, download=True)
             )
 
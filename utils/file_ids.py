@@ -0,0 +1,90 @@
+import os
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional, Dict
+from telegram import Message
+from telegram.error import BadRequest
+from utils.cache import LRUCache
+from utils.database import db
+
+logger = logging.getLogger(__name__)
+
+class FileIdCache:
+    """Re-sends media by the Telegram file_id of an earlier upload of the same source.
+
+    Source keys name what was sent, e.g. "video:youtube:<id>" or "audio:<track key>".
+    The mapping is persisted in the database, with an in-process LRU in front of it.
+    """
+
+    # telegram_files.source_key is a VARCHAR(512)
+    MAX_KEY_LENGTH = 512
+
+    def __init__(self):
+        self._file_ids = LRUCache(maxsize=int(os.getenv('FILE_ID_CACHE_SIZE', 10000)))
+        self.reused = 0
+        self.uploaded = 0
+        self.rejected = 0
+
+    @staticmethod
+    def track_key(music_info: Dict) -> str:
+        """Get the source key of a recognized or searched track, the same wherever it is sent from."""
+        return f"audio:{music_info.get('key') or music_info['url']}"
+
+    def _key(self, source_key: str) -> str:
+        if len(source_key) <= self.MAX_KEY_LENGTH:
+            return source_key
+        return f"sha256:{hashlib.sha256(source_key.encode()).hexdigest()}"
+
+    async def get(self, source_key: str) -> Optional[str]:
+        """Get the file_id uploaded earlier for a source, if any."""
+        key = self._key(source_key)
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id = await db.get_file_id(key)
+            if file_id:
+                self._file_ids.set(key, file_id)
+        return file_id
+
+    async def send(self, message: Message, media_type: str, source_key: str, path: Optional[Path], **kwargs) -> Optional[Message]:
+        """Reply with a 'video' or 'audio', by file_id when possible and by uploading path otherwise.
+
+        Returns None without sending when there is no usable file_id and no path.
+        """
+        send = message.reply_video if media_type == 'video' else message.reply_audio
+        key = self._key(source_key)
+
+        file_id = await self.get(key)
+        if file_id:
+            try:
+                sent = await send(file_id, **kwargs)
+                self.reused += 1
+                return sent
+            except BadRequest as e:
+                # Deleted bot, file purged by Telegram, or a type mismatch
+                logger.warning(f"Telegram rejected cached file_id for {key}, uploading again: {e}")
+                self.rejected += 1
+                self._file_ids.pop(key)
+                await db.forget_file_id(key)
+
+        if path is None:
+            return None
+        sent = await send(Path(path), **kwargs)
+        self.uploaded += 1
+
+        media = getattr(sent, media_type, None) or sent.document
+        if media:
+            self._file_ids.set(key, media.file_id)
+            await db.save_file_id(key, media_type, media.file_id)
+        return sent
+
+    def stats(self) -> Dict:
+        """Get reuse and upload counters."""
+        return {
+            'reused': self.reused,
+            'uploaded': self.uploaded,
+            'rejected': self.rejected,
+        }
+
+# Create a singleton instance
+file_ids = FileIdCache()
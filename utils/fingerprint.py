@@ -0,0 +1,219 @@
+import os
+import json
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple
+import aiosqlite
+import numpy as np
+from utils.media import SAMPLE_RATE, pcm_to_float32
+
+logger = logging.getLogger(__name__)
+
+# Spectrogram: 128 ms frames every 32 ms, keeping bins up to 4 kHz
+FFT_SIZE = 2048
+HOP = 512
+MAX_BIN = 512
+# A peak is the loudest point within this many frames and bins around it
+PEAK_FRAMES = 15
+PEAK_BINS = 15
+PEAKS_PER_SECOND = 30
+# Each peak is paired with the next FAN_OUT peaks up to MAX_DT frames later
+FAN_OUT = 10
+MAX_DT = 63
+
+def _max_filter(values: np.ndarray, size: int, axis: int) -> np.ndarray:
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (size // 2, size // 2)
+    padded = np.pad(values, pad, constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, size, axis=axis).max(axis=-1)
+
+def find_peaks(pcm: bytes) -> List[Tuple[int, int]]:
+    """Find the (frame, bin) spectral peaks of 16 kHz PCM, sorted by time."""
+    samples = pcm_to_float32(pcm)
+    if len(samples) < FFT_SIZE + HOP * PEAK_FRAMES:
+        return []
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[::HOP]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FFT_SIZE).astype(np.float32), axis=1))[:, :MAX_BIN]
+    spectrum = np.log(spectrum + 1e-6)
+
+    local_max = _max_filter(_max_filter(spectrum, PEAK_BINS, 1), PEAK_FRAMES, 0)
+    frame_idx, bin_idx = np.nonzero((spectrum == local_max) & (spectrum > np.median(spectrum)))
+
+    # Keep the strongest peaks, so density does not depend on loudness
+    limit = int(PEAKS_PER_SECOND * len(samples) / SAMPLE_RATE)
+    if len(frame_idx) > limit:
+        strongest = np.argsort(spectrum[frame_idx, bin_idx])[::-1][:limit]
+        frame_idx, bin_idx = frame_idx[strongest], bin_idx[strongest]
+    order = np.lexsort((bin_idx, frame_idx))
+    return list(zip(frame_idx[order].tolist(), bin_idx[order].tolist()))
+
+def fingerprint(pcm: bytes) -> List[Tuple[int, int]]:
+    """Get the (hash, frame) landmarks of 16 kHz PCM.
+
+    A hash packs two nearby peaks' frequencies and their time distance, so it
+    survives gain changes, re-encoding and a different start point.
+    """
+    peaks = find_peaks(pcm)
+    hashes = []
+    for i, (frame, freq) in enumerate(peaks):
+        paired = 0
+        for next_frame, next_freq in peaks[i + 1:]:
+            dt = next_frame - frame
+            if dt == 0:
+                continue
+            if dt > MAX_DT or paired >= FAN_OUT:
+                break
+            hashes.append(((freq << 16) | (next_freq << 6) | dt, frame))
+            paired += 1
+    return hashes
+
+class FingerprintIndex:
+    """Local index of spectral-peak fingerprints of tracks Shazam has matched before.
+
+    Clips of the same trending songs arrive over and over; once Shazam has named
+    one, later clips are matched here without an external call. A clip matches
+    when at least FINGERPRINT_MIN_MATCHES hashes line up at the same time offset.
+    Only the window Shazam matched is indexed, so every clip stays a few seconds long.
+    The index lives in its own SQLite file (FINGERPRINT_DB_PATH) and keeps the
+    newest FINGERPRINT_MAX_CLIPS clips; older ones are dropped as new ones come in.
+    """
+
+    # Bound on SQL variables per lookup query
+    QUERY_CHUNK = 500
+
+    def __init__(self):
+        self.enabled = os.getenv('FINGERPRINT_INDEX', '1').lower() in ('1', 'true', 'yes')
+        self.path = os.getenv('FINGERPRINT_DB_PATH', 'data/fingerprints.db')
+        self.min_matches = int(os.getenv('FINGERPRINT_MIN_MATCHES', 20))
+        self.max_clips = int(os.getenv('FINGERPRINT_MAX_CLIPS', 5000))
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.indexed = 0
+        self.evicted = 0
+
+    async def _get_conn(self) -> aiosqlite.Connection:
+        async with self._connect_lock:
+            if self._conn is None:
+                if self.path != ':memory:':
+                    Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                conn = await aiosqlite.connect(self.path)
+                await conn.execute("PRAGMA journal_mode = WAL")
+                await conn.execute("PRAGMA synchronous = NORMAL")
+                await conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS clips (
+                        clip_id INTEGER PRIMARY KEY,
+                        track_key TEXT,
+                        info TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+                    );
+                    CREATE TABLE IF NOT EXISTS hashes (
+                        hash INTEGER NOT NULL,
+                        clip_id INTEGER NOT NULL,
+                        frame INTEGER NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_hashes_hash ON hashes (hash);
+                    CREATE INDEX IF NOT EXISTS idx_hashes_clip ON hashes (clip_id);
+                """)
+                self._conn = conn
+            return self._conn
+
+    async def match(self, pcm: bytes) -> Optional[Dict]:
+        """Get the music_info of an indexed track the clip comes from, if any."""
+        if not self.enabled:
+            return None
+        try:
+            hashes = await asyncio.to_thread(fingerprint, pcm)
+            if not hashes:
+                return None
+            query_frames = defaultdict(list)
+            for value, frame in hashes:
+                query_frames[value].append(frame)
+
+            conn = await self._get_conn()
+            votes = Counter()
+            keys = list(query_frames)
+            for i in range(0, len(keys), self.QUERY_CHUNK):
+                chunk = keys[i:i + self.QUERY_CHUNK]
+                query = f"SELECT hash, clip_id, frame FROM hashes WHERE hash IN ({','.join('?' * len(chunk))})"
+                async with conn.execute(query, chunk) as cursor:
+                    async for value, clip_id, frame in cursor:
+                        for query_frame in query_frames[value]:
+                            votes[(clip_id, frame - query_frame)] += 1
+
+            if votes:
+                # Frame boundaries rarely line up exactly; count neighbouring offsets too
+                (clip_id, offset), _ = votes.most_common(1)[0]
+                score = sum(votes[(clip_id, offset + d)] for d in (-1, 0, 1))
+                if score >= self.min_matches:
+                    async with conn.execute("SELECT info FROM clips WHERE clip_id = ?", (clip_id,)) as cursor:
+                        row = await cursor.fetchone()
+                    if row:
+                        self.hits += 1
+                        logger.info(f"Fingerprint index matched clip {clip_id} with {score} aligned hashes")
+                        return json.loads(row[0])
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.error(f"Error querying fingerprint index: {e}")
+            return None
+
+    async def add(self, music_info: Dict, pcm: bytes) -> None:
+        """Index a clip of a track Shazam has recognized; pcm is the window it matched on."""
+        if not self.enabled:
+            return
+        try:
+            hashes = await asyncio.to_thread(fingerprint, pcm)
+            if not hashes:
+                return
+            conn = await self._get_conn()
+            async with self._write_lock:
+                cursor = await conn.execute(
+                    "INSERT INTO clips (track_key, info) VALUES (?, ?)",
+                    (music_info.get('key'), json.dumps(music_info))
+                )
+                clip_id = cursor.lastrowid
+                await conn.executemany(
+                    "INSERT INTO hashes (hash, clip_id, frame) VALUES (?, ?, ?)",
+                    [(value, clip_id, frame) for value, frame in hashes]
+                )
+                evicted = await self._evict(conn)
+                await conn.commit()
+            self.evicted += evicted
+            self.indexed += 1
+            logger.info(f"Indexed {len(hashes)} fingerprint hashes for {music_info.get('title')}")
+        except Exception as e:
+            logger.error(f"Error adding to fingerprint index: {e}")
+
+    async def _evict(self, conn: aiosqlite.Connection) -> int:
+        """Delete the oldest clips beyond max_clips, with their hashes; returns how many were deleted."""
+        async with conn.execute("SELECT clip_id FROM clips ORDER BY clip_id DESC LIMIT 1 OFFSET ?", (self.max_clips,)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return 0
+        await conn.execute("DELETE FROM hashes WHERE clip_id <= ?", row)
+        cursor = await conn.execute("DELETE FROM clips WHERE clip_id <= ?", row)
+        return cursor.rowcount
+
+    async def close(self) -> None:
+        """Close the index database."""
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def stats(self) -> Dict:
+        """Get local match and indexing counters."""
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'indexed': self.indexed,
+            'evicted': self.evicted,
+        }
+
+# Create a singleton instance
+fingerprint_index = FingerprintIndex()
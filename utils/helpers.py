@@ -1,6 +1,6 @@
 import logging
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from pathlib import Path
 import mimetypes
 
@@ -60,6 +60,19 @@ class Helpers:
             size_bytes /= 1024
         return f"{size_bytes:.1f} TB"
 
+    @staticmethod
+    def check_limits(size: int, duration: Optional[float], max_size: int, max_duration: float) -> List[str]:
+        """Describe every size or duration limit a file exceeds."""
+        errors = []
+        
+        if size > max_size:
+            errors.append(f"File too large ({Helpers.format_file_size(size)}). Maximum size: {Helpers.format_file_size(max_size)}")
+        
+        if duration and duration > max_duration:
+            errors.append(f"File too long ({Helpers.format_duration(duration)}). Maximum duration: {Helpers.format_duration(max_duration)}")
+
+        return errors
+
     @staticmethod
     def validate_file(file_path: Path, max_size: int, max_duration: float) -> Dict:
         """Validate file size and duration."""
@@ -67,13 +80,7 @@ class Helpers:
         if not file_info:
             return {'valid': False, 'error': 'File not found'}
 
-        errors = []
-        
-        if file_info['size'] > max_size:
-            errors.append(f"File too large ({Helpers.format_file_size(file_info['size'])}). Maximum size: {Helpers.format_file_size(max_size)}")
-        
-        if 'duration' in file_info and file_info['duration'] > max_duration:
-            errors.append(f"File too long ({Helpers.format_duration(file_info['duration'])}). Maximum duration: {Helpers.format_duration(max_duration)}")
+        errors = Helpers.check_limits(file_info['size'], file_info.get('duration'), max_size, max_duration)
 
         return {
             'valid': len(errors) == 0,
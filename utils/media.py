@@ -0,0 +1,149 @@
+import os
+import io
+import wave
+import asyncio
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+import numpy as np
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Shazam signatures and Whisper both work on 16 kHz mono
+SAMPLE_RATE = 16000
+
+# Uploads up to this size are kept in memory and decoded over ffmpeg's pipes;
+# larger ones go through a file on disk
+MEMORY_LIMIT = int(float(os.getenv('MEDIA_MEMORY_LIMIT_MB', 8)) * 1024 * 1024)
+
+# A media file on disk, or its raw bytes in memory
+MediaSource = Union[Path, bytes]
+
+def describe(source: MediaSource) -> str:
+    """Name a media source for log messages."""
+    return str(source) if isinstance(source, Path) else f"<{len(source)} bytes in memory>"
+
+def source_key(source: MediaSource) -> str:
+    """Identify a media source: its path, or a digest of in-memory content."""
+    return str(source) if isinstance(source, Path) else f"sha1:{hashlib.sha1(source).hexdigest()}"
+
+def pcm_duration(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> float:
+    """Get the length in seconds of 16-bit mono PCM."""
+    return len(pcm) / (2 * sample_rate)
+
+def pcm_to_float32(pcm: bytes) -> np.ndarray:
+    """Convert 16-bit PCM to the float32 samples in [-1, 1] that Whisper takes."""
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+async def _run_ffmpeg(command: list, data: Optional[bytes], label: str) -> Optional[bytes]:
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE if data is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate(input=data)
+    except Exception as e:
+        logger.error(f"Error running ffmpeg on {label}: {e}")
+        return None
+    if process.returncode != 0:
+        logger.error(f"ffmpeg failed for {label}. Stderr: {stderr.decode()}")
+        return None
+    return stdout
+
+async def decode_pcm(source: MediaSource, sample_rate: int = SAMPLE_RATE) -> Optional[bytes]:
+    """Decode a file's audio to 16-bit mono PCM on ffmpeg's stdout.
+
+    In-memory sources are fed over stdin.
+    """
+    command = ['ffmpeg', '-nostdin', '-v', 'error'] if isinstance(source, Path) else ['ffmpeg', '-v', 'error']
+    output = ['-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-']
+
+    if isinstance(source, Path):
+        return await _run_ffmpeg(command + ['-i', str(source)] + output, None, describe(source))
+
+    pcm = await _run_ffmpeg(command + ['-i', 'pipe:0'] + output, source, describe(source))
+    if pcm is None:
+        # Containers with their index at the end (e.g. MP4 without faststart)
+        # cannot be read from a pipe; retry from a temporary file
+        with tempfile.NamedTemporaryFile(prefix="vortex_", suffix=".media") as tmp:
+            await asyncio.to_thread(tmp.write, source)
+            await asyncio.to_thread(tmp.flush)
+            pcm = await _run_ffmpeg(command + ['-i', tmp.name] + output, None, describe(source))
+    return pcm
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Wrap 16-bit mono PCM in a WAV container, in memory."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+class PreparedMedia:
+    """A media source decoded once to 16 kHz mono PCM, shared by every consumer.
+
+    Music recognition slices its windows out of the same buffer that
+    transcription reads, so neither runs ffprobe or ffmpeg again.
+    """
+
+    def __init__(self, key: str, label: str, pcm: bytes):
+        self.key = key
+        self.label = label
+        self.pcm = pcm
+        self._samples = None
+        self._digest = None
+
+    @property
+    def duration(self) -> float:
+        """Length of the decoded audio in seconds."""
+        return pcm_duration(self.pcm)
+
+    def clip(self, start: float, duration: float) -> bytes:
+        """Get the PCM of a window of the audio."""
+        offset = int(start * SAMPLE_RATE) * 2
+        return self.pcm[offset:offset + int(duration * SAMPLE_RATE) * 2]
+
+    def digest(self) -> str:
+        """Get a hash of the decoded audio, identical for the same content in any container."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.pcm).hexdigest()
+        return self._digest
+
+    def samples(self) -> np.ndarray:
+        """Get the audio as the float32 samples Whisper takes, converting at most once."""
+        if self._samples is None:
+            self._samples = pcm_to_float32(self.pcm)
+        return self._samples
+
+class MediaPreparer:
+    """Decodes each media source once, coalescing concurrent requests for the same media."""
+
+    def __init__(self):
+        self.flights = SingleFlight("media preparation")
+
+    async def prepare(self, source: MediaSource, key: Optional[str] = None) -> Optional[PreparedMedia]:
+        """Decode a media file or in-memory bytes, or None if it has no decodable audio.
+
+        key identifies the media across requests (e.g. a Telegram file_unique_id);
+        it defaults to the file path or a digest of the bytes.
+        """
+        key = key or source_key(source)
+        return await self.flights.do(key, lambda: self._prepare(source, key))
+
+    async def _prepare(self, source: MediaSource, key: str) -> Optional[PreparedMedia]:
+        pcm = await decode_pcm(source)
+        if not pcm:
+            logger.info(f"No decodable audio in {describe(source)}")
+            return None
+        logger.info(f"Decoded {pcm_duration(pcm):.1f}s of audio from {describe(source)}")
+        return PreparedMedia(key, describe(source), pcm)
+
+# Create a singleton instance
+media_preparer = MediaPreparer()
@@ -0,0 +1,223 @@
+import os
+import json
+import asyncio
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional, Dict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from yt_dlp.extractor import gen_extractor_classes
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = {'si', 'feature', 'igsh', 'igshid', 'fbclid', 'gclid', 'is_from_webapp', 'sender_device', 'pp'}
+
+def normalize_url(url: str) -> str:
+    """Canonicalize a URL so the same video shared in different ways maps to one key."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS and not k.startswith('utm_')
+    )
+    return urlunsplit(('https', host, parts.path.rstrip('/') or '/', urlencode(query), ''))
+
+class MediaCache:
+    """On-disk cache of downloaded media, keyed by extractor video id or normalized URL.
+
+    Entries are files in cache_dir plus a JSON index. The cache keeps total size under
+    max_bytes by evicting least recently used entries and drops entries older than ttl.
+    Callers pin an entry while they use its file (acquire/put) and unpin it with
+    release, and pinned entries are never evicted.
+    """
+
+    def __init__(self):
+        self.cache_dir = Path(os.getenv('MEDIA_CACHE_DIR', Path(tempfile.gettempdir()) / "vortex_bot" / "cache"))
+        self.max_bytes = int(float(os.getenv('MEDIA_CACHE_MAX_MB', 1024)) * 1024 * 1024)
+        self.ttl = float(os.getenv('MEDIA_CACHE_TTL', 86400))
+        self.index_path = self.cache_dir / "index.json"
+        # Downloads land here first, so moving them into the cache is a rename
+        self.staging_dir = self.cache_dir / "incoming"
+        self._entries: Dict[str, Dict] = {}
+        self._pins: Dict[str, int] = {}
+        self._keys = LRUCache(maxsize=4096)
+        self._extractors = None
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key_for(self, url: str) -> str:
+        """Get the cache key for a URL: extractor and video id when known offline, else the normalized URL.
+
+        Matching a new URL tries every extractor's pattern, so async callers use resolve_key.
+        """
+        normalized = normalize_url(url)
+        key = self._keys.get(normalized)
+        if key is None:
+            key = self._match_key(url, normalized)
+            self._keys.set(normalized, key)
+        return key
+
+    async def resolve_key(self, url: str) -> str:
+        """Get the cache key for a URL, matching it against the extractors off the event loop."""
+        normalized = normalize_url(url)
+        key = self._keys.get(normalized)
+        if key is None:
+            key = await asyncio.to_thread(self._match_key, url, normalized)
+            self._keys.set(normalized, key)
+        return key
+
+    def _match_key(self, url: str, normalized: str) -> str:
+        if self._extractors is None:
+            # Built once; the extractors compile their URL patterns on first use
+            self._extractors = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+        for ie in self._extractors:
+            if not ie.suitable(url):
+                continue
+            try:
+                video_id = ie.get_temp_id(url)
+            except Exception:
+                video_id = None
+            if video_id:
+                return f"{ie.ie_key().lower()}:{video_id}"
+            break
+        return f"url:{normalized}"
+
+    def _load(self) -> None:
+        """Read the index on first use, forgetting entries whose file is gone."""
+        if self._loaded:
+            return
+        self._loaded = True
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        # Partial downloads from a previous run are never picked up again
+        for leftover in self.staging_dir.iterdir():
+            leftover.unlink(missing_ok=True)
+        try:
+            entries = json.loads(self.index_path.read_text())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable media cache index: {e}")
+            return
+        self._entries = {key: e for key, e in entries.items() if Path(e['filename']).is_file()}
+        self._evict()
+
+    def _save(self) -> None:
+        """Write the index atomically."""
+        tmp = self.index_path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(self._entries))
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            logger.error(f"Error saving media cache index: {e}")
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return now - entry['created'] > self.ttl
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        try:
+            Path(entry['filename']).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing cached file {entry['filename']}: {e}")
+        self.evictions += 1
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Drop expired entries, then least recently used ones until under max_bytes.
+
+        Pinned entries and `keep` (the entry just added) are never dropped.
+        """
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if self._expired(e, now) and not self._pins.get(k) and k != keep]:
+            self._remove(key)
+        total = sum(e['size'] for e in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if self._pins.get(key) or key == keep:
+                continue
+            total -= self._entries[key]['size']
+            self._remove(key)
+        self._save()
+
+    def acquire(self, key: str) -> Optional[Dict]:
+        """Get a cached entry's info and pin it, or None on a miss."""
+        self._load()
+        entry = self._entries.get(key)
+        if entry and self._expired(entry, time.time()) and not self._pins.get(key):
+            self._remove(key)
+            self._save()
+            entry = None
+        if not entry:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.pin(key)
+
+    def pin(self, key: str) -> Optional[Dict]:
+        """Pin an entry without counting a lookup, or return None if it is gone."""
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        entry['last_access'] = time.time()
+        self._pins[key] = self._pins.get(key, 0) + 1
+        return {**entry['info'], 'filename': entry['filename'], 'cache_key': key}
+
+    def put(self, key: str, path: Path, info: Dict, pin: bool = True) -> Dict:
+        """Move a freshly downloaded file into the cache, pin it unless asked not to and return its info."""
+        self._load()
+        target = self.cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()[:32]}{path.suffix}"
+        if key in self._entries and self._entries[key]['filename'] != str(target):
+            self._remove(key)
+        # Replacing a file that a pinned reader has open is safe on POSIX; it keeps the old inode
+        shutil.move(str(path), target)
+        now = time.time()
+        self._entries[key] = {
+            'filename': str(target),
+            'size': target.stat().st_size,
+            'created': now,
+            'last_access': now,
+            'info': info,
+        }
+        if pin:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        # An unpinned new entry must still be there for the caller to pin
+        self._evict(keep=key)
+        return {**info, 'filename': str(target), 'cache_key': key}
+
+    def release(self, key: str) -> None:
+        """Unpin an entry returned by acquire or put."""
+        pins = self._pins.get(key, 0) - 1
+        if pins > 0:
+            self._pins[key] = pins
+        else:
+            self._pins.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Get size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': sum(e['size'] for e in self._entries.values()),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+# Create a singleton instance
+media_cache = MediaCache()
@@ -0,0 +1,361 @@
+import os
+import asyncio
+import logging
+from typing import List, Dict, Optional
+from utils.storage import StorageBackend, StorageError, create_backend
+
+logger = logging.getLogger(__name__)
+
+# Ordered schema changes. Each entry lists the statements for every backend.
+# Statements must be safe to run against a database that was created before
+# versioning existed: MySQL errors for tables, columns and indexes that already
+# exist are ignored, and SQLite statements use IF NOT EXISTS.
+# Migrations marked 'offline' copy or lock a large table; the bot never applies
+# them on boot, only `python -m utils.migrations` does, in a maintenance window.
+MIGRATIONS: List[Dict] = [
+    {
+        'version': 1,
+        'description': 'Base users and stats tables',
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                first_name VARCHAR(255),
+                last_name VARCHAR(255),
+                username VARCHAR(255),
+                language_code VARCHAR(10),
+                phone_number VARCHAR(20),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                user_id BIGINT,
+                action_type VARCHAR(50),
+                action_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                first_name TEXT,
+                last_name TEXT,
+                username TEXT,
+                language_code TEXT,
+                phone_number TEXT,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                last_active TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                action_type TEXT,
+                action_time TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+            )
+            """,
+        ],
+    },
+    {
+        'version': 2,
+        'description': 'Add last_name and language_code to users created by early versions',
+        'mysql': [
+            "ALTER TABLE users ADD COLUMN last_name VARCHAR(255) AFTER first_name",
+            "ALTER TABLE users ADD COLUMN language_code VARCHAR(10) AFTER username",
+        ],
+        'sqlite': [],
+    },
+    {
+        'version': 3,
+        'description': 'Indexes for per-user and time-range queries on stats',
+        'mysql': [
+            "CREATE INDEX idx_stats_user_time ON stats (user_id, action_time)",
+            "CREATE INDEX idx_stats_time ON stats (action_time)",
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS idx_stats_user_time ON stats (user_id, action_time)",
+            "CREATE INDEX IF NOT EXISTS idx_stats_time ON stats (action_time)",
+        ],
+    },
+    {
+        'version': 4,
+        'description': 'Daily and per-user rollups for stats, backfilled from existing rows',
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS daily_actions (
+                day DATE NOT NULL,
+                action_type VARCHAR(50) NOT NULL,
+                actions INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, action_type)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS daily_users (
+                day DATE PRIMARY KEY,
+                new_users INT NOT NULL DEFAULT 0
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_action_totals (
+                user_id BIGINT PRIMARY KEY,
+                total_actions INT NOT NULL DEFAULT 0,
+                last_action_time TIMESTAMP NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            # Backfills only run while the rollup is still empty. Rollup days are UTC
+            # days, as the bot keeps them; TIMESTAMP columns read in the session zone.
+            """
+            INSERT INTO daily_users (day, new_users)
+            SELECT DATE(CONVERT_TZ(created_at, @@session.time_zone, '+00:00')), COUNT(*) FROM users
+            WHERE NOT EXISTS (SELECT 1 FROM daily_users)
+            GROUP BY DATE(CONVERT_TZ(created_at, @@session.time_zone, '+00:00'))
+            """,
+            """
+            INSERT INTO user_action_totals (user_id, total_actions, last_action_time)
+            SELECT user_id, COUNT(*), MAX(action_time) FROM stats
+            WHERE user_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM daily_actions)
+            GROUP BY user_id
+            """,
+            """
+            INSERT INTO daily_actions (day, action_type, actions)
+            SELECT DATE(CONVERT_TZ(action_time, @@session.time_zone, '+00:00')), COALESCE(action_type, ''), COUNT(*)
+            FROM stats
+            WHERE NOT EXISTS (SELECT 1 FROM daily_actions)
+            GROUP BY DATE(CONVERT_TZ(action_time, @@session.time_zone, '+00:00')), COALESCE(action_type, '')
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS daily_actions (
+                day DATE NOT NULL,
+                action_type TEXT NOT NULL,
+                actions INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, action_type)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS daily_users (
+                day DATE PRIMARY KEY,
+                new_users INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_action_totals (
+                user_id INTEGER PRIMARY KEY,
+                total_actions INTEGER NOT NULL DEFAULT 0,
+                last_action_time TIMESTAMP
+            )
+            """,
+        ],
+    },
+    {
+        'version': 5,
+        'description': 'Per-day archive for pruned stats rows; drop the stats foreign key',
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS stats_archive (
+                day DATE NOT NULL,
+                user_id BIGINT NOT NULL,
+                action_type VARCHAR(50) NOT NULL,
+                actions INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id, action_type)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            # The write-behind flush already writes users before their actions, and a
+            # partitioned table cannot carry foreign keys. The implicit user_id index
+            # is covered by idx_stats_user_time.
+            "ALTER TABLE stats DROP FOREIGN KEY stats_ibfk_1, ALGORITHM=INPLACE, LOCK=NONE",
+            "ALTER TABLE stats DROP INDEX user_id, ALGORITHM=INPLACE, LOCK=NONE",
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS stats_archive (
+                day DATE NOT NULL,
+                user_id INTEGER NOT NULL,
+                action_type TEXT NOT NULL,
+                actions INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id, action_type)
+            )
+            """,
+        ],
+    },
+    {
+        'version': 6,
+        'description': 'Range-partition stats by action_time so old months can be dropped',
+        # Changing the primary key and partitioning both copy the whole table under lock
+        'offline': True,
+        'mysql': [
+            # The partitioning column must be part of every unique key
+            """
+            ALTER TABLE stats
+                MODIFY action_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (id, action_time)
+            """,
+            # Monthly partitions are split off pmax by the retention job. Every existing
+            # row lands in pmax, so the job's first REORGANIZE PARTITION rewrites the whole
+            # table into the current month's partition (which has no lower bound). On a
+            # large table, run that first split in a maintenance window.
+            """
+            ALTER TABLE stats PARTITION BY RANGE (UNIX_TIMESTAMP(action_time)) (
+                PARTITION pmax VALUES LESS THAN MAXVALUE
+            )
+            """,
+        ],
+        'sqlite': [],
+    },
+    {
+        'version': 7,
+        'description': 'Telegram file_ids of uploaded media, for re-sending without an upload',
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS telegram_files (
+                source_key VARCHAR(512) PRIMARY KEY,
+                media_type VARCHAR(16) NOT NULL,
+                file_id VARCHAR(255) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS telegram_files (
+                source_key TEXT PRIMARY KEY,
+                media_type TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+            )
+            """,
+        ],
+    },
+    {
+        'version': 8,
+        'description': 'Cached music recognition results, including "no music" answers',
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS recognitions (
+                cache_key VARCHAR(512) PRIMARY KEY,
+                result TEXT NULL,
+                expires_at DATETIME NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS recognitions (
+                cache_key TEXT PRIMARY KEY,
+                result TEXT,
+                expires_at TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+            )
+            """,
+        ],
+    },
+    {
+        'version': 9,
+        'description': 'Cached transcripts, evicted least recently used first',
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS transcripts (
+                cache_key VARCHAR(512) PRIMARY KEY,
+                language VARCHAR(16) NOT NULL,
+                transcript MEDIUMTEXT NOT NULL,
+                segments MEDIUMTEXT NOT NULL,
+                last_used DATETIME NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_transcripts_last_used (last_used)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS transcripts (
+                cache_key TEXT PRIMARY KEY,
+                language TEXT NOT NULL,
+                transcript TEXT NOT NULL,
+                segments TEXT NOT NULL,
+                last_used TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_transcripts_last_used ON transcripts (last_used)",
+        ],
+    },
+]
+
+LATEST_VERSION = MIGRATIONS[-1]['version']
+
+async def apply_pending(backend: StorageBackend, current: int, target: Optional[int] = None) -> int:
+    """Apply every migration newer than current (up to target, if given), in order, and return the new version."""
+    for migration in MIGRATIONS:
+        if migration['version'] <= current or (target is not None and migration['version'] > target):
+            continue
+        logger.info(f"Applying migration {migration['version']}: {migration['description']}...")
+        await backend.apply_migration(migration['version'], migration['description'], migration[backend.name])
+        current = migration['version']
+    return current
+
+async def ensure_schema(backend: StorageBackend, auto_migrate: bool) -> None:
+    """Check the schema version on boot and, if allowed, bring it up to date."""
+    current = await backend.get_schema_version()
+
+    if current == LATEST_VERSION:
+        logger.info(f"Database schema is up to date (version {current}).")
+        return
+    if current > LATEST_VERSION:
+        logger.warning(f"Database schema version {current} is newer than this code ({LATEST_VERSION}).")
+        return
+    if not auto_migrate:
+        raise StorageError(
+            f"Database schema is at version {current} but version {LATEST_VERSION} is required. "
+            f"Run `python -m utils.migrations` to apply pending migrations."
+        )
+
+    offline = [
+        m for m in MIGRATIONS
+        if m['version'] > current and m.get('offline') and m[backend.name]
+    ]
+    if offline:
+        # Apply what can run online, then leave the rest to the migrate command
+        current = await apply_pending(backend, current, offline[0]['version'] - 1)
+        raise StorageError(
+            f"Database schema is at version {current} and migration {offline[0]['version']} "
+            f"({offline[0]['description']}) locks large tables, so it is not applied on boot. "
+            f"Run `python -m utils.migrations` in a maintenance window."
+        )
+
+    current = await apply_pending(backend, current)
+    logger.info(f"Database schema migrated to version {current}.")
+
+async def migrate() -> None:
+    """Apply pending migrations out of band, creating the database if needed."""
+    backend = create_backend(os.getenv('DB_BACKEND', 'mysql').lower())
+    await backend.connect(create_database=True)
+    try:
+        current = await backend.get_schema_version()
+        if current >= LATEST_VERSION:
+            logger.info(f"Nothing to migrate; schema is at version {current}.")
+            return
+        current = await apply_pending(backend, current)
+        logger.info(f"Database schema migrated to version {current}.")
+    finally:
+        await backend.close()
+
+def main() -> None:
+    """Entry point for `python -m utils.migrations`."""
+    from dotenv import load_dotenv
+    from logging_config import setup_logging
+
+    setup_logging()
+    load_dotenv()
+    asyncio.run(migrate())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Tuple
+from utils.cache import LRUCache
+from utils.database import db
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class RecognitionCache:
+    """Remembers music recognition results, so the same media is not sent to Shazam again.
+
+    Keys are "tg:<file_unique_id>" for Telegram uploads and "audio:<sha256>" of the
+    decoded audio for link downloads. Matches are kept for RECOGNITION_CACHE_TTL
+    seconds and "no music" answers for RECOGNITION_NEGATIVE_TTL, in the database
+    with an in-process LRU in front of it.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv('RECOGNITION_CACHE_TTL', 30 * 86400))
+        self.negative_ttl = float(os.getenv('RECOGNITION_NEGATIVE_TTL', 86400))
+        self._results = LRUCache(maxsize=int(os.getenv('RECOGNITION_CACHE_SIZE', 10000)))
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Tuple[bool, Optional[Dict]]:
+        """Get (found, music_info) for a key; music_info is None for a cached "no music" answer."""
+        music_info = self._results.get(key, _MISSING)
+        if music_info is _MISSING:
+            row = await db.get_recognition(key)
+            if row is None:
+                self.misses += 1
+                return False, None
+            music_info = json.loads(row['result']) if row['result'] else None
+            remaining = (row['expires_at'] - datetime.now()).total_seconds()
+            self._results.set(key, music_info, ttl=max(remaining, 1.0))
+
+        if music_info:
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        return True, music_info
+
+    async def put(self, key: str, music_info: Optional[Dict]) -> None:
+        """Remember a match, or a "no music" answer when music_info is None."""
+        ttl = self.ttl if music_info else self.negative_ttl
+        if ttl <= 0:
+            return
+        self._results.set(key, music_info, ttl=ttl)
+        await db.save_recognition(
+            key,
+            json.dumps(music_info) if music_info else None,
+            datetime.now() + timedelta(seconds=ttl)
+        )
+
+    def stats(self) -> Dict:
+        """Get hit and miss counters."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+# Create a singleton instance
+recognition_cache = RecognitionCache()
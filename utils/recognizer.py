@@ -1,85 +1,164 @@
-import logging
+import os
 import asyncio
-from typing import Optional, Dict
+import logging
+from typing import Optional, Dict, List, Tuple
 import tempfile
-from shazamio import Shazam
+import aiohttp
+from aiohttp_retry import ExponentialRetry
+from shazamio import Shazam, HTTPClient
+from shazamio.exceptions import FailedDecodeJson
 from pathlib import Path
+from utils.singleflight import SingleFlight
+from utils.downloader import downloader
+from utils.media_cache import media_cache
+from utils.media import PreparedMedia, media_preparer, pcm_to_wav
+from utils.recognition_cache import recognition_cache
+from utils.fingerprint import fingerprint_index
+from utils.resilience import ServiceGuard, ServiceUnavailable
 
 logger = logging.getLogger(__name__)
 
 class MusicRecognizer:
     def __init__(self):
-        self.shazam = Shazam()
+        # Retries are ours to budget: shazamio's own client would retry a 429 up to 20 times
+        self.shazam = Shazam(http_client=HTTPClient(retry_options=ExponentialRetry(attempts=1)))
+        self.guard = ServiceGuard(
+            "Shazam",
+            rate=float(os.getenv('SHAZAM_RATE', 2)),
+            burst=int(os.getenv('SHAZAM_BURST', 5)),
+            max_waiting=int(os.getenv('SHAZAM_QUEUE_LIMIT', 20)),
+            timeout=float(os.getenv('SHAZAM_TIMEOUT', 10)),
+            attempts=int(os.getenv('SHAZAM_ATTEMPTS', 3)),
+            backoff=float(os.getenv('SHAZAM_BACKOFF', 0.5)),
+            retry_ratio=float(os.getenv('SHAZAM_RETRY_RATIO', 0.2)),
+            breaker_threshold=int(os.getenv('SHAZAM_BREAKER_THRESHOLD', 5)),
+            breaker_reset=float(os.getenv('SHAZAM_BREAKER_RESET', 30)),
+            transient_errors=(aiohttp.ClientError, FailedDecodeJson),
+        )
         self.temp_dir = Path(tempfile.gettempdir()) / "vortex_bot"
         self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.flights = SingleFlight("music recognition")
+        # Shazam only needs a few seconds: query RECOGNITION_WINDOW-second clips
+        # centred at these fractions of the file, and stop at the first match
+        self.window = float(os.getenv('RECOGNITION_WINDOW', 12))
+        self.window_positions = [float(p) for p in os.getenv('RECOGNITION_POSITIONS', '0.3,0.6,0.1').split(',')]
 
-    async def recognize_music(self, file_path: Path) -> Optional[Dict]:
-        """Recognize music from a media file by first extracting audio with ffmpeg."""
-        logger.info(f"Starting music recognition for {file_path}")
-        
-        audio_file_to_process = file_path
-        temp_audio_file = None
-
-        video_extensions = ['.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v']
-        if file_path.suffix.lower() in video_extensions:
-            logger.info(f"Video file detected. Extracting audio with ffmpeg from {file_path}")
-            temp_audio_file = self.temp_dir / f"{file_path.stem}.mp3"
-            
-            command = [
-                'ffmpeg',
-                '-i', str(file_path),
-                '-vn',          # No video
-                '-acodec', 'libmp3lame',
-                '-q:a', '2',    # Audio quality
-                '-y',           # Overwrite output
-                str(temp_audio_file)
-            ]
-
-            process = await asyncio.create_subprocess_exec(
-                *command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-
-            if process.returncode != 0:
-                logger.error(f"ffmpeg failed for {file_path}. Stderr: {stderr.decode()}")
-                if temp_audio_file.exists():
-                    temp_audio_file.unlink()
-                return None
-            
-            logger.info(f"Audio extracted successfully to {temp_audio_file}")
-            audio_file_to_process = temp_audio_file
-        
-        try:
-            logger.info(f"Processing {audio_file_to_process} with Shazam.")
-            out = await self.shazam.recognize(str(audio_file_to_process))
+    async def recognize_music(self, media: PreparedMedia, cache_key: Optional[str] = None) -> Optional[Dict]:
+        """Recognize music from decoded media, sharing the work with identical in-flight requests.
 
-            if out and out.get('track'):
-                track = out['track']
-                logger.info(f"Music recognized: {track.get('title')} - {track.get('subtitle')}")
-                return {
-                    'title': track.get('title', 'N/A'),
-                    'subtitle': track.get('subtitle', 'N/A'),
-                    'url': track.get('share', {}).get('href')
-                }
-            else:
-                logger.info(f"No music track found for {audio_file_to_process}")
-                return None
-                
-        except Exception as e:
-            logger.error(f"An exception occurred during Shazam recognition: {e}")
-            return None
+        Results are cached under cache_key (e.g. "tg:<file_unique_id>"), which
+        defaults to a hash of the decoded audio. Raises ServiceUnavailable when
+        Shazam is throttling or down and no answer could be had.
+        """
+        return await self.flights.do(media.key, lambda: self._recognize_cached(media, cache_key))
+
+    async def recognize_url(self, url: str) -> Tuple[Optional[PreparedMedia], Optional[Dict]]:
+        """Recognize music from a link's smallest audio-only stream, without waiting for the video.
+
+        Returns the decoded stream along with the match, so it can be transcribed
+        without decoding again. Returns (None, None) when the link has no separate
+        audio stream, so the caller should prepare the downloaded video instead.
+        """
+        key = await media_cache.resolve_key(url)
+        return await self.flights.do(f"url:{key}", lambda: self._recognize_url(url, key))
+
+    async def _recognize_url(self, url: str, key: str) -> Tuple[Optional[PreparedMedia], Optional[Dict]]:
+        audio_path = await downloader.download_recognition_audio(url)
+        if audio_path is None:
+            return None, None
+        try:
+            media = await media_preparer.prepare(audio_path, key=f"audio:{key}")
         finally:
-            if temp_audio_file and temp_audio_file.exists():
-                temp_audio_file.unlink()
-                logger.info(f"Cleaned up temporary audio file: {temp_audio_file}")
+            await downloader.cleanup_file(str(audio_path))
+        if media is None:
+            return None, None
+        return media, await self._recognize_cached(media)
+
+    def _window_starts(self, duration: float) -> List[float]:
+        """Start offsets of the clips to try, spread over the file and in try order."""
+        if duration <= self.window * 1.5:
+            return [0.0]
+        starts = []
+        for position in self.window_positions:
+            start = round(min(max(position * duration - self.window / 2, 0.0), duration - self.window), 1)
+            if start not in starts:
+                starts.append(start)
+        return starts
+
+    async def _recognize_cached(self, media: PreparedMedia, cache_key: Optional[str] = None) -> Optional[Dict]:
+        if cache_key is None:
+            cache_key = f"audio:{await asyncio.to_thread(media.digest)}"
+        found, music_info = await recognition_cache.get(cache_key)
+        if found:
+            logger.info(f"Recognition cache hit for {media.label}")
+            return music_info
+
+        music_info, conclusive = await self._recognize_music(media)
+        # A failed Shazam call is not a "no music" answer and must not be cached as one
+        if not music_info and not conclusive:
+            raise ServiceUnavailable(f"Shazam could not be reached for {media.label}")
+        await recognition_cache.put(cache_key, music_info)
+        return music_info
+
+    async def _recognize_music(self, media: PreparedMedia) -> Tuple[Optional[Dict], bool]:
+        """Recognize music from short clips of decoded media, stopping at the first match.
+
+        The local fingerprint index is tried on every clip before Shazam is
+        called, and each Shazam match is added to it.
+        Returns (music_info, conclusive); conclusive is False when a Shazam call failed.
+        """
+        logger.info(f"Starting music recognition for {media.label}")
+        clips = [(start, media.clip(start, self.window)) for start in self._window_starts(media.duration)]
+
+        for start, pcm in clips:
+            music_info = await fingerprint_index.match(pcm)
+            if music_info:
+                logger.info(f"Music recognized locally for {media.label} @ {start:.0f}s: {music_info.get('title')}")
+                return music_info, True
+
+        conclusive = True
+        for start, pcm in clips:
+            label = f"{media.label} @ {start:.0f}s"
+            try:
+                music_info = await self._query(pcm_to_wav(pcm), label)
+            except ServiceUnavailable as e:
+                # Throttled or down: further windows would fail the same way
+                logger.warning(f"Shazam unavailable for {label}: {e}")
+                return None, False
+            except Exception as e:
+                logger.error(f"An exception occurred during Shazam recognition of {label}: {e}")
+                conclusive = False
+                continue
+            if music_info:
+                # Only the window Shazam matched: indexing whole uploads would grow the index without bound
+                await fingerprint_index.add(music_info, pcm)
+                return music_info, True
+
+        logger.info(f"No music track found for {media.label}")
+        return None, conclusive
+
+    async def _query(self, wav: bytes, label: str) -> Optional[Dict]:
+        """Look up one in-memory WAV clip with Shazam."""
+        logger.info(f"Processing {label} with Shazam.")
+        out = await self.guard.call(lambda: self.shazam.recognize(wav))
+
+        if out and out.get('track'):
+            track = out['track']
+            logger.info(f"Music recognized: {track.get('title')} - {track.get('subtitle')}")
+            return {
+                'key': track.get('key'),
+                'title': track.get('title', 'N/A'),
+                'subtitle': track.get('subtitle', 'N/A'),
+                'artist': track.get('subtitle', 'N/A'),
+                'url': track.get('share', {}).get('href')
+            }
+        return None
 
     async def search_music(self, query: str) -> Optional[Dict]:
         """Search for music on YouTube using recognized track info."""
         try:
             # Search YouTube for the track
-            results = await self.shazam.search(query)
+            results = await self.guard.call(lambda: self.shazam.search_track(query=query, limit=1))
             
             if results and results.get('tracks') and results['tracks'].get('hits'):
                 # Get the first result
@@ -87,7 +166,8 @@ class MusicRecognizer:
                 return {
                     'title': track.get('title', 'Unknown'),
                     'artist': track.get('subtitle', 'Unknown'),
-                    'url': track.get('url')
+                    'url': track.get('url'),
+                    'key': track.get('key')
                 }
             
             return None
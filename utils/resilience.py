@@ -0,0 +1,186 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+class ServiceUnavailable(Exception):
+    """A guarded call was refused or gave up: circuit open, queue full or retries exhausted."""
+
+class TokenBucket:
+    """Allows `rate` calls per second on average and bursts of up to `burst`.
+
+    Callers beyond that wait their turn in FIFO order; once max_waiting callers
+    are queued, new ones are rejected with ServiceUnavailable.
+    """
+
+    def __init__(self, rate: float, burst: int, max_waiting: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_waiting = max_waiting
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self.rejected = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Take a token, waiting for one if needed."""
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ServiceUnavailable(f"Rate limiter queue is full ({self.waiting} waiting)")
+        self.waiting += 1
+        try:
+            async with self._lock:
+                self._refill()
+                if self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= 1
+        finally:
+            self.waiting -= 1
+
+class CircuitBreaker:
+    """Stops calling a failing service for a while.
+
+    After `threshold` consecutive failures the circuit opens and calls are
+    refused for reset_timeout seconds. Then one trial call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Whether a call may be made now."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """End a trial call that neither succeeded nor failed, so the next call can try again."""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+
+class RetryBudget:
+    """Caps retries at a fraction of calls, so retries cannot multiply load during an outage.
+
+    Every call deposits `ratio` tokens, up to `cap`; every retry spends one.
+    """
+
+    def __init__(self, ratio: float, cap: float):
+        self.ratio = ratio
+        self.cap = cap
+        self.balance = cap
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Spend one retry, or return False if the budget is used up."""
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        self.exhausted += 1
+        return False
+
+class ServiceGuard:
+    """Calls an external service through a rate limiter, a timeout, budgeted retries and a circuit breaker.
+
+    Only transient_errors (and timeouts) count as failures and are retried,
+    with full-jitter exponential backoff; any other exception is passed through.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_waiting: int, timeout: float,
+                 attempts: int, backoff: float, retry_ratio: float, breaker_threshold: int,
+                 breaker_reset: float, transient_errors: Tuple[Type[BaseException], ...] = ()):
+        self.name = name
+        self.timeout = timeout
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.transient_errors = (asyncio.TimeoutError,) + tuple(transient_errors)
+        self.limiter = TokenBucket(rate, burst, max_waiting)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.budget = RetryBudget(retry_ratio, cap=max(1.0, burst))
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func() against the service, raising ServiceUnavailable when it cannot be reached."""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.short_circuited += 1
+                raise ServiceUnavailable(f"{self.name} circuit is open")
+            try:
+                await self.limiter.acquire()
+                self.calls += 1
+                result = await asyncio.wait_for(func(), self.timeout)
+            except self.transient_errors as e:
+                self.failures += 1
+                self.breaker.record_failure()
+                attempt += 1
+                if attempt >= self.attempts or not self.breaker.allow() or not self.budget.withdraw():
+                    raise ServiceUnavailable(f"{self.name} call failed after {attempt} attempt(s): {e!r}") from e
+                self.breaker.release()
+                self.retries += 1
+                delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+                logger.warning(f"{self.name} call failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> Dict:
+        """Get breaker state, limiter queue and retry counters."""
+        return {
+            'state': self.breaker.state,
+            'calls': self.calls,
+            'failures': self.failures,
+            'retries': self.retries,
+            'retry_budget': self.budget.balance,
+            'retries_denied': self.budget.exhausted,
+            'short_circuited': self.short_circuited,
+            'waiting': self.limiter.waiting,
+            'rejected': self.limiter.rejected,
+            'times_opened': self.breaker.times_opened,
+        }
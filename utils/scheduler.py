@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """The download queue is full; the request was rejected without waiting."""
+
+class DownloadScheduler:
+    """Runs blocking yt-dlp calls on a dedicated worker pool.
+
+    At most `workers` downloads run at once, and at most the configured limit per
+    host (DOWNLOAD_HOST_LIMITS, e.g. "instagram.com=2,tiktok.com=3"). Requests
+    beyond that wait in a queue of at most queue_limit entries; once it is full,
+    new requests are rejected immediately with QueueFullError.
+    """
+
+    def __init__(self):
+        self.workers = max(1, int(os.getenv('DOWNLOAD_WORKERS', 4)))
+        self.queue_limit = int(os.getenv('DOWNLOAD_QUEUE_LIMIT', 20))
+        self.host_limits = self._parse_host_limits(os.getenv('DOWNLOAD_HOST_LIMITS', ''))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        self._slots = asyncio.Semaphore(self.workers)
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self.waiting = 0
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @staticmethod
+    def _parse_host_limits(value: str) -> Dict[str, int]:
+        limits = {}
+        for item in filter(None, (part.strip() for part in value.split(','))):
+            host, _, limit = item.partition('=')
+            try:
+                limits[host.strip().lower()] = int(limit)
+            except ValueError:
+                logger.warning(f"Ignoring malformed DOWNLOAD_HOST_LIMITS entry: {item}")
+        return limits
+
+    def _host_slot(self, url: str) -> Optional[asyncio.Semaphore]:
+        """Get the semaphore limiting the URL's host, or None if it has no limit."""
+        host = (urlsplit(url).hostname or '').lower()
+        for domain, limit in self.host_limits.items():
+            if host == domain or host.endswith('.' + domain):
+                if domain not in self._host_slots:
+                    self._host_slots[domain] = asyncio.Semaphore(limit)
+                return self._host_slots[domain]
+        return None
+
+    async def run(self, url: str, func: Callable, *args) -> Any:
+        """Run func(*args) on the download pool once a worker and a slot for url's host are free."""
+        if self.waiting >= self.queue_limit:
+            self.rejected += 1
+            raise QueueFullError(f"Download queue is full ({self.waiting} waiting)")
+
+        host_slot = self._host_slot(url)
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            # Take the host slot first, so a request waiting on a busy host does not hold a worker
+            if host_slot:
+                await host_slot.acquire()
+            try:
+                await self._slots.acquire()
+            except BaseException:
+                if host_slot:
+                    host_slot.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.started += 1
+        self.running += 1
+
+        loop = asyncio.get_running_loop()
+
+        def release(_) -> None:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+            if host_slot:
+                host_slot.release()
+
+        try:
+            future = self._executor.submit(func, *args)
+        except RuntimeError:
+            release(None)
+            raise
+        # Free the slots when the download really stops, not when the caller is cancelled
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(release, f))
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        """Get queue depth, concurrency and wait-time metrics."""
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'waiting': self.waiting,
+            'queue_limit': self.queue_limit,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'wait_avg_ms': (self.wait_total / self.started * 1000) if self.started else 0.0,
+            'wait_max_ms': self.wait_max * 1000,
+        }
+
+# Create a singleton instance
+download_scheduler = DownloadScheduler()
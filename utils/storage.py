@@ -0,0 +1,909 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta, timezone
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable
+from urllib.parse import urlparse
+import aiosqlite
+import mysql.connector
+from mysql.connector import pooling
+from mysql.connector import Error
+from mysql.connector import errorcode
+from mysql.connector.errors import PoolError, OperationalError, InterfaceError
+
+logger = logging.getLogger(__name__)
+
+class StorageError(Exception):
+    """A storage operation failed."""
+
+class TransientStorageError(StorageError):
+    """A storage operation failed for a reason that may go away on retry."""
+
+class ConnectionGate:
+    """Hands out a fixed number of connection slots and records how long callers wait."""
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(size)
+        self.acquired = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def acquire(self) -> None:
+        """Wait for a free slot, giving up after timeout seconds."""
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise TransientStorageError(f"Timed out after {self.timeout}s waiting for a database connection")
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.in_use += 1
+
+    def release(self) -> None:
+        """Return a slot."""
+        self.in_use -= 1
+        self._slots.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    @staticmethod
+    def combined_metrics(*gates: 'ConnectionGate') -> Dict:
+        """Get usage and wait-time metrics summed over one or more gates."""
+        acquired = sum(g.acquired for g in gates)
+        wait_total = sum(g.wait_total for g in gates)
+        return {
+            'pool_size': sum(g.size for g in gates),
+            'in_use': sum(g.in_use for g in gates),
+            'waiting': sum(g.waiting for g in gates),
+            'acquired': acquired,
+            'timeouts': sum(g.timeouts for g in gates),
+            'wait_avg_ms': (wait_total / acquired * 1000) if acquired else 0.0,
+            'wait_max_ms': max((g.wait_max for g in gates), default=0.0) * 1000,
+        }
+
+def local_time(value: datetime) -> datetime:
+    """Convert a timestamp to naive server-local time, as the stats tables store it."""
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+def aggregate_actions(actions: List[tuple]) -> tuple:
+    """Fold buffered (user_id, action_type, action_time) rows into rollup increments.
+
+    Rollup days are UTC days, like daily_users; a naive action_time is taken as local time.
+    """
+    per_day = Counter((action_time.astimezone(timezone.utc).date(), action_type) for _, action_type, action_time in actions)
+    per_user: Dict[int, list] = {}
+    for user_id, _, action_time in actions:
+        action_time = local_time(action_time)
+        totals = per_user.setdefault(user_id, [0, action_time])
+        totals[0] += 1
+        totals[1] = max(totals[1], action_time)
+    return (
+        [(day, action_type, count) for (day, action_type), count in per_day.items()],
+        [(user_id, count, last) for user_id, (count, last) in per_user.items()],
+    )
+
+class StorageBackend:
+    """Interface implemented by every storage engine behind Database."""
+
+    name = 'base'
+
+    async def connect(self, create_database: bool = False) -> None:
+        """Open connections; create_database also creates the database itself if missing."""
+        raise NotImplementedError
+
+    async def get_schema_version(self) -> int:
+        """Get the latest applied migration version, or 0 for an unversioned database."""
+        raise NotImplementedError
+
+    async def apply_migration(self, version: int, description: str, statements: List[str]) -> None:
+        """Run a migration's statements and record it in schema_version."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Close all connections."""
+        raise NotImplementedError
+
+    async def write_batch(self, users: List[tuple], actions: List[tuple], today: date) -> None:
+        """Upsert users, insert actions and update the rollups in one transaction."""
+        raise NotImplementedError
+
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        """Get a user's full record."""
+        raise NotImplementedError
+
+    async def update_phone_number(self, user_id: int, phone_number: str) -> None:
+        """Set a user's phone number."""
+        raise NotImplementedError
+
+    async def get_user_totals(self, user_id: int) -> Optional[Dict]:
+        """Get total_actions and last_action_time for a user from the rollup."""
+        raise NotImplementedError
+
+    async def get_bot_stats(self, today: date) -> Dict:
+        """Get total users, total actions, new users today and actions per type."""
+        raise NotImplementedError
+
+    async def get_file_id(self, source_key: str) -> Optional[str]:
+        """Get the Telegram file_id stored for a media source."""
+        raise NotImplementedError
+
+    async def save_file_id(self, source_key: str, media_type: str, file_id: str) -> None:
+        """Store or replace the Telegram file_id for a media source."""
+        raise NotImplementedError
+
+    async def delete_file_id(self, source_key: str) -> None:
+        """Forget the Telegram file_id for a media source."""
+        raise NotImplementedError
+
+    async def get_recognition(self, cache_key: str, now: datetime) -> Optional[Dict]:
+        """Get the unexpired recognition row for a key; its result is JSON, or NULL for "no music"."""
+        raise NotImplementedError
+
+    async def save_recognition(self, cache_key: str, result: Optional[str], expires_at: datetime) -> None:
+        """Store or replace the recognition result for a key."""
+        raise NotImplementedError
+
+    async def get_transcript(self, cache_key: str, now: datetime) -> Optional[Dict]:
+        """Get the transcript row for a key (language, transcript, segments JSON) and mark it used at now."""
+        raise NotImplementedError
+
+    async def save_transcript(self, cache_key: str, language: str, transcript: str, segments: str, now: datetime) -> None:
+        """Store or replace the transcript for a key."""
+        raise NotImplementedError
+
+    async def evict_transcripts(self, keep: int) -> int:
+        """Delete all but the `keep` most recently used transcripts; returns the number deleted."""
+        raise NotImplementedError
+
+    async def maintain_partitions(self, cutoff: Optional[date]) -> int:
+        """Add upcoming stats partitions, then archive and drop those ending before cutoff.
+
+        Returns the number of partitions dropped; backends without partitioning do nothing.
+        """
+        return 0
+
+    async def archive_stats_chunk(self, cutoff: datetime, limit: int) -> int:
+        """Roll up to limit stats rows older than cutoff into stats_archive and delete them."""
+        raise NotImplementedError
+
+    def get_metrics(self) -> Dict:
+        """Get connection usage and wait-time metrics."""
+        raise NotImplementedError
+
+class MySQLBackend(StorageBackend):
+    """MySQL storage on a blocking connection pool driven from a dedicated executor."""
+
+    name = 'mysql'
+
+    # Errors meaning a migration step was already applied to a pre-versioning schema
+    ALREADY_APPLIED = (
+        errorcode.ER_TABLE_EXISTS_ERROR,
+        errorcode.ER_DUP_FIELDNAME,
+        errorcode.ER_DUP_KEYNAME,
+        errorcode.ER_CANT_DROP_FIELD_OR_KEY,
+    )
+
+    def __init__(self):
+        # Check if running on Railway by looking for a Railway-specific env var
+        self.is_railway = 'RAILWAY_ENVIRONMENT' in os.environ
+
+        if self.is_railway:
+            logger.info("Railway environment detected. Using MYSQL_URL.")
+            # Railway provides a single connection string URL which is more reliable
+            db_url_str = os.getenv('MYSQL_URL')
+            if not db_url_str:
+                logger.critical("MYSQL_URL not found in Railway environment! Cannot connect to the database.")
+                raise ValueError("MYSQL_URL environment variable not found.")
+
+            url = urlparse(db_url_str)
+            self.db_host = url.hostname
+            self.db_user = url.username
+            self.db_password = url.password
+            self.db_name = url.path[1:]  # Remove leading '/'
+            self.db_port = url.port
+
+        else:
+            logger.info("Local environment detected. Using .env file variables.")
+            self.db_host = os.getenv('DB_HOST', 'localhost')
+            self.db_user = os.getenv('DB_USER', 'root')
+            self.db_password = os.getenv('DB_PASSWORD', '')
+            self.db_name = os.getenv('DB_NAME', 'vortex_bot')
+            self.db_port = os.getenv('DB_PORT', 3306)
+
+        # mysql-connector caps a pool at 32 connections
+        self.pool_size = max(1, min(int(os.getenv('DB_POOL_SIZE', 5)), 32))
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
+        # The driver is blocking, so every round-trip runs on a dedicated executor
+        # sized to the pool. The gate hands out pool slots to coroutines and
+        # lets them give up after pool_timeout instead of queueing forever.
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="db")
+        self._gate = ConnectionGate(self.pool_size, self.pool_timeout)
+        self.pool = None
+
+        # Months of empty stats partitions kept ready ahead of the current one
+        self.partitions_ahead = int(os.getenv('STATS_PARTITIONS_AHEAD', 2))
+
+    async def connect(self, create_database: bool = False) -> None:
+        await self._run(self._setup, create_database, gated=False)
+
+    def _create_database(self) -> None:
+        """Create the configured database if it does not exist (blocking)."""
+        conn = mysql.connector.connect(host=self.db_host, user=self.db_user, password=self.db_password, port=int(self.db_port))
+        cursor = conn.cursor()
+        logger.info(f"Ensuring local database '{self.db_name}' exists...")
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.db_name} CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+        cursor.close()
+        conn.close()
+        logger.info(f"Local database '{self.db_name}' is ready.")
+
+    def _create_pool(self) -> None:
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name="bot_pool",
+            pool_size=self.pool_size,
+            host=self.db_host,
+            database=self.db_name,
+            user=self.db_user,
+            password=self.db_password,
+            port=int(self.db_port),
+            charset='utf8mb4'
+        )
+
+    def _setup(self, create_database: bool) -> None:
+        """Create the connection pool, creating the database first when asked to (blocking)."""
+        if create_database:
+            self._create_database()
+
+        try:
+            self._create_pool()
+        except Error as e:
+            # A missing local database is created on first run. On Railway the
+            # database is already provisioned, so the error is real.
+            if e.errno != errorcode.ER_BAD_DB_ERROR or self.is_railway:
+                raise
+            self._create_database()
+            self._create_pool()
+        logger.info("Database connection pool created successfully.")
+
+    def _get_schema_version(self) -> int:
+        conn = self.pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(version) FROM schema_version")
+            return cursor.fetchone()[0] or 0
+        except Error as e:
+            if e.errno == errorcode.ER_NO_SUCH_TABLE:
+                return 0
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _apply_migration(self, version: int, description: str, statements: List[str]) -> None:
+        conn = self.pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255),
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """)
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except Error as e:
+                    if e.errno not in self.ALREADY_APPLIED:
+                        raise
+                    logger.info(f"Migration {version}: skipping step already present ({e.msg}).")
+            cursor.execute(
+                "INSERT IGNORE INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    async def get_schema_version(self) -> int:
+        return await self._run(self._get_schema_version)
+
+    async def apply_migration(self, version: int, description: str, statements: List[str]) -> None:
+        await self._run(self._apply_migration, version, description, statements)
+
+    async def _run(self, func: Callable, *args, gated: bool = True) -> Any:
+        """Run a blocking call on the DB executor once a pool slot is free."""
+        loop = asyncio.get_running_loop()
+        if gated:
+            await self._gate.acquire()
+
+        future = self._executor.submit(func, *args)
+        if gated:
+            # Release the slot when the blocking call really finishes, not when the
+            # awaiting coroutine is cancelled, so the pool can never be oversubscribed.
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._gate.release))
+
+        try:
+            return await asyncio.wrap_future(future)
+        except (OperationalError, InterfaceError, PoolError) as e:
+            raise TransientStorageError(str(e)) from e
+        except Error as e:
+            raise StorageError(str(e)) from e
+
+    def _execute(self, query: str, params: tuple = (), fetch: Optional[str] = None, dictionary: bool = False) -> Any:
+        """Execute a single statement on a pooled connection (blocking).
+
+        With fetch='one' the first row is returned, with fetch='all' every row,
+        otherwise the statement is committed and the affected row count is returned.
+        """
+        conn = self.pool.get_connection()
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            cursor.execute(query, params)
+            if fetch == 'one':
+                return cursor.fetchone()
+            if fetch == 'all':
+                return cursor.fetchall()
+            conn.commit()
+            return cursor.rowcount
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _write_batch(self, users: List[tuple], actions: List[tuple], today: date) -> None:
+        """Write buffered users and actions, and update the rollups, in a single transaction (blocking)."""
+        conn = self.pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            # Users go first so a batch never logs actions for a user that does not exist yet
+            if users:
+                # Count only the rows this insert created: a SELECT first would let two
+                # concurrent batches both see the same user as new
+                cursor.executemany("""
+                    INSERT IGNORE INTO users (user_id, first_name, last_name, username, language_code)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, users)
+                new_users = max(cursor.rowcount, 0)
+                cursor.executemany("""
+                    INSERT INTO users (user_id, first_name, last_name, username, language_code)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        first_name = VALUES(first_name),
+                        last_name = VALUES(last_name),
+                        username = VALUES(username),
+                        language_code = VALUES(language_code),
+                        last_active = NOW()
+                """, users)
+                if new_users:
+                    cursor.execute("""
+                        INSERT INTO daily_users (day, new_users) VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE new_users = new_users + VALUES(new_users)
+                    """, (today, new_users))
+            if actions:
+                cursor.executemany("""
+                    INSERT INTO stats (user_id, action_type, action_time)
+                    VALUES (%s, %s, %s)
+                """, [(user_id, action_type, local_time(t)) for user_id, action_type, t in actions])
+
+                per_day, per_user = aggregate_actions(actions)
+                cursor.executemany("""
+                    INSERT INTO daily_actions (day, action_type, actions) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE actions = actions + VALUES(actions)
+                """, per_day)
+                cursor.executemany("""
+                    INSERT INTO user_action_totals (user_id, total_actions, last_action_time) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        total_actions = total_actions + VALUES(total_actions),
+                        last_action_time = GREATEST(last_action_time, VALUES(last_action_time))
+                """, per_user)
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _maintain_partitions(self, cutoff: Optional[date], months_ahead: int) -> int:
+        """Split monthly partitions off pmax and drop expired ones (blocking)."""
+        conn = self.pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM INFORMATION_SCHEMA.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'stats' AND PARTITION_NAME IS NOT NULL
+                ORDER BY PARTITION_ORDINAL_POSITION
+            """)
+            rows = cursor.fetchall()
+            if not rows:
+                # Not partitioned (migration 6 not applied); the chunked job still prunes
+                return 0
+            partitions = [(name, int(bound)) for name, bound in rows if bound != 'MAXVALUE']
+
+            # Keep the current month and the next few in their own partitions, so pmax
+            # stays empty and later splits move no rows. The first split after
+            # migration 6 is the exception: it rewrites every row already in pmax.
+            existing = {name for name, _ in partitions}
+            missing = []
+            month = date.today().replace(day=1)
+            for _ in range(months_ahead + 1):
+                next_month = (month + timedelta(days=32)).replace(day=1)
+                name = f"p{month:%Y%m}"
+                if name not in existing:
+                    missing.append(f"PARTITION {name} VALUES LESS THAN (UNIX_TIMESTAMP('{next_month}'))")
+                month = next_month
+            if missing:
+                missing.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+                cursor.execute(f"ALTER TABLE stats REORGANIZE PARTITION pmax INTO ({', '.join(missing)})")
+                logger.info(f"Added {len(missing) - 1} monthly partitions to stats.")
+
+            if cutoff is None:
+                return 0
+            cursor.execute("SELECT UNIX_TIMESTAMP(%s)", (cutoff,))
+            cutoff_ts = int(cursor.fetchone()[0])
+            dropped = 0
+            for name, bound in partitions:
+                if bound > cutoff_ts:
+                    break
+                # DDL commits implicitly, so a crash between these two statements
+                # archives the partition twice on the next run. The archive only
+                # holds advisory per-day counts, so that is preferable to losing rows.
+                cursor.execute(f"""
+                    INSERT INTO stats_archive (day, user_id, action_type, actions)
+                    SELECT DATE(action_time), COALESCE(user_id, 0), COALESCE(action_type, ''), COUNT(*)
+                    FROM stats PARTITION ({name})
+                    GROUP BY DATE(action_time), COALESCE(user_id, 0), COALESCE(action_type, '')
+                    ON DUPLICATE KEY UPDATE actions = actions + VALUES(actions)
+                """)
+                conn.commit()
+                cursor.execute(f"ALTER TABLE stats DROP PARTITION {name}")
+                dropped += 1
+                logger.info(f"Archived and dropped stats partition {name}.")
+            return dropped
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _archive_stats_chunk(self, cutoff: datetime, limit: int) -> int:
+        """Archive and delete one chunk of old stats rows in a short transaction (blocking)."""
+        conn = self.pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM stats WHERE action_time < %s ORDER BY action_time LIMIT %s", (cutoff, limit))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return 0
+            placeholders = ", ".join(["%s"] * len(ids))
+            cursor.execute(f"""
+                INSERT INTO stats_archive (day, user_id, action_type, actions)
+                SELECT DATE(action_time), COALESCE(user_id, 0), COALESCE(action_type, ''), COUNT(*)
+                FROM stats WHERE id IN ({placeholders})
+                GROUP BY DATE(action_time), COALESCE(user_id, 0), COALESCE(action_type, '')
+                ON DUPLICATE KEY UPDATE actions = actions + VALUES(actions)
+            """, ids)
+            cursor.execute(f"DELETE FROM stats WHERE id IN ({placeholders})", ids)
+            conn.commit()
+            return len(ids)
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    async def maintain_partitions(self, cutoff: Optional[date]) -> int:
+        return await self._run(self._maintain_partitions, cutoff, self.partitions_ahead)
+
+    async def archive_stats_chunk(self, cutoff: datetime, limit: int) -> int:
+        return await self._run(self._archive_stats_chunk, cutoff, limit)
+
+    async def close(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def write_batch(self, users: List[tuple], actions: List[tuple], today: date) -> None:
+        await self._run(self._write_batch, users, actions, today)
+
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        return await self._run(self._execute, "SELECT * FROM users WHERE user_id = %s", (user_id,), 'one', True)
+
+    async def update_phone_number(self, user_id: int, phone_number: str) -> None:
+        await self._run(self._execute, "UPDATE users SET phone_number = %s WHERE user_id = %s", (phone_number, user_id))
+
+    async def get_user_totals(self, user_id: int) -> Optional[Dict]:
+        query = "SELECT total_actions, last_action_time FROM user_action_totals WHERE user_id = %s"
+        return await self._run(self._execute, query, (user_id,), 'one', True)
+
+    async def get_file_id(self, source_key: str) -> Optional[str]:
+        row = await self._run(self._execute, "SELECT file_id FROM telegram_files WHERE source_key = %s", (source_key,), 'one')
+        return row[0] if row else None
+
+    async def save_file_id(self, source_key: str, media_type: str, file_id: str) -> None:
+        await self._run(self._execute, """
+            INSERT INTO telegram_files (source_key, media_type, file_id) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE media_type = VALUES(media_type), file_id = VALUES(file_id), created_at = NOW()
+        """, (source_key, media_type, file_id))
+
+    async def delete_file_id(self, source_key: str) -> None:
+        await self._run(self._execute, "DELETE FROM telegram_files WHERE source_key = %s", (source_key,))
+
+    async def get_recognition(self, cache_key: str, now: datetime) -> Optional[Dict]:
+        query = "SELECT result, expires_at FROM recognitions WHERE cache_key = %s AND expires_at > %s"
+        return await self._run(self._execute, query, (cache_key, now), 'one', True)
+
+    async def save_recognition(self, cache_key: str, result: Optional[str], expires_at: datetime) -> None:
+        await self._run(self._execute, """
+            INSERT INTO recognitions (cache_key, result, expires_at) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE result = VALUES(result), expires_at = VALUES(expires_at), created_at = NOW()
+        """, (cache_key, result, expires_at))
+
+    async def get_transcript(self, cache_key: str, now: datetime) -> Optional[Dict]:
+        query = "SELECT language, transcript, segments FROM transcripts WHERE cache_key = %s"
+        row = await self._run(self._execute, query, (cache_key,), 'one', True)
+        if row:
+            await self._run(self._execute, "UPDATE transcripts SET last_used = %s WHERE cache_key = %s", (now, cache_key))
+        return row
+
+    async def save_transcript(self, cache_key: str, language: str, transcript: str, segments: str, now: datetime) -> None:
+        await self._run(self._execute, """
+            INSERT INTO transcripts (cache_key, language, transcript, segments, last_used) VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE language = VALUES(language), transcript = VALUES(transcript),
+                segments = VALUES(segments), last_used = VALUES(last_used), created_at = NOW()
+        """, (cache_key, language, transcript, segments, now))
+
+    async def evict_transcripts(self, keep: int) -> int:
+        query = "SELECT last_used FROM transcripts ORDER BY last_used DESC LIMIT 1 OFFSET %s"
+        row = await self._run(self._execute, query, (keep,), 'one')
+        if not row:
+            return 0
+        return await self._run(self._execute, "DELETE FROM transcripts WHERE last_used <= %s", (row[0],))
+
+    async def get_bot_stats(self, today: date) -> Dict:
+        query = '''
+            SELECT
+                (SELECT COALESCE(SUM(new_users), 0) FROM daily_users) as total_users,
+                (SELECT COALESCE(SUM(actions), 0) FROM daily_actions) as total_actions,
+                (SELECT COALESCE(SUM(new_users), 0) FROM daily_users WHERE day = %s) as new_today
+        '''
+        row = await self._run(self._execute, query, (today,), 'one', True)
+        by_type = await self._run(
+            self._execute,
+            "SELECT action_type, SUM(actions) as actions FROM daily_actions GROUP BY action_type",
+            (), 'all', True
+        )
+        stats = {key: int(value) for key, value in row.items()}
+        stats['actions_by_type'] = {r['action_type']: int(r['actions']) for r in by_type}
+        return stats
+
+    def get_metrics(self) -> Dict:
+        return ConnectionGate.combined_metrics(self._gate)
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite storage in WAL mode, for single-node deployments and tests.
+
+    One connection writes and one reads; WAL lets the reader run while a batch
+    is being committed. Every statement is a constant parameterised string, so
+    sqlite3's per-connection statement cache keeps them prepared.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self):
+        self.path = os.getenv('SQLITE_PATH', 'data/vortex_bot.db')
+        self.timeout = float(os.getenv('DB_POOL_TIMEOUT', 10))
+        self._writer = None
+        self._reader = None
+        self._write_gate = ConnectionGate(1, self.timeout)
+        self._read_gate = ConnectionGate(1, self.timeout)
+
+    async def _open(self, read_only: bool):
+        # isolation_level=None: we issue BEGIN/COMMIT ourselves
+        conn = await aiosqlite.connect(self.path, timeout=self.timeout, isolation_level=None, cached_statements=256)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        else:
+            await conn.execute("PRAGMA journal_mode = WAL")
+            await conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    async def connect(self, create_database: bool = False) -> None:
+        # The database file is always created on demand
+        if self.path != ':memory:':
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._writer = await self._open(read_only=False)
+            # An in-memory database is private to its connection, so reads share the writer
+            self._reader = self._writer if self.path == ':memory:' else await self._open(read_only=True)
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        logger.info(f"SQLite database ready at {self.path} (WAL mode).")
+
+    async def close(self) -> None:
+        if self._reader is not None and self._reader is not self._writer:
+            await self._reader.close()
+        if self._writer is not None:
+            await self._writer.close()
+        self._reader = self._writer = None
+
+    async def get_schema_version(self) -> int:
+        try:
+            row = await self._fetch_one("SELECT MAX(version) AS version FROM schema_version")
+        except StorageError as e:
+            if 'no such table' in str(e):
+                return 0
+            raise
+        return row['version'] or 0
+
+    async def apply_migration(self, version: int, description: str, statements: List[str]) -> None:
+        async with self._write_gate:
+            conn = self._writer
+            try:
+                # SQLite DDL is transactional, so a migration applies completely or not at all
+                await conn.execute("BEGIN IMMEDIATE")
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+                    )
+                """)
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute(
+                    "INSERT OR IGNORE INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+                await conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                await conn.execute("ROLLBACK")
+                raise self._translate(e) from e
+
+    @staticmethod
+    def _translate(e: sqlite3.Error) -> StorageError:
+        # "database is locked" and friends are OperationalErrors worth retrying
+        if isinstance(e, sqlite3.OperationalError):
+            return TransientStorageError(str(e))
+        return StorageError(str(e))
+
+    async def _fetch_one(self, query: str, params: tuple = ()) -> Optional[Dict]:
+        async with self._read_gate:
+            try:
+                async with self._reader.execute(query, params) as cursor:
+                    row = await cursor.fetchone()
+            except sqlite3.Error as e:
+                raise self._translate(e) from e
+        return dict(row) if row else None
+
+    async def _fetch_all(self, query: str, params: tuple = ()) -> List[Dict]:
+        async with self._read_gate:
+            try:
+                async with self._reader.execute(query, params) as cursor:
+                    rows = await cursor.fetchall()
+            except sqlite3.Error as e:
+                raise self._translate(e) from e
+        return [dict(row) for row in rows]
+
+    async def write_batch(self, users: List[tuple], actions: List[tuple], today: date) -> None:
+        async with self._write_gate:
+            conn = self._writer
+            try:
+                await conn.execute("BEGIN IMMEDIATE")
+                if users:
+                    # Count only the rows this insert created, as the MySQL backend does
+                    async with conn.executemany("""
+                        INSERT INTO users (user_id, first_name, last_name, username, language_code)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (user_id) DO NOTHING
+                    """, users) as cursor:
+                        new_users = max(cursor.rowcount, 0)
+                    await conn.executemany("""
+                        INSERT INTO users (user_id, first_name, last_name, username, language_code)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            first_name = excluded.first_name,
+                            last_name = excluded.last_name,
+                            username = excluded.username,
+                            language_code = excluded.language_code,
+                            last_active = datetime('now', 'localtime')
+                    """, users)
+                    if new_users:
+                        await conn.execute("""
+                            INSERT INTO daily_users (day, new_users) VALUES (?, ?)
+                            ON CONFLICT (day) DO UPDATE SET new_users = new_users + excluded.new_users
+                        """, (today.isoformat(), new_users))
+                if actions:
+                    await conn.executemany("""
+                        INSERT INTO stats (user_id, action_type, action_time) VALUES (?, ?, ?)
+                    """, [(user_id, action_type, self._timestamp(local_time(t))) for user_id, action_type, t in actions])
+
+                    per_day, per_user = aggregate_actions(actions)
+                    await conn.executemany("""
+                        INSERT INTO daily_actions (day, action_type, actions) VALUES (?, ?, ?)
+                        ON CONFLICT (day, action_type) DO UPDATE SET actions = actions + excluded.actions
+                    """, [(day.isoformat(), action_type, count) for day, action_type, count in per_day])
+                    await conn.executemany("""
+                        INSERT INTO user_action_totals (user_id, total_actions, last_action_time) VALUES (?, ?, ?)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            total_actions = total_actions + excluded.total_actions,
+                            last_action_time = MAX(last_action_time, excluded.last_action_time)
+                    """, [(user_id, count, self._timestamp(last)) for user_id, count, last in per_user])
+                await conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                await conn.execute("ROLLBACK")
+                raise self._translate(e) from e
+
+    async def archive_stats_chunk(self, cutoff: datetime, limit: int) -> int:
+        async with self._write_gate:
+            conn = self._writer
+            try:
+                await conn.execute("BEGIN IMMEDIATE")
+                async with conn.execute(
+                    "SELECT id FROM stats WHERE action_time < ? ORDER BY action_time LIMIT ?",
+                    (self._timestamp(cutoff), limit)
+                ) as cursor:
+                    ids = [row[0] for row in await cursor.fetchall()]
+                if ids:
+                    placeholders = ", ".join(["?"] * len(ids))
+                    await conn.execute(f"""
+                        INSERT INTO stats_archive (day, user_id, action_type, actions)
+                        SELECT DATE(action_time), COALESCE(user_id, 0), COALESCE(action_type, ''), COUNT(*)
+                        FROM stats WHERE id IN ({placeholders})
+                        GROUP BY DATE(action_time), COALESCE(user_id, 0), COALESCE(action_type, '')
+                        ON CONFLICT (day, user_id, action_type) DO UPDATE SET actions = actions + excluded.actions
+                    """, ids)
+                    await conn.execute(f"DELETE FROM stats WHERE id IN ({placeholders})", ids)
+                await conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                await conn.execute("ROLLBACK")
+                raise self._translate(e) from e
+        return len(ids)
+
+    @staticmethod
+    def _timestamp(value: datetime) -> str:
+        return value.isoformat(sep=' ', timespec='seconds')
+
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        return await self._fetch_one("SELECT * FROM users WHERE user_id = ?", (user_id,))
+
+    async def update_phone_number(self, user_id: int, phone_number: str) -> None:
+        await self._write("UPDATE users SET phone_number = ? WHERE user_id = ?", (phone_number, user_id))
+
+    async def get_user_totals(self, user_id: int) -> Optional[Dict]:
+        row = await self._fetch_one(
+            "SELECT total_actions, last_action_time FROM user_action_totals WHERE user_id = ?", (user_id,)
+        )
+        if row and row['last_action_time']:
+            row['last_action_time'] = datetime.fromisoformat(row['last_action_time'])
+        return row
+
+    async def _write(self, query: str, params: tuple = ()) -> None:
+        async with self._write_gate:
+            try:
+                await self._writer.execute(query, params)
+            except sqlite3.Error as e:
+                raise self._translate(e) from e
+
+    async def get_file_id(self, source_key: str) -> Optional[str]:
+        row = await self._fetch_one("SELECT file_id FROM telegram_files WHERE source_key = ?", (source_key,))
+        return row['file_id'] if row else None
+
+    async def save_file_id(self, source_key: str, media_type: str, file_id: str) -> None:
+        await self._write("""
+            INSERT INTO telegram_files (source_key, media_type, file_id) VALUES (?, ?, ?)
+            ON CONFLICT (source_key) DO UPDATE SET
+                media_type = excluded.media_type,
+                file_id = excluded.file_id,
+                created_at = datetime('now', 'localtime')
+        """, (source_key, media_type, file_id))
+
+    async def delete_file_id(self, source_key: str) -> None:
+        await self._write("DELETE FROM telegram_files WHERE source_key = ?", (source_key,))
+
+    async def get_recognition(self, cache_key: str, now: datetime) -> Optional[Dict]:
+        row = await self._fetch_one(
+            "SELECT result, expires_at FROM recognitions WHERE cache_key = ? AND expires_at > ?",
+            (cache_key, self._timestamp(now))
+        )
+        if row:
+            row['expires_at'] = datetime.fromisoformat(row['expires_at'])
+        return row
+
+    async def save_recognition(self, cache_key: str, result: Optional[str], expires_at: datetime) -> None:
+        await self._write("""
+            INSERT INTO recognitions (cache_key, result, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                result = excluded.result,
+                expires_at = excluded.expires_at,
+                created_at = datetime('now', 'localtime')
+        """, (cache_key, result, self._timestamp(expires_at)))
+
+    async def get_transcript(self, cache_key: str, now: datetime) -> Optional[Dict]:
+        row = await self._fetch_one(
+            "SELECT language, transcript, segments FROM transcripts WHERE cache_key = ?", (cache_key,)
+        )
+        if row:
+            await self._write("UPDATE transcripts SET last_used = ? WHERE cache_key = ?", (self._timestamp(now), cache_key))
+        return row
+
+    async def save_transcript(self, cache_key: str, language: str, transcript: str, segments: str, now: datetime) -> None:
+        await self._write("""
+            INSERT INTO transcripts (cache_key, language, transcript, segments, last_used) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                language = excluded.language,
+                transcript = excluded.transcript,
+                segments = excluded.segments,
+                last_used = excluded.last_used,
+                created_at = datetime('now', 'localtime')
+        """, (cache_key, language, transcript, segments, self._timestamp(now)))
+
+    async def evict_transcripts(self, keep: int) -> int:
+        row = await self._fetch_one("SELECT last_used FROM transcripts ORDER BY last_used DESC LIMIT 1 OFFSET ?", (keep,))
+        if not row:
+            return 0
+        async with self._write_gate:
+            try:
+                cursor = await self._writer.execute("DELETE FROM transcripts WHERE last_used <= ?", (row['last_used'],))
+            except sqlite3.Error as e:
+                raise self._translate(e) from e
+        return cursor.rowcount
+
+    async def get_bot_stats(self, today: date) -> Dict:
+        row = await self._fetch_one("""
+            SELECT
+                (SELECT COALESCE(SUM(new_users), 0) FROM daily_users) as total_users,
+                (SELECT COALESCE(SUM(actions), 0) FROM daily_actions) as total_actions,
+                (SELECT COALESCE(SUM(new_users), 0) FROM daily_users WHERE day = ?) as new_today
+        """, (today.isoformat(),))
+        by_type = await self._fetch_all(
+            "SELECT action_type, SUM(actions) as actions FROM daily_actions GROUP BY action_type"
+        )
+        row['actions_by_type'] = {r['action_type']: r['actions'] for r in by_type}
+        return row
+
+    def get_metrics(self) -> Dict:
+        return ConnectionGate.combined_metrics(self._write_gate, self._read_gate)
+
+BACKENDS = {
+    MySQLBackend.name: MySQLBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+def create_backend(name: str) -> StorageBackend:
+    """Instantiate the storage backend configured by DB_BACKEND."""
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown DB_BACKEND '{name}'. Expected one of: {', '.join(BACKENDS)}")
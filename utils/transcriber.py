@@ -1,80 +1,224 @@
 import logging
 import asyncio
 import os
-from typing import Optional, Dict
-from faster_whisper import WhisperModel
+from collections import defaultdict
+from typing import Callable, Optional, Dict, List, Tuple
 from pathlib import Path
 import tempfile
+from utils.singleflight import SingleFlight
+from utils.helpers import helpers
+from utils.media import SAMPLE_RATE, PreparedMedia
+from utils.transcript_cache import transcript_cache
+from utils.whisper_pool import WhisperPool, TranscriptionQueueFull, speech_chunks
 
 logger = logging.getLogger(__name__)
 
+def group_chunks(chunks: List[Dict], parts: int) -> List[List[Dict]]:
+    """Split consecutive speech chunks into up to `parts` runs with about the same amount of speech each."""
+    target = sum(chunk['end'] - chunk['start'] for chunk in chunks) / parts
+    groups = [[]]
+    speech = 0
+    for chunk in chunks:
+        if groups[-1] and len(groups) < parts and speech >= target * len(groups):
+            groups.append([])
+        groups[-1].append(chunk)
+        speech += chunk['end'] - chunk['start']
+    return groups
+
 class Transcriber:
     def __init__(self):
-        self.model = WhisperModel("base", device="cpu")  # Using CPU for better compatibility
+        # Models live in worker processes, loaded on first use or in the background by start_loading()
+        cores = os.cpu_count() or 1
+        processes = int(os.getenv('WHISPER_PROCESSES', 0)) or max(1, cores // 2)
+        self.config = {
+            'model_size': os.getenv('WHISPER_MODEL', 'base'),
+            'device': os.getenv('WHISPER_DEVICE', 'cpu'),  # CPU for better compatibility
+            'compute_type': os.getenv('WHISPER_COMPUTE_TYPE', 'int8'),
+            # 0: share the cores evenly between the worker processes
+            'cpu_threads': int(os.getenv('WHISPER_CPU_THREADS', 0)) or max(1, cores // processes),
+            'num_workers': int(os.getenv('WHISPER_NUM_WORKERS', 1)),
+            # Requests (or pause-split chunks of a long one) decoded together; 1 turns batching off
+            'batch_size': int(os.getenv('WHISPER_BATCH_SIZE', 8)),
+        }
+        self.beam_size = int(os.getenv('WHISPER_BEAM_SIZE', 5))
+        # Part of every transcript cache key: other settings give other text
+        self.settings_key = f"{self.config['model_size']}/{self.config['compute_type']}/beam{self.beam_size}"
+        self.preload = os.getenv('WHISPER_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+        self.pool = WhisperPool(
+            self.config,
+            processes=processes,
+            queue_limit=int(os.getenv('WHISPER_QUEUE_LIMIT', 20)),
+            max_wait=float(os.getenv('WHISPER_MAX_WAIT', 120)),
+            batch_wait=float(os.getenv('WHISPER_BATCH_WAIT_MS', 20)) / 1000
+        )
         self.temp_dir = Path(tempfile.gettempdir()) / "vortex_bot"
         self.temp_dir.mkdir(parents=True, exist_ok=True)
-        self.max_file_size = 25 * 1024 * 1024  # 25MB limit
-        self.max_duration = 180  # 3 minutes limit in seconds
+        self.flights = SingleFlight("transcription")
+        # Segment callbacks of everyone waiting on a transcription, by media key
+        self._listeners: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self.max_duration = float(os.getenv('TRANSCRIBE_MAX_DURATION', 1800))
+        # Longer audio is split at pauses and its parts transcribed in parallel, with timestamps
+        self.long_form_seconds = float(os.getenv('WHISPER_LONG_FORM_SECONDS', 60))
+
+    def start_loading(self) -> None:
+        """Start the worker processes loading and warming up their models, so the first request does not wait.
+
+        With WHISPER_PRELOAD=0 each worker loads its model when it gets its first job instead.
+        """
+        self.pool.start(preload=self.preload)
+
+    def estimate_wait(self, duration: float) -> float:
+        """Estimate in seconds how long a transcription of this length would queue."""
+        return self.pool.estimate_wait(duration)
+
+    def get_model_metrics(self) -> Dict:
+        """Get the model configuration with the worker pool's queue and memory metrics."""
+        return {
+            'model': self.config['model_size'],
+            'compute_type': self.config['compute_type'],
+            'cpu_threads': self.config['cpu_threads'],
+            'num_workers': self.config['num_workers'],
+            'batch_size': self.config['batch_size'],
+            **self.pool.stats(),
+        }
+
+    async def close(self) -> None:
+        """Stop the worker processes."""
+        await self.pool.close()
+
+    async def cached_transcript(self, cache_key: str) -> Optional[str]:
+        """Get the cached transcript for a media identity under the current model settings, if any."""
+        entry = await transcript_cache.get(f"{cache_key}|{self.settings_key}")
+        return entry['transcript'] if entry else None
+
+    async def transcribe_audio(self, media: PreparedMedia, on_segment: Optional[Callable[[str], None]] = None,
+                               cache_key: Optional[str] = None) -> Optional[str]:
+        """Transcribe decoded media to text, sharing the work with identical in-flight requests.
 
-    async def transcribe_audio(self, audio_path: Path) -> Optional[str]:
-        """Transcribe audio file to text using faster-whisper."""
+        on_segment is called with each segment's text as it is decoded; a caller
+        that joins a transcription already under way gets the segments from then on.
+        Segments come through a callback rather than an async iterator because one
+        coalesced transcription feeds every caller waiting on it, and each caller
+        still needs the full transcript as the return value; the handlers only
+        keep the text so far and edit their reply on their own schedule.
+        Transcripts are cached under cache_key (by default the audio's hash).
+        """
+        if on_segment:
+            self._listeners[media.key].append(on_segment)
         try:
-            # Check file size
-            if audio_path.stat().st_size > self.max_file_size:
-                logger.warning(f"File too large: {audio_path}")
-                return None
+            return await self.flights.do(media.key, lambda: self._transcribe_cached(media, cache_key))
+        finally:
+            if on_segment:
+                self._listeners[media.key].remove(on_segment)
+                if not self._listeners[media.key]:
+                    del self._listeners[media.key]
+
+    def _publish(self, key: str, text: str) -> None:
+        for listener in list(self._listeners.get(key, ())):
+            listener(text)
 
+    async def _transcribe_cached(self, media: PreparedMedia, cache_key: Optional[str]) -> Optional[str]:
+        if cache_key is None:
+            cache_key = f"audio:{await asyncio.to_thread(media.digest)}"
+        cache_key = f"{cache_key}|{self.settings_key}"
+        entry = await transcript_cache.get(cache_key)
+        if entry:
+            logger.info(f"Transcript cache hit for {media.label}")
+            return entry['transcript']
+
+        result = await self._transcribe_audio(media)
+        if result is None:
+            return None
+        transcript, language, segments = result
+        await transcript_cache.put(cache_key, language, transcript, segments)
+        return transcript
+
+    async def _transcribe_audio(self, media: PreparedMedia) -> Optional[Tuple[str, str, List[Tuple[float, str]]]]:
+        """Transcribe audio using faster-whisper; returns (text, language, (start, text) segments)."""
+        try:
             # Check duration
-            duration = await self._get_audio_duration(audio_path)
-            if duration > self.max_duration:
-                logger.warning(f"Audio too long: {audio_path}")
+            if media.duration > self.max_duration:
+                logger.warning(f"Audio too long: {media.label}")
                 return None
 
-            # Run synchronous transcription in a separate thread to avoid blocking the event loop
-            def sync_transcribe():
-                segments, info = self.model.transcribe(str(audio_path), beam_size=5)
-                logger.info(f"Detected language '{info.language}' with probability {info.language_probability}")
-                return segments
+            if media.duration > self.long_form_seconds:
+                return await self._transcribe_long(media)
 
-            segments = await asyncio.to_thread(sync_transcribe)
-            
-            # Join all segments
-            transcript = " ".join([segment.text for segment in segments])
+            segments = []
+
+            def on_segment(start: float, text: str) -> None:
+                segments.append((start, text.strip()))
+                self._publish(media.key, text)
+
+            # Runs in a worker process; queued behind shorter audio, or rejected when overloaded
+            transcript, language, probability = await self.pool.transcribe(
+                media.samples(), on_segment=on_segment, beam_size=self.beam_size
+            )
+            logger.info(f"Detected language '{language}' with probability {probability}")
             
-            logger.info(f"Transcribed {audio_path}: {len(transcript)} characters")
-            return transcript
+            logger.info(f"Transcribed {media.label}: {len(transcript)} characters")
+            return (transcript, language, segments) if transcript else None
 
+        except TranscriptionQueueFull:
+            raise
         except Exception as e:
             logger.error(f"Error transcribing audio: {str(e)}")
             return None
 
-    async def _get_audio_duration(self, audio_path: Path) -> float:
-        """Get audio duration in seconds using ffprobe."""
-        try:
-            command = [
-                'ffprobe',
-                '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                str(audio_path)
-            ]
-            process = await asyncio.create_subprocess_exec(
-                *command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
+    async def _transcribe_long(self, media: PreparedMedia) -> Optional[Tuple[str, str, List[Tuple[float, str]]]]:
+        """Transcribe long audio as parallel parts cut at pauses, stitched in order as timestamped lines.
 
-            if process.returncode != 0:
-                logger.error(f"ffprobe failed for {audio_path}. Stderr: {stderr.decode()}")
-                return 0.0
+        Voice activity detection runs once here; silence is dropped and each
+        worker gets a run of speech chunks to decode in batches. Segments are
+        published in order: those of a later part are held back until the
+        parts before it are done.
+        """
+        samples = media.samples()
+        chunks = await asyncio.to_thread(speech_chunks, samples)
+        if not chunks:
+            logger.info(f"No speech found in {media.label}")
+            return None
 
-            duration = float(stdout.decode().strip())
-            return duration
-            
-        except Exception as e:
-            logger.error(f"Error getting audio duration: {e}")
-            return 0.0
+        parts = []
+        offsets = []
+        for group in group_chunks(chunks, self.pool.processes):
+            start, end = group[0]['start'], group[-1]['end']
+            clips = [{'start': chunk['start'] - start, 'end': chunk['end'] - start} for chunk in group]
+            parts.append((samples[start:end], {'beam_size': self.beam_size, 'clip_timestamps': clips}))
+            offsets.append(start / SAMPLE_RATE)
+
+        segments = [[] for _ in parts]
+        lines = [[] for _ in parts]
+        current = 0
+
+        def on_segment(part: int, start: float, text: str) -> None:
+            segments[part].append((offsets[part] + start, text.strip()))
+            line = f"[{helpers.format_duration(offsets[part] + start)}] {text.strip()}"
+            lines[part].append(line)
+            if part == current:
+                self._publish(media.key, "\n" + line)
+
+        futures = self.pool.submit(parts, on_segment)
+        languages = []
+        try:
+            for part, future in enumerate(futures):
+                _, language, probability = await future
+                if language:
+                    languages.append(language)
+                logger.info(f"Part {part + 1}/{len(parts)} of {media.label}: language '{language}' ({probability:.2f})")
+                current = part + 1
+                for line in lines[current] if current < len(parts) else ():
+                    self._publish(media.key, "\n" + line)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        transcript = "\n".join(line for part_lines in lines for line in part_lines)
+        logger.info(f"Transcribed {media.label} in {len(parts)} parallel parts: {len(transcript)} characters")
+        if not transcript:
+            return None
+        return transcript, max(languages, key=languages.count), [segment for part in segments for segment in part]
 
     async def cleanup(self) -> None:
         """Cleanup temporary files."""
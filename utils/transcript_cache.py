@@ -0,0 +1,63 @@
+import os
+import json
+import logging
+from typing import Optional, Dict, List, Tuple
+from utils.cache import LRUCache
+from utils.database import db
+
+logger = logging.getLogger(__name__)
+
+class TranscriptCache:
+    """Remembers transcripts, so media forwarded again is not run through Whisper again.
+
+    Keys are the media identity ("tg:<file_unique_id>" or "audio:<sha256>") plus
+    the model settings, since another model or beam size gives another text.
+    Entries are kept in the database, bounded to TRANSCRIPT_CACHE_MAX_ENTRIES
+    by evicting the least recently used, with an in-process LRU in front of it.
+    """
+
+    def __init__(self):
+        self.max_entries = int(os.getenv('TRANSCRIPT_CACHE_MAX_ENTRIES', 50000))
+        self._transcripts = LRUCache(maxsize=int(os.getenv('TRANSCRIPT_CACHE_SIZE', 500)))
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Get {'language', 'transcript', 'segments'} for a key, or None."""
+        entry = self._transcripts.get(key)
+        if entry is None:
+            row = await db.get_transcript(key)
+            if row is None:
+                self.misses += 1
+                return None
+            entry = {
+                'language': row['language'],
+                'transcript': row['transcript'],
+                'segments': json.loads(row['segments']),
+            }
+            self._transcripts.set(key, entry)
+        self.hits += 1
+        return entry
+
+    async def put(self, key: str, language: str, transcript: str, segments: List[Tuple[float, str]]) -> None:
+        """Remember a transcript with its detected language and (start, text) segments."""
+        if self.max_entries <= 0:
+            return
+        entry = {'language': language, 'transcript': transcript, 'segments': [list(segment) for segment in segments]}
+        self._transcripts.set(key, entry)
+        await db.save_transcript(key, language, transcript, json.dumps(entry['segments'], ensure_ascii=False))
+        self.evicted += await db.evict_transcripts(self.max_entries)
+
+    def stats(self) -> Dict:
+        """Get hit, miss and eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+# Create a singleton instance
+transcript_cache = TranscriptCache()
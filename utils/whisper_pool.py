@@ -0,0 +1,416 @@
+import os
+import time
+import asyncio
+import logging
+import bisect
+import itertools
+import multiprocessing
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.vad import VadOptions, get_speech_timestamps, merge_segments
+from utils.media import SAMPLE_RATE
+from utils.scheduler import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# Whisper's window: batched chunks are at most this long
+CHUNK_SECONDS = 30
+# Speech is cut at pauses of 160 ms or more into chunks of at most CHUNK_SECONDS
+VAD_OPTIONS = VadOptions(max_speech_duration_s=CHUNK_SECONDS, min_silence_duration_ms=160)
+
+class TranscriptionQueueFull(QueueFullError):
+    """The transcription queue is full or too slow; the request was rejected without waiting."""
+
+    def __init__(self, message: str, estimated_wait: float):
+        super().__init__(message)
+        self.estimated_wait = estimated_wait
+
+def _rss_bytes() -> int:
+    """Resident memory of this process, or 0 where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def load_model(config: Dict) -> Tuple[WhisperModel, Dict]:
+    """Load and warm up a Whisper model; returns it with load time, warm-up time and resident memory."""
+    started = time.monotonic()
+    model = WhisperModel(
+        config['model_size'],
+        device=config['device'],
+        compute_type=config['compute_type'],
+        cpu_threads=config['cpu_threads'],
+        num_workers=config['num_workers']
+    )
+    loaded = time.monotonic()
+
+    # One second of silence runs every stage once, so the first real request is not the slow one
+    segments, _ = model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), beam_size=1, language='en')
+    list(segments)
+    warmed = time.monotonic()
+
+    return model, {
+        'load_seconds': loaded - started,
+        'warmup_seconds': warmed - loaded,
+        'rss_bytes': _rss_bytes(),
+    }
+
+def speech_chunks(samples: np.ndarray, vad_options: VadOptions = VAD_OPTIONS) -> List[Dict]:
+    """Split audio at pauses into speech chunks of at most 30 s, as sample ranges; silence is left out."""
+    chunks = merge_segments(get_speech_timestamps(samples, vad_options), vad_options)
+    return [{'start': chunk['start'], 'end': chunk['end']} for chunk in chunks]
+
+def transcribe_batch(model: WhisperModel, batched: BatchedInferencePipeline, jobs: List[Tuple[np.ndarray, Dict]],
+                     batch_size: int, emit: Callable[[int, float, str], None]) -> List[Tuple[str, str, float]]:
+    """Transcribe several requests together; returns (text, language, probability) for each.
+
+    emit(index, start, text) is called with each segment as soon as it is
+    decoded, start being seconds into that request's audio. A lone short
+    request is decoded directly, as before. Otherwise each request's language
+    is detected on its own audio (unless it passes one), and the requests of
+    each language are split at pauses (or at the clip_timestamps they bring,
+    as sample ranges) and go through the batched pipeline together, decoded
+    in batches of batch_size.
+    """
+    if len(jobs) == 1 and len(jobs[0][0]) <= CHUNK_SECONDS * SAMPLE_RATE and 'clip_timestamps' not in jobs[0][1]:
+        samples, options = jobs[0]
+        segments, info = model.transcribe(samples, **options)
+        texts = []
+        for segment in segments:
+            emit(0, segment.start, segment.text)
+            texts.append(segment.text)
+        return [(" ".join(texts), info.language, info.language_probability)]
+
+    clips = []
+    languages = []
+    for samples, options in jobs:
+        if 'clip_timestamps' in options:
+            job_clips = [{'start': clip['start'], 'end': clip['end']} for clip in options['clip_timestamps']]
+        else:
+            job_clips = speech_chunks(samples)
+        clips.append(job_clips)
+        if not job_clips:
+            languages.append(("", 0.0))
+        elif options.get('language'):
+            languages.append((options['language'], 1.0))
+        else:
+            # Detected on this request's own speech; chunks of other requests may be in another language
+            speech = np.concatenate([samples[clip['start']:clip['end']] for clip in job_clips])
+            language, probability, _ = model.detect_language(speech)
+            languages.append((language, probability))
+
+    texts = [[] for _ in jobs]
+    by_language: Dict[str, List[int]] = {}
+    for index, (language, _) in enumerate(languages):
+        if language:
+            by_language.setdefault(language, []).append(index)
+    for language, indexes in by_language.items():
+        group_clips = []
+        starts = []
+        offset = 0
+        for index in indexes:
+            group_clips += [{'start': clip['start'] + offset, 'end': clip['end'] + offset} for clip in clips[index]]
+            starts.append(offset)
+            offset += len(jobs[index][0])
+
+        audio = np.concatenate([jobs[index][0] for index in indexes])
+        options = {key: value for key, value in jobs[indexes[0]][1].items() if key not in ('clip_timestamps', 'language')}
+        segments, _ = batched.transcribe(
+            audio, clip_timestamps=group_clips, batch_size=batch_size, language=language, **options
+        )
+        for segment in segments:
+            # A segment belongs to the request its midpoint falls in
+            owner = bisect.bisect_right(starts, (segment.start + segment.end) / 2 * SAMPLE_RATE) - 1
+            emit(indexes[owner], segment.start - starts[owner] / SAMPLE_RATE, segment.text)
+            texts[indexes[owner]].append(segment.text)
+    return [(" ".join(text), language, probability) for text, (language, probability) in zip(texts, languages)]
+
+def _worker_main(conn, config: Dict) -> None:
+    """Worker process: load a model, then transcribe batches of jobs from the pipe until told to stop."""
+    try:
+        model, metrics = load_model(config)
+    except Exception as e:
+        conn.send(('failed', repr(e)))
+        return
+    batched = BatchedInferencePipeline(model)
+    conn.send(('ready', metrics))
+
+    while True:
+        try:
+            jobs = conn.recv()
+        except EOFError:
+            return
+        if jobs is None:
+            return
+        try:
+            emit = lambda index, start, text: conn.send(('segment', (index, start, text)))
+            conn.send(('ok', transcribe_batch(model, batched, jobs, config['batch_size'], emit)))
+        except Exception as e:
+            conn.send(('error', repr(e)))
+
+class _Job:
+    __slots__ = ('samples', 'duration', 'options', 'future', 'on_segment', 'enqueued')
+
+    def __init__(self, samples: np.ndarray, duration: float, options: Dict, future: asyncio.Future,
+                 on_segment: Optional[Callable[[float, str], None]]):
+        self.samples = samples
+        self.duration = duration
+        self.options = options
+        self.future = future
+        self.on_segment = on_segment
+        self.enqueued = time.monotonic()
+
+class WhisperPool:
+    """Transcribes on a pool of worker processes, each holding its own model.
+
+    Each worker takes the next job plus whatever else is queued within
+    batch_wait seconds, up to batch_size jobs, and transcribes them as one
+    batch. Jobs wait in a bounded priority queue ordered by arrival time plus audio
+    length, so a short voice note goes ahead of a long video that arrived less
+    than the video's length earlier, and nothing waits forever. A job is
+    rejected with TranscriptionQueueFull when queue_limit jobs are waiting or
+    its estimated wait exceeds max_wait seconds.
+    """
+
+    def __init__(self, config: Dict, processes: int, queue_limit: int, max_wait: float, batch_wait: float = 0.0):
+        self.config = config
+        self.processes = max(1, processes)
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.batch_size = max(1, config.get('batch_size', 1))
+        self.batch_wait = batch_wait
+        self._context = multiprocessing.get_context('spawn')
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._workers: List[asyncio.Task] = []
+        self._children: Dict[int, Any] = {}
+        self.worker_metrics: Dict[int, Dict] = {}
+        # Seconds of processing per second of audio, smoothed; refined as jobs complete
+        self.realtime_factor = 0.5
+        self.queued_audio = 0.0
+        self.running_audio = 0.0
+        self.running = 0
+        self.started = 0
+        self.batches = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self, preload: bool = False) -> None:
+        """Start the dispatchers; with preload, worker processes load their models right away."""
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._run_worker(i, preload)) for i in range(self.processes)]
+
+    def estimate_wait(self, duration: float) -> float:
+        """Estimate how long a new job with this much audio would wait before starting, in seconds."""
+        key = time.monotonic() + duration
+        ahead = sum(job.duration for item_key, _, job in self._queue._queue if item_key <= key)
+        return (ahead + self.running_audio / 2) * self.realtime_factor / self.processes
+
+    def _check_room(self, count: int, duration: float) -> None:
+        """Reject a request of `count` jobs, the longest `duration` seconds, when the queue cannot take it."""
+        estimated = self.estimate_wait(duration)
+        if self._queue.qsize() + count > self.queue_limit or estimated > self.max_wait:
+            self.rejected += 1
+            raise TranscriptionQueueFull(
+                f"Transcription queue is full ({self._queue.qsize()} waiting, ~{estimated:.0f}s)", estimated
+            )
+
+    def _admit(self, samples: np.ndarray, duration: float, options: Dict,
+               on_segment: Optional[Callable[[float, str], None]] = None) -> _Job:
+        self._check_room(1, duration)
+        return self._enqueue(samples, duration, options, on_segment)
+
+    def _enqueue(self, samples: np.ndarray, duration: float, options: Dict,
+                 on_segment: Optional[Callable[[float, str], None]]) -> _Job:
+        job = _Job(samples, duration, options, asyncio.get_running_loop().create_future(), on_segment)
+        self._queue.put_nowait((job.enqueued + duration, next(self._sequence), job))
+        self.queued_audio += duration
+        return job
+
+    def submit(self, parts: List[Tuple[np.ndarray, Dict]],
+               on_segment: Optional[Callable[[int, float, str], None]] = None) -> List[asyncio.Future]:
+        """Queue parts of one request as separate jobs, so idle workers take them in parallel.
+
+        Returns a future per part resolving to (text, language, language
+        probability). The parts are admitted together, or rejected together
+        with TranscriptionQueueFull. Since they run side by side, the wait is
+        estimated once, for the longest part, rather than each part queueing
+        behind its siblings. on_segment(part, start, text) is called on the
+        event loop with each segment as a worker decodes it.
+        """
+        self.start()
+        durations = [len(samples) / SAMPLE_RATE for samples, _ in parts]
+        self._check_room(len(parts), max(durations))
+        jobs = []
+        for index, ((samples, options), duration) in enumerate(zip(parts, durations)):
+            callback = partial(on_segment, index) if on_segment else None
+            jobs.append(self._enqueue(samples, duration, options, callback))
+        return [job.future for job in jobs]
+
+    async def transcribe(self, samples: np.ndarray, on_segment: Optional[Callable[[float, str], None]] = None,
+                         **options) -> Tuple[str, str, float]:
+        """Transcribe float32 16 kHz samples; returns (text, language, language probability).
+
+        on_segment, if given, is called on the event loop with each segment's start and text as the worker decodes it.
+        """
+        callback = (lambda part, start, text: on_segment(start, text)) if on_segment else None
+        future, = self.submit([(samples, options)], callback)
+        return await future
+
+    async def _spawn(self, index: int) -> Optional[Tuple[Any, Any]]:
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child, self.config), name=f"whisper-{index}", daemon=True)
+        process.start()
+        child.close()
+        self._children[index] = process
+        try:
+            status, payload = await asyncio.to_thread(parent.recv)
+        except (EOFError, OSError) as e:
+            status, payload = 'failed', repr(e)
+        if status != 'ready':
+            logger.error(f"Whisper worker {index} could not load the model: {payload}")
+            process.join(timeout=5)
+            parent.close()
+            return None
+        self.worker_metrics[index] = payload
+        logger.info(
+            f"Whisper worker {index} loaded '{self.config['model_size']}' ({self.config['compute_type']}) "
+            f"in {payload['load_seconds']:.1f}s, warm-up {payload['warmup_seconds']:.1f}s, "
+            f"{payload['rss_bytes'] / 1048576:.0f} MB resident"
+        )
+        return process, parent
+
+    async def _next_batch(self, first: _Job) -> List[_Job]:
+        """Gather jobs queued within batch_wait of the first one, up to batch_size jobs."""
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            if self._queue.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    _, _, job = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                _, _, job = self._queue.get_nowait()
+            self.queued_audio -= job.duration
+            if not job.future.done():
+                batch.append(job)
+        return batch
+
+    @staticmethod
+    def _deliver_segment(job: _Job, start: float, text: str) -> None:
+        if job.on_segment is None or job.future.done():
+            return
+        try:
+            job.on_segment(start, text)
+        except Exception as e:
+            logger.error(f"Error delivering transcript segment: {e}")
+
+    async def _run_worker(self, index: int, preload: bool) -> None:
+        worker = await self._spawn(index) if preload else None
+        while True:
+            _, _, job = await self._queue.get()
+            self.queued_audio -= job.duration
+            if job.future.done():
+                # The caller went away while the job was queued
+                continue
+            batch = await self._next_batch(job)
+
+            if worker is None:
+                worker = await self._spawn(index)
+                if worker is None:
+                    self.failed += len(batch)
+                    for job in batch:
+                        if not job.future.done():
+                            job.future.set_exception(RuntimeError("Whisper model could not be loaded"))
+                    continue
+            process, conn = worker
+
+            audio = sum(job.duration for job in batch)
+            now = time.monotonic()
+            for job in batch:
+                waited = now - job.enqueued
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            self.started += len(batch)
+            self.batches += 1
+            self.running += len(batch)
+            self.running_audio += audio
+            try:
+                await asyncio.to_thread(conn.send, [(job.samples, job.options) for job in batch])
+                while True:
+                    status, payload = await asyncio.to_thread(conn.recv)
+                    if status != 'segment':
+                        break
+                    position, start, text = payload
+                    self._deliver_segment(batch[position], start, text)
+            except (EOFError, OSError) as e:
+                logger.error(f"Whisper worker {index} died: {e!r}; restarting it")
+                conn.close()
+                process.join(timeout=5)
+                worker = None
+                status, payload = 'error', f"worker died: {e!r}"
+            finally:
+                self.running -= len(batch)
+                self.running_audio -= audio
+
+            if status == 'ok':
+                self.completed += len(batch)
+                if audio > 0:
+                    factor = (time.monotonic() - now) / audio
+                    self.realtime_factor = 0.8 * self.realtime_factor + 0.2 * factor
+                for job, result in zip(batch, payload):
+                    if not job.future.done():
+                        job.future.set_result(result)
+            else:
+                self.failed += len(batch)
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(RuntimeError(f"Transcription failed: {payload}"))
+
+    async def close(self) -> None:
+        """Stop the dispatchers and worker processes."""
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        for process in self._children.values():
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=5)
+        self._children.clear()
+
+    def stats(self) -> Dict:
+        """Get queue, throughput and per-worker model metrics."""
+        return {
+            'processes': self.processes,
+            'ready': len(self.worker_metrics),
+            'running': self.running,
+            'waiting': self._queue.qsize(),
+            'queue_limit': self.queue_limit,
+            'queued_audio': self.queued_audio,
+            'completed': self.completed,
+            'batch_avg': self.started / self.batches if self.batches else 0.0,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'realtime_factor': self.realtime_factor,
+            'wait_avg_ms': (self.wait_total / self.started * 1000) if self.started else 0.0,
+            'wait_max_ms': self.wait_max * 1000,
+            'rss_bytes': sum(m['rss_bytes'] for m in self.worker_metrics.values()),
+            'load_seconds': max((m['load_seconds'] for m in self.worker_metrics.values()), default=0.0),
+            'warmup_seconds': max((m['warmup_seconds'] for m in self.worker_metrics.values()), default=0.0),
+        }